@@ -0,0 +1,181 @@
+'''Measure throughput, latency, memory and CPU of the client APIs.
+
+Starts the stub server with the requested latency distribution, failure
+rates, load indicator and result size, then runs Pipeline, align_texts and
+direct run_pipeline calls (from a thread pool) at every concurrency level.
+Every run happens in a fresh child process, so peak RSS and CPU time are
+those of the client alone (the server runs in this process).
+
+align_texts runs with max_workers set to the concurrency level and collects
+failed alignments instead of stopping at the first one.
+
+usage: python benchmarks/bench_pipeline.py [--jobs 200] [--concurrency 1,4,16]
+       [--apis pipeline,align_texts,run_pipeline] [--latency 0.05]
+       [--distribution lognormal] [--failure-rate 0.05] [--error-rate 0.01]
+       [--load 1] [--result-intervals 1000]
+'''
+import argparse
+import contextlib
+import io
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from stub_server import StubConfig, start_server
+from webmaus import retry
+from webmaus import simple_align
+from webmaus.backends import BASBackend
+from webmaus.connector import run_pipeline
+from webmaus.pipeline import Pipeline
+
+
+APIS = ('pipeline', 'align_texts', 'run_pipeline')
+
+
+class TimedPipeline(Pipeline):
+    '''Pipeline recording the latency of every job.'''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def _run_single(self, *args, **kwargs):
+        start = time.perf_counter()
+        try: return super()._run_single(*args, **kwargs)
+        finally: self.latencies.append(time.perf_counter() - start)
+
+
+def run_child(api, concurrency, n_jobs, url):
+    '''Run one measurement; returns a dict of results.'''
+    directory = Path(tempfile.mkdtemp(prefix = 'webmaus-bench-'))
+    audio_filename = str(directory / 'clip.wav')
+    sf.write(audio_filename, np.zeros(8000), 16000, subtype = 'PCM_16')
+    output_directory = directory / 'out'
+    output_directory.mkdir()
+    policy = retry.RetryPolicy(max_attempts = 5, base_delay = 0.01,
+        max_delay = 0.2)
+    # injected failures must not pause the whole run
+    retry.get_circuit_breaker().failure_threshold = float('inf')
+    backend = BASBackend(url, url.replace('runPipeline', 'getLoadIndicator'))
+    latencies = []
+    errors = 0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if api == 'pipeline':
+            files = [{'audio_filename': audio_filename, 'text': 'test',
+                'output_directory': str(output_directory / str(i))}
+                for i in range(n_jobs)]
+            pipeline = TimedPipeline(files, output_directory, 'nld-NL',
+                overwrite = True, max_workers = concurrency,
+                retry_policy = policy, backend = backend)
+            pipeline._run()
+            latencies = pipeline.latencies
+            errors = len(pipeline.errors)
+        elif api == 'align_texts':
+            align_text = simple_align.align_text
+            def timed_align_text(**kwargs):
+                t = time.perf_counter()
+                try: return align_text(**kwargs)
+                finally: latencies.append(time.perf_counter() - t)
+            simple_align.align_text = timed_align_text
+            outputs = [output_directory / f'{i}.TextGrid'
+                for i in range(n_jobs)]
+            results = simple_align.align_texts(['test'] * n_jobs,
+                [audio_filename] * n_jobs, outputs, 'nld-NL',
+                backend = backend, max_workers = concurrency,
+                fail_fast = False)
+            errors = sum(isinstance(r, Exception) for r in results)
+        else:
+            def job(_):
+                t = time.perf_counter()
+                response = run_pipeline(audio_filename, None, 'nld-NL',
+                    text = 'test', url = url, retry_policy = policy)
+                ok = response is not None and response.success and \
+                    response.download() is not None
+                latencies.append(time.perf_counter() - t)
+                return ok
+            with ThreadPoolExecutor(concurrency) as executor:
+                errors = sum(not ok for ok in executor.map(job,
+                    range(n_jobs)))
+    elapsed = time.perf_counter() - start
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = end_usage.ru_utime - usage.ru_utime
+    cpu += end_usage.ru_stime - usage.ru_stime
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) \
+        if latencies else (0, 0, 0)
+    return {'api': api, 'concurrency': concurrency, 'jobs': len(latencies),
+        'errors': errors, 'seconds': elapsed,
+        'jobs_per_second': len(latencies) / elapsed,
+        'p50': p50, 'p95': p95, 'p99': p99,
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': end_usage.ru_maxrss / 1024,
+        'cpu_ms_per_job': 1000 * cpu / max(1, len(latencies))}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('--jobs', type = int, default = 200)
+    parser.add_argument('--concurrency', default = '1,4,16')
+    parser.add_argument('--apis', default = ','.join(APIS))
+    parser.add_argument('--latency', type = float, default = 0.05)
+    parser.add_argument('--distribution', default = 'lognormal',
+        choices = ['fixed', 'uniform', 'exponential', 'lognormal'])
+    parser.add_argument('--download-latency', type = float, default = 0.0)
+    parser.add_argument('--failure-rate', type = float, default = 0.0)
+    parser.add_argument('--error-rate', type = float, default = 0.0)
+    parser.add_argument('--load', type = int, default = 0)
+    parser.add_argument('--result-intervals', type = int, default = 1000)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--child', nargs = 4, help = argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        api, concurrency, n_jobs, url = args.child
+        print(json.dumps(run_child(api, int(concurrency), int(n_jobs), url)))
+        return
+    config = StubConfig(latency = args.latency,
+        latency_distribution = args.distribution,
+        download_latency = args.download_latency,
+        failure_rate = args.failure_rate, error_rate = args.error_rate,
+        load = args.load, result_intervals = args.result_intervals,
+        seed = args.seed)
+    server, url = start_server(config = config)
+    m = f'jobs: {args.jobs}, latency: {args.latency} s '
+    m += f'({args.distribution}), failure rate: {args.failure_rate}, '
+    m += f'error rate: {args.error_rate}, load: {args.load}, '
+    m += f'result: {len(config.result) / 1024:.0f} KiB'
+    print(m)
+    print(f'{"api":<13}{"conc":>5}{"jobs/s":>9}{"p50 ms":>9}{"p95 ms":>9}'
+        f'{"p99 ms":>9}{"rss MiB":>9}{"cpu ms/job":>11}{"errors":>8}')
+    try:
+        for api in args.apis.split(','):
+            for concurrency in map(int, args.concurrency.split(',')):
+                child = subprocess.run([sys.executable, __file__, '--child',
+                    api, str(concurrency), str(args.jobs), url],
+                    capture_output = True, text = True, check = True)
+                r = json.loads(child.stdout.strip().splitlines()[-1])
+                print(f'{api:<13}{concurrency:>5}'
+                    f'{r["jobs_per_second"]:>9.1f}{r["p50"] * 1000:>9.1f}'
+                    f'{r["p95"] * 1000:>9.1f}{r["p99"] * 1000:>9.1f}'
+                    f'{r["peak_rss_mb"]:>9.1f}{r["cpu_ms_per_job"]:>11.2f}'
+                    f'{r["errors"]:>8}')
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
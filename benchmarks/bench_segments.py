@@ -0,0 +1,65 @@
+'''Compare per-segment CPU time and peak memory of segment extraction.
+
+decode: audio.load_audio + audio.audio_to_buffer (float32 round trip)
+pcm:    audio.load_pcm_segment (byte range copy behind a new header)
+
+usage: python benchmarks/bench_segments.py [n_segments] [segment_seconds]
+'''
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from webmaus import audio
+
+
+def make_recording(filename, seconds = 600, sample_rate = 48000):
+    signal = np.random.default_rng(0).uniform(-0.5, 0.5,
+        (seconds * sample_rate, 2))
+    sf.write(filename, signal, sample_rate, subtype = 'PCM_16')
+
+
+def decode(filename, start_time, end_time):
+    signal, sample_rate = audio.load_audio(filename, start_time, end_time)
+    return audio.audio_to_buffer(signal, sample_rate)
+
+
+def measure(func, filename, segments):
+    tracemalloc.start()
+    start = time.process_time()
+    for start_time, end_time in segments:
+        func(filename, start_time, end_time)
+    cpu = (time.process_time() - start) / len(segments)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    length = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = str(Path(tmpdir) / 'recording.wav')
+        make_recording(filename)
+        starts = np.random.default_rng(1).uniform(0, 590, n)
+        segments = [(s, s + length) for s in starts]
+        results = {'decode': measure(decode, filename, segments),
+            'pcm': measure(audio.load_pcm_segment, filename, segments)}
+    print(f'{n} segments of {length} s from 48 kHz stereo 16 bit PCM')
+    for name, (cpu, peak) in results.items():
+        print(f'{name:7s} cpu/segment: {cpu * 1000:7.3f} ms   '
+            f'peak memory: {peak / 1024 ** 2:7.2f} MiB')
+    decode_cpu, decode_peak = results['decode']
+    pcm_cpu, pcm_peak = results['pcm']
+    print(f'cpu speedup: {decode_cpu / pcm_cpu:.1f}x   '
+        f'memory ratio: {decode_peak / pcm_peak:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
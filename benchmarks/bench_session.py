@@ -0,0 +1,52 @@
+'''Compare requests per second with and without a pooled keep-alive session.
+
+Runs run_pipeline (upload + download) against the local stub server.
+Without pooling every call opens fresh connections, which is what
+module level requests.post / requests.get did before.
+
+usage: python benchmarks/bench_session.py [n_requests]
+'''
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from stub_server import start_server
+from webmaus import session as session_module
+from webmaus.connector import run_pipeline
+
+
+
+def run(url, n, make_session_per_call):
+    shared = session_module.make_session()
+    start = time.perf_counter()
+    for _ in range(n):
+        session = shared
+        if make_session_per_call: session = session_module.make_session()
+        response = run_pipeline(__file__, None, 'nld-NL', text = 'test',
+            session = session, url = url)
+        response.download()
+        if make_session_per_call: session.close()
+    elapsed = time.perf_counter() - start
+    shared.close()
+    return n / elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    server, url = start_server()
+    try:
+        fresh = run(url, n, make_session_per_call = True)
+        pooled = run(url, n, make_session_per_call = False)
+    finally:
+        server.shutdown()
+    print(f'requests: {n} (upload + download each)')
+    print(f'fresh connections: {fresh:8.1f} jobs/s')
+    print(f'pooled keep-alive: {pooled:8.1f} jobs/s')
+    print(f'speedup:           {pooled / fresh:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+'''Minimal local stand-in for the BAS runPipeline service.
+
+Answers POSTs to /runPipeline with the XML shape parsed by
+connector.Response, GETs of /getLoadIndicator with the configured load and
+serves a TextGrid from /download/. Speaks HTTP/1.1 so clients can keep
+connections alive. Latency, failures and result size are set with a
+StubConfig.
+'''
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+TEXTGRID = '''File type = "ooTextFile"
+Object class = "TextGrid"
+
+xmin = 0
+xmax = 1
+tiers? <exists>
+size = 0
+item []:
+'''
+
+
+class StubConfig:
+    def __init__(self, latency = 0.0, latency_distribution = 'fixed',
+        download_latency = 0.0, failure_rate = 0.0, failure_status = 503,
+        error_rate = 0.0, load = 0, result_intervals = 0, seed = None):
+        '''Behaviour of the stub server.
+        latency:            mean seconds the server takes per runPipeline
+        latency_distribution: 'fixed', 'uniform' (0 to 2 * latency),
+                            'exponential' or 'lognormal' (sigma 1, heavy
+                            tail, like a queue on a busy server)
+        download_latency:   seconds before a download is answered
+        failure_rate:       fraction of runPipeline calls answered with
+                            failure_status (transient, retried by clients)
+        failure_status:     http status of failures
+        error_rate:         fraction of runPipeline calls answered with
+                            success false (permanent alignment errors)
+        load:               answer of getLoadIndicator (0, 1 or 2)
+        result_intervals:   number of intervals in the served TextGrid
+        seed:               random seed for latencies and failures
+        '''
+        self.latency = latency
+        self.latency_distribution = latency_distribution
+        self.download_latency = download_latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.error_rate = error_rate
+        self.load = load
+        self.result = make_textgrid(result_intervals).encode()
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self):
+        mean = self.latency
+        with self._lock:
+            if mean <= 0 or self.latency_distribution == 'fixed': return mean
+            if self.latency_distribution == 'uniform':
+                return self.random.uniform(0, 2 * mean)
+            if self.latency_distribution == 'exponential':
+                return self.random.expovariate(1 / mean)
+            if self.latency_distribution == 'lognormal':
+                # mu chosen so the mean equals latency
+                return self.random.lognormvariate(math.log(mean) - 0.5, 1.0)
+        raise ValueError(f'unknown distribution: {self.latency_distribution}')
+
+    def draw(self, rate):
+        with self._lock: return self.random.random() < rate
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        time.sleep(self.config.sample_latency())
+        if self.config.draw(self.config.failure_rate):
+            self._send(b'<html>Service Unavailable</html>',
+                self.config.failure_status)
+            return
+        success = not self.config.draw(self.config.error_rate)
+        host, port = self.server.server_address[:2]
+        link = f'http://{host}:{port}/download/result.TextGrid'
+        body = '<WebServiceResponseLink>'
+        body += f'<success>{str(success).lower()}</success>'
+        body += f'<downloadLink>{link if success else ""}</downloadLink>'
+        body += f'<output>{"" if success else "alignment failed"}</output>'
+        body += '<warnings></warnings></WebServiceResponseLink>'
+        self._send(body.encode())
+
+    def do_GET(self):
+        if self.path.endswith('getLoadIndicator'):
+            self._send(str(self.config.load).encode())
+            return
+        time.sleep(self.config.download_latency)
+        self._send(self.config.result)
+
+    def _send(self, body, status = 200):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_server(host = '127.0.0.1', port = 0, config = None):
+    '''Start the stub server in a daemon thread.
+    config:             StubConfig (default: instant successful replies)
+    Returns: the server and the runPipeline url
+    '''
+    server = StubServer((host, port), StubHandler)
+    server.config = StubConfig() if config is None else config
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f'http://{host}:{port}/runPipeline'
+
+
+def make_textgrid(n_intervals):
+    '''TextGrid with one tier of n_intervals intervals of 10 ms.'''
+    if n_intervals == 0: return TEXTGRID
+    lines = [TEXTGRID.replace('size = 0', 'size = 1')
+        .replace('xmax = 1', f'xmax = {n_intervals / 100}').rstrip('\n'),
+        '    item [1]:', '        class = "IntervalTier"',
+        '        name = "MAU"', '        xmin = 0',
+        f'        xmax = {n_intervals / 100}',
+        f'        intervals: size = {n_intervals}']
+    for i in range(n_intervals):
+        lines += [f'        intervals [{i + 1}]:',
+            f'            xmin = {i / 100}',
+            f'            xmax = {(i + 1) / 100}',
+            '            text = "a"']
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,172 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from unittest.mock import patch
+
+import numpy as np
+import soundfile as sf
+
+from webmaus import audio
+from webmaus.pipeline import Pipeline
+
+
+def write_noise(filename, seconds=2, sample_rate=16000, channels=2,
+    subtype='PCM_16', format=None):
+    rng = np.random.default_rng(0)
+    signal = rng.uniform(-0.5, 0.5, (int(seconds * sample_rate), channels))
+    sf.write(filename, signal, sample_rate, subtype=subtype, format=format)
+
+
+class PCMSegmentTests(unittest.TestCase):
+    def test_pcm_segment_matches_decoded_segment(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for subtype in ['PCM_16', 'PCM_24']:
+                filename = str(Path(tmpdir) / f'{subtype}.wav')
+                write_noise(filename, subtype=subtype)
+
+                buffer = audio.load_pcm_segment(filename, 0.5, 1.25)
+                fast, sample_rate = sf.read(buffer, dtype='int32')
+                expected, _ = sf.read(filename, start=8000, stop=20000,
+                    dtype='int32')
+
+                buffer.seek(0)
+                self.assertEqual(sample_rate, 16000)
+                self.assertEqual(sf.info(buffer).subtype, subtype)
+                np.testing.assert_array_equal(fast, expected)
+
+    def test_segment_past_the_end_is_truncated(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = str(Path(tmpdir) / 'a.wav')
+            write_noise(filename, seconds=1, channels=1)
+
+            buffer = audio.load_partial_audio_in_bytes_buffer(filename, 0.5,
+                3.0)
+
+        self.assertEqual(buffer.name, 'a.wav')
+        self.assertEqual(sf.info(buffer).frames, 8000)
+
+    def test_duration_of_wav_and_compressed_files(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in ['a.wav', 'a.flac']:
+                filename = str(Path(tmpdir) / name)
+                write_noise(filename, seconds=1.5, channels=2)
+
+                self.assertAlmostEqual(audio.duration(filename), 1.5)
+                self.assertAlmostEqual(audio.duration(filename, 0.5), 1.0)
+            self.assertIsNone(audio.duration(str(Path(tmpdir) / 'x.wav')))
+
+    def test_compressed_audio_falls_back_to_decoding(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = str(Path(tmpdir) / 'a.flac')
+            write_noise(filename, channels=1)
+
+            self.assertIsNone(audio.load_pcm_segment(filename, 0, 1))
+            buffer = audio.load_partial_audio_in_bytes_buffer(filename, 0, 1)
+
+        info = sf.info(buffer)
+        self.assertEqual(info.format, 'WAV')
+        self.assertEqual(info.frames, 16000)
+
+
+class UploadProfileTests(unittest.TestCase):
+    def test_resample_keeps_duration_and_removes_aliasing_band(self):
+        sample_rate = 48000
+        t = np.arange(sample_rate) / sample_rate
+        low = np.sin(2 * np.pi * 1000 * t)
+        high = np.sin(2 * np.pi * 12000 * t)
+
+        low_16k = audio.resample(low, sample_rate, 16000)
+        high_16k = audio.resample(high, sample_rate, 16000)
+
+        self.assertEqual(len(low_16k), 16000)
+        expected = np.sin(2 * np.pi * 1000 * np.arange(16000) / 16000)
+        np.testing.assert_allclose(low_16k[200:-200], expected[200:-200],
+            atol=0.02)
+        self.assertLess(np.abs(high_16k[200:-200]).max(), 0.01)
+
+    def test_segment_is_uploaded_as_16k_mono_flac(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = str(Path(tmpdir) / 'a.wav')
+            write_noise(filename, sample_rate=48000, channels=2)
+            profile = audio.UploadProfile()
+
+            buffer = audio.load_partial_audio_in_bytes_buffer(filename, 0.5,
+                1.5, profile=profile)
+            info = sf.info(buffer)
+
+        self.assertEqual(buffer.name, 'a.flac')
+        self.assertEqual((info.format, info.samplerate, info.channels),
+            ('FLAC', 16000, 1))
+        self.assertAlmostEqual(info.duration, 1.0)
+        self.assertEqual(buffer.original_size, 44 + 48000 * 2 * 2)
+        self.assertLess(len(buffer.getvalue()), buffer.original_size / 6)
+
+    def test_sample_based_formats_keep_the_original_rate(self):
+        profile = audio.UploadProfile()
+
+        self.assertIs(profile.for_output_format('TextGrid'), profile)
+        self.assertIsNone(profile.for_output_format('par').sample_rate)
+        self.assertTrue(profile.for_output_format('par').mono)
+
+
+class SegmentReaderTests(unittest.TestCase):
+    def test_reader_opens_each_recording_once(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            wav = str(Path(tmpdir) / 'a.wav')
+            flac = str(Path(tmpdir) / 'b.flac')
+            write_noise(wav)
+            write_noise(flac)
+            reader = audio.SegmentReader()
+
+            for start in [0, 0.5, 1.0]:
+                for filename in [wav, flac]:
+                    buffer = reader.read(filename, start, start + 0.5)
+                    expected = audio.load_partial_audio_in_bytes_buffer(
+                        filename, start, start + 0.5)
+                    self.assertEqual(buffer.getvalue(), expected.getvalue())
+            reader.close()
+
+        self.assertEqual(reader.opened, 2)
+
+    def test_least_recently_used_handle_is_closed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            names = [str(Path(tmpdir) / f'{i}.wav') for i in range(3)]
+            for name in names: write_noise(name, seconds=1)
+            reader = audio.SegmentReader(max_open=2)
+
+            for name in names + names[-1:]:
+                reader.read(name, 0, 0.1)
+            reader.read(names[0], 0, 0.1)
+            reader.close()
+
+        self.assertEqual(reader.opened, 4)
+
+
+class PipelineSegmentTests(unittest.TestCase):
+    def test_pipeline_groups_segments_by_recording(self):
+        files = [
+            {'audio_filename': 'b.wav', 'start_time': 2, 'end_time': 3},
+            {'audio_filename': 'a.wav', 'start_time': 1, 'end_time': 2},
+            {'audio_filename': 'b.wav', 'start_time': 0, 'end_time': 1},
+        ]
+        calls = []
+        def fake_run_pipeline(**kwargs):
+            calls.append((kwargs['audio_filename'], kwargs['start_time'],
+                kwargs['segment_reader']))
+            return None
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pipeline = Pipeline(files, tmpdir, 'eng-US', max_workers=1)
+            with patch('webmaus.pipeline.run_pipeline',
+                side_effect=fake_run_pipeline):
+                pipeline._run()
+
+        self.assertEqual([c[:2] for c in calls],
+            [('a.wav', 1), ('b.wav', 0), ('b.wav', 2)])
+        self.assertIsInstance(calls[0][2], audio.SegmentReader)
+        self.assertIsNone(pipeline.segment_reader)
+
+
+if __name__ == '__main__':
+    unittest.main()
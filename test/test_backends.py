@@ -0,0 +1,92 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import soundfile as sf
+
+from webmaus import textgrid
+from webmaus.backends import BASBackend, FakeBackend, LocalBackend
+from webmaus.connector import run_pipeline
+from webmaus.pipeline import Pipeline
+from webmaus.simple_align import align_text
+
+
+class BackendTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmpdir.name)
+        self.audio = str(self.directory / 'clip.wav')
+        sf.write(self.audio, np.zeros(16000 * 2), 16000)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_fake_backend_aligns_without_http(self):
+        with patch('webmaus.connector.session_module.get_session') as get:
+            response = run_pipeline(self.audio, None, 'nld-NL',
+                text = 'dit is', backend = FakeBackend())
+        alignment = response.alignment()
+
+        get.assert_not_called()
+        self.assertTrue(response.success)
+        self.assertEqual(alignment['ORT-MAU'].labels, ['dit', 'is'])
+        self.assertEqual(alignment['MAU'].labels, list('ditis'))
+        self.assertEqual(alignment.xmax, 2.0)
+
+    def test_segments_are_sliced_before_local_alignment(self):
+        response = run_pipeline(self.audio, None, 'nld-NL', start_time = 0.5,
+            end_time = 1.0, text = 'dit', backend = FakeBackend())
+
+        self.assertEqual(response.alignment().xmax, 0.5)
+
+    def test_command_backend_runs_in_process_pool(self):
+        script = 'import shutil, sys; shutil.copyfile(sys.argv[1], sys.argv[2])'
+        backend = LocalBackend([sys.executable, '-c', script, '{text}',
+            '{output}'], max_workers = 2)
+        try:
+            response = run_pipeline(self.audio, None, 'nld-NL',
+                output_format = 'txt', text = 'dit is', backend = backend)
+        finally: backend.close()
+
+        self.assertTrue(response.success)
+        self.assertEqual(response.download(), 'dit is')
+
+    def test_failing_command_returns_failed_response(self):
+        backend = LocalBackend([sys.executable, '-c',
+            'import sys; sys.exit("no model for {language}")'],
+            max_workers = 0)
+
+        response = run_pipeline(self.audio, None, 'xx', text = 'dit',
+            backend = backend)
+
+        self.assertFalse(response.success)
+        self.assertIn('no model for xx', response.output)
+
+    def test_bas_backend_posts_to_its_url(self):
+        with patch('webmaus.connector.run_pipeline') as run:
+            BASBackend('http://localhost/run').run(audio_filename = 'a.wav')
+
+        self.assertEqual(run.call_args.kwargs['url'], 'http://localhost/run')
+
+    def test_pipeline_and_align_text_accept_a_backend(self):
+        files = [{'audio_filename': self.audio, 'text': 'dit is'}]
+        backend = FakeBackend()
+        pipeline = Pipeline(files, self.directory / 'out', 'nld-NL',
+            backend = backend, max_workers = 2)
+        with patch.object(backend, 'close') as close: pipeline._run()
+        close.assert_called_once()
+        output = align_text('dit', self.audio,
+            self.directory / 'clip.TextGrid', backend = FakeBackend())
+
+        self.assertEqual(len(pipeline.done), 1)
+        grid = textgrid.Alignment.read(pipeline.done[0][-1])
+        self.assertEqual(grid['ORT-MAU'].labels, ['dit', 'is'])
+        self.assertEqual(textgrid.Alignment.read(output)['ORT-MAU'].labels,
+            ['dit'])
+
+
+if __name__ == '__main__':
+    unittest.main()
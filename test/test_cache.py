@@ -0,0 +1,73 @@
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import Mock
+
+from webmaus.cache import ResultCache
+from webmaus.connector import run_pipeline
+
+
+SUCCESS = (b'<root><success>true</success>'
+    b'<downloadLink>http://example.com/a.TextGrid</downloadLink></root>')
+
+
+class HTTPResponse:
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+
+class ResultCacheTests(unittest.TestCase):
+    def test_second_identical_request_is_served_without_network(self):
+        session = Mock()
+        session.post.return_value = HTTPResponse(SUCCESS)
+        session.get.return_value = HTTPResponse(b'alignment')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ResultCache(tmpdir)
+            first = run_pipeline(__file__, None, 'eng-US', text='a',
+                session=session, cache=cache)
+            self.assertEqual(first.download(), 'alignment')
+            second = run_pipeline(__file__, None, 'eng-US', text='a',
+                session=session, cache=cache)
+            other = run_pipeline(__file__, None, 'nld-NL', text='a',
+                session=session, cache=cache)
+
+        self.assertTrue(second.cached)
+        self.assertEqual(second.download(), 'alignment')
+        self.assertFalse(other.cached)
+        self.assertEqual(session.post.call_count, 2)
+        self.assertEqual(session.get.call_count, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_key_depends_on_payload_and_rewinds_files(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ResultCache(tmpdir)
+            audio = io.BytesIO(b'audio')
+            key = cache.make_key({'SIGNAL': audio}, {'LANGUAGE': 'eng-US'})
+
+            self.assertEqual(audio.read(), b'audio')
+            self.assertNotEqual(key, cache.make_key(
+                {'SIGNAL': io.BytesIO(b'other')}, {'LANGUAGE': 'eng-US'}))
+            self.assertNotEqual(key, cache.make_key(
+                {'SIGNAL': io.BytesIO(b'audio')}, {'LANGUAGE': 'nld-NL'}))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ResultCache(tmpdir, max_bytes=250)
+            cache.put('aa01', 'x' * 100)
+            cache.put('bb02', 'x' * 100)
+            os.utime(Path(tmpdir, 'aa', 'aa01'), (0, 0))
+            cache.get('bb02')
+            cache.put('cc03', 'x' * 100)
+
+            self.assertNotIn('aa01', cache)
+            self.assertIn('bb02', cache)
+            self.assertIn('cc03', cache)
+            self.assertEqual(cache.size, 200)
+            self.assertEqual(ResultCache(tmpdir).size, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import soundfile as sf
+
+from webmaus import chunking, textgrid
+from webmaus.connector import Response
+
+
+def make_textgrid(duration, words):
+    step = duration / (len(words) + 1)
+    items = [(0.0, step, '<p:>')]
+    for i, word in enumerate(words, 1):
+        items.append((i * step, (i + 1) * step, word))
+    items[-1] = (items[-1][0], duration, items[-1][2])
+    return {'xmin': 0.0, 'xmax': duration, 'tiers': [{
+        'class': 'IntervalTier', 'name': 'ORT-MAU', 'xmin': 0.0,
+        'xmax': duration, 'items': items}]}
+
+
+class TextGridTests(unittest.TestCase):
+    def test_round_trip(self):
+        grid = make_textgrid(2.5, ['dit', 'is', '"een"'])
+        grid['tiers'].append({'class': 'TextTier', 'name': 'points',
+            'xmin': 0.0, 'xmax': 2.5, 'items': [(1.25, 'x')]})
+
+        text = textgrid.write_textgrid(grid)
+
+        self.assertTrue(text.startswith('File type = "ooTextFile"'))
+        self.assertEqual(textgrid.read_textgrid(text), grid)
+
+    def test_merge_shifts_times_and_joins_pauses_at_boundaries(self):
+        first = make_textgrid(2.0, ['a'])
+        first['tiers'][0]['items'].append((2.0, 2.0, '<p:>'))
+        first['tiers'][0]['items'][-2] = (1.0, 1.5, 'a')
+        first['tiers'][0]['items'][-1] = (1.5, 2.0, '<p:>')
+        second = make_textgrid(3.0, ['b'])
+
+        merged = textgrid.merge_textgrids([first, second], [0.0, 2.0])
+
+        self.assertEqual(merged['xmax'], 5.0)
+        self.assertEqual(merged['tiers'][0]['items'], [(0.0, 1.0, '<p:>'),
+            (1.0, 1.5, 'a'), (1.5, 3.5, '<p:>'), (3.5, 5.0, 'b')])
+
+
+class ChunkingTests(unittest.TestCase):
+    def test_splits_fall_in_pauses(self):
+        energy = np.full(1000, -20.0)
+        energy[380:400] = -80
+        energy[700:720] = -80
+
+        splits = chunking.find_split_points(energy, hop=0.01,
+            max_chunk_seconds=4, search_seconds=1.5, smooth_seconds=0.05)
+
+        self.assertEqual(len(splits), 2)
+        self.assertTrue(3.8 <= splits[0] < 4.0)
+        self.assertTrue(7.0 <= splits[1] < 7.2)
+
+    def test_split_times_are_sample_exact_across_blocks(self):
+        sample_rate = 22050
+        signal = np.full(10 * sample_rate, 0.5)
+        signal[int(3.5 * sample_rate):int(3.7 * sample_rate)] = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = str(Path(tmpdir) / 'a.wav')
+            sf.write(filename, signal, sample_rate)
+            energy = chunking.frame_energy(filename, hop=0.01,
+                block_seconds=1.23)
+
+        # 0.01 s is 220.5 samples: frames are 220 samples long
+        self.assertEqual(chunking.frame_samples(0.01, sample_rate), 220)
+        self.assertEqual(len(energy), len(signal) // 220)
+        splits = chunking.find_split_points(energy, hop=0.01,
+            max_chunk_seconds=4, search_seconds=1, smooth_seconds=0.05,
+            sample_rate=sample_rate)
+        split_sample = splits[0] * sample_rate
+        self.assertAlmostEqual(split_sample, round(split_sample))
+        self.assertEqual(round(split_sample) % 220, 0)
+        self.assertTrue(3.5 <= splits[0] < 3.7)
+
+    def test_empty_chunks_are_merged_into_a_neighbour(self):
+        splits, texts = chunking.merge_empty_chunks([1.0, 2.0, 3.0],
+            ['a', '', 'b', ''])
+
+        self.assertEqual(splits, [1.0])
+        self.assertEqual(texts, ['a', 'b'])
+
+    def test_words_are_distributed_by_speech_time(self):
+        energy = np.full(300, -80.0)
+        energy[0:100] = -10
+        energy[200:300] = -10
+        texts = chunking.distribute_words('a b c d'.split(), energy, [1.5])
+        self.assertEqual(texts, ['a b', 'c d'])
+
+    def test_long_recording_is_aligned_in_chunks_and_merged(self):
+        sample_rate = 8000
+        rng = np.random.default_rng(0)
+        signal = rng.uniform(-0.5, 0.5, 10 * sample_rate)
+        signal[:int(1.5 * sample_rate)] = 0
+        signal[int(4.5 * sample_rate):int(4.8 * sample_rate)] = 0
+        requests = []
+        def fake_run_pipeline(**kwargs):
+            duration = kwargs['end_time'] - kwargs['start_time']
+            requests.append((kwargs['start_time'], kwargs['text']))
+            return Response.from_output(textgrid.write_textgrid(
+                make_textgrid(duration, kwargs['text'].split())))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = str(Path(tmpdir) / 'long.wav')
+            sf.write(filename, signal, sample_rate)
+            with patch('webmaus.pipeline.run_pipeline',
+                side_effect=fake_run_pipeline):
+                output = chunking.align_long_recording(filename,
+                    Path(tmpdir) / 'out', 'nld-NL', text='een twee drie vier',
+                    max_chunk_seconds=6, search_seconds=3)
+            merged = textgrid.read_textgrid(Path(output).read_text())
+
+        self.assertEqual(Path(output).name, 'long.TextGrid')
+        self.assertEqual(len(requests), 2)
+        self.assertTrue(4.5 <= requests[1][0] <= 4.8)
+        self.assertTrue(all(text for _, text in requests))
+        self.assertEqual(merged['xmax'], 10.0)
+        labels = [i[2] for i in merged['tiers'][0]['items'] if i[2] != '<p:>']
+        self.assertEqual(labels, ['een', 'twee', 'drie', 'vier'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import contextlib
+import io
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from webmaus import cli
+
+
+class CliTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_cli(self, *argv):
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()), \
+            contextlib.redirect_stderr(stderr):
+            status = cli.main([str(a) for a in argv])
+        return status, stderr.getvalue()
+
+    def test_batch_run_and_resume(self):
+        audio = self.directory / 'a.wav'
+        sf.write(audio, np.zeros(16000), 16000)
+        manifest = self.directory / 'manifest.csv'
+        rows = [f'{audio},{i / 10},{(i + 1) / 10},een twee' for i in range(6)]
+        manifest.write_text('audio_filename,start_time,end_time,text\n'
+            + '\n'.join(rows) + '\n')
+        output_directory = self.directory / 'out'
+        summary = self.directory / 'summary.json'
+
+        status, stderr = self.run_cli(manifest, output_directory, 'dutch',
+            '--fake', '--workers', 2, '--summary', summary)
+
+        self.assertEqual(status, 0)
+        self.assertIn('aligned 6 files', stderr)
+        self.assertEqual(len(list(output_directory.glob('*.TextGrid'))), 6)
+        s = json.loads(summary.read_text())
+        self.assertEqual((s['done'], s['errors'], s['complete']),
+            (6, 0, True))
+        self.assertAlmostEqual(s['audio_seconds'], 0.6)
+
+        status, stderr = self.run_cli(manifest, output_directory, 'nld-NL',
+            '--fake', '--summary', summary)
+        self.assertEqual(status, 0)
+        self.assertEqual(json.loads(summary.read_text())['skipped'], 6)
+
+    def test_errors_give_a_non_zero_status(self):
+        manifest = self.directory / 'manifest.jsonl'
+        manifest.write_text(json.dumps({'audio_filename':
+            str(self.directory / 'missing.wav'), 'text': 'een'}) + '\n')
+
+        status, _ = self.run_cli(manifest, self.directory / 'out', 'nld-NL',
+            '--fake')
+
+        self.assertEqual(status, 1)
+
+    def test_missing_manifest_fails_at_once(self):
+        status, stderr = self.run_cli(self.directory / 'missing.csv',
+            self.directory / 'out', 'dutch', '--fake')
+
+        self.assertEqual(status, 2)
+        self.assertIn('missing.csv', stderr)
+
+    def test_run_ends_when_the_run_thread_dies(self):
+        args = cli.parse_args([str(self.directory / 'manifest.jsonl'),
+            str(self.directory / 'out'), 'nld-NL', '--fake',
+            '--progress-interval', '0.05'])
+        (self.directory / 'manifest.jsonl').write_text('')
+        pipeline = cli.make_pipeline(args)
+
+        def crash(show_progress = False):
+            # ends without setting finished
+            pipeline.manifest_error = RuntimeError('crashed')
+
+        pipeline._run = crash
+        with contextlib.redirect_stderr(io.StringIO()):
+            s = cli.run(args, pipeline)
+
+        self.assertEqual(s['error'], 'crashed')
+        self.assertFalse(s['complete'])
+
+    def test_parse_shard(self):
+        self.assertEqual(cli.parse_shard('1/4'), (1, 4))
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                cli.parse_args(['m.csv', 'out', 'nld-NL', '--shard', '4/4'])
+
+    def test_import_is_light(self):
+        code = 'import sys, webmaus.cli; '
+        code += 'print(sorted(m for m in ("numpy", "soundfile", "lxml", '
+        code += '"requests", "progressbar") if m in sys.modules))'
+        result = subprocess.run([sys.executable, '-c', code],
+            capture_output = True, text = True, check = True,
+            cwd = Path(__file__).resolve().parent.parent)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_pipeline_import_does_not_load_numpy_or_soundfile(self):
+        code = 'import sys, webmaus.pipeline; '
+        code += 'print(sorted(m for m in ("numpy", "soundfile") '
+        code += 'if m in sys.modules))'
+        result = subprocess.run([sys.executable, '-c', code],
+            capture_output = True, text = True, check = True,
+            cwd = Path(__file__).resolve().parent.parent)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_submodules_are_attributes_of_the_package(self):
+        code = 'import webmaus; '
+        code += 'print(webmaus.pipeline.Pipeline.__name__, '
+        code += 'webmaus.connector.run_pipeline.__name__, '
+        code += 'webmaus.audio.__name__, webmaus.textgrid.__name__, '
+        code += 'hasattr(webmaus, "no_such_module"))'
+        result = subprocess.run([sys.executable, '-c', code],
+            capture_output = True, text = True, check = True,
+            cwd = Path(__file__).resolve().parent.parent)
+        self.assertEqual(result.stdout.split(), ['Pipeline', 'run_pipeline',
+            'webmaus.audio', 'webmaus.textgrid', 'False'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from webmaus.concurrency import AdaptiveConcurrency
+from webmaus.pipeline import Pipeline
+
+
+class AdaptiveConcurrencyTests(unittest.TestCase):
+    def test_successes_grow_limit_up_to_max(self):
+        controller = AdaptiveConcurrency(initial_limit=2, max_limit=4)
+
+        for _ in range(50):
+            controller.acquire()
+            controller.release(success=True)
+
+        self.assertEqual(controller.target, 4)
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_error_halves_limit_once_per_cooldown(self):
+        controller = AdaptiveConcurrency(initial_limit=8, max_limit=8,
+            cooldown=60)
+
+        for _ in range(3):
+            controller.acquire()
+            controller.release(success=False)
+
+        self.assertEqual(controller.target, 4)
+        self.assertGreater(controller.error_rate, 0)
+
+    def test_high_load_shrinks_and_medium_load_holds(self):
+        controller = AdaptiveConcurrency(initial_limit=8, max_limit=16,
+            cooldown=0)
+
+        controller.update_load(2)
+        self.assertEqual(controller.target, 4)
+        controller.update_load(1)
+        controller.acquire()
+        controller.release(success=True)
+        self.assertEqual(controller.target, 4)
+
+    def test_latency_increase_counts_as_congestion(self):
+        controller = AdaptiveConcurrency(initial_limit=8, max_limit=8,
+            cooldown=0)
+
+        controller.observe_latency(1.0)
+        for _ in range(10):
+            controller.acquire()
+            controller.observe_latency(20.0)
+            controller.release(success=True)
+
+        self.assertLess(controller.target, 8)
+
+    def test_latency_baseline_follows_recent_latencies(self):
+        controller = AdaptiveConcurrency(initial_limit=8, max_limit=8,
+            cooldown=0, latency_window=10)
+
+        controller.observe_latency(0.1)
+        self.assertEqual(controller.baseline_latency, 0.1)
+        for _ in range(30): controller.observe_latency(2.0)
+        controller.acquire()
+        controller.release(success=True)
+
+        self.assertEqual(controller.baseline_latency, 2.0)
+        self.assertEqual(controller.target, 8)
+
+
+class AdaptivePipelineTests(unittest.TestCase):
+    def test_adaptive_pipeline_reports_concurrency_in_eta(self):
+        files = [{'audio_filename': f'clip{i}.wav', 'text': 'a'}
+            for i in range(5)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pipeline = Pipeline(files, tmpdir, 'eng-US', max_workers=4,
+                adaptive=True)
+            with patch('webmaus.pipeline.get_load_indicator',
+                return_value=0) as load:
+                with patch.object(pipeline, '_run_single',
+                    return_value='out.TextGrid'):
+                    pipeline._run()
+
+            with patch('builtins.print') as printed:
+                pipeline.eta
+
+        load.assert_called()
+        self.assertEqual(pipeline.concurrency.load, 0)
+        self.assertEqual(pipeline.concurrency.in_flight, 0)
+        self.assertIn('target:', printed.call_args[0][0])
+
+    def test_only_uncached_server_time_per_audio_second_is_observed(self):
+        pipeline = Pipeline([], 'out', 'eng-US', adaptive=True)
+        cached = Mock(cached=True, success=True, request_seconds=5.0)
+        uncached = Mock(cached=False, success=True, request_seconds=5.0)
+
+        pipeline._observe_latency(cached, 'clip.wav', 0.0, 10.0)
+        self.assertIsNone(pipeline.concurrency.latency)
+        pipeline._observe_latency(uncached, 'clip.wav', 0.0, 10.0)
+        self.assertEqual(pipeline.concurrency.latency, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
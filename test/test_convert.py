@@ -0,0 +1,97 @@
+import csv
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from webmaus import convert, textgrid
+from webmaus.backends import FakeBackend
+from webmaus.pipeline import Pipeline
+
+
+TEXTGRID = textgrid.write_textgrid({'xmin': 0.0, 'xmax': 1.0, 'tiers': [
+    {'class': 'IntervalTier', 'name': 'ORT-MAU', 'xmin': 0.0, 'xmax': 1.0,
+        'items': [(0.0, 0.4, 'een'), (0.4, 1.0, 'twee, "drie"')]},
+    {'class': 'TextTier', 'name': 'POINTS', 'xmin': 0.0, 'xmax': 1.0,
+        'items': [(0.5, 'p')]}]})
+
+
+class ConvertTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmpdir.name)
+        self.filename = self.directory / 'a_s-0-1000-ms.TextGrid'
+        self.filename.write_text(TEXTGRID)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_every_format_is_written_next_to_the_textgrid(self):
+        filenames = convert.convert(self.filename, convert.FORMATS)
+
+        stem = self.directory / 'a_s-0-1000-ms'
+        self.assertEqual(filenames, [f'{stem}.tiers.csv',
+            f'{stem}.tiers.json', f'{stem}.tables'])
+        with open(f'{stem}.tiers.csv', newline = '') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ['tier', 'start', 'end', 'label'])
+        self.assertEqual(rows[2], ['ORT-MAU', '0.4', '1.0', 'twee, "drie"'])
+        self.assertEqual(rows[3], ['POINTS', '0.5', '0.5', 'p'])
+        data = json.loads(Path(f'{stem}.tiers.json').read_text())
+        self.assertEqual(data['tiers'][0]['items'][0], [0.0, 0.4, 'een'])
+        tables = sorted(p.name for p in Path(f'{stem}.tables').iterdir())
+        self.assertEqual(tables, ['ORT-MAU.csv', 'POINTS.csv'])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError): convert.Converter(['par'])
+        # the BAS formats of the same name have another layout
+        with self.assertRaises(ValueError): convert.Converter(['csv'])
+
+    def test_converter_process_pool_reports_errors(self):
+        converter = convert.Converter(['tiers-csv'], max_workers = 1)
+        ok = converter.submit(self.filename)
+        broken = self.directory / 'broken.TextGrid'
+        broken.write_text('not a textgrid')
+        converter.submit(broken)
+        converter.close()
+
+        self.assertEqual(ok.result(),
+            [str(self.filename.with_suffix('.tiers.csv'))])
+        self.assertEqual([e[0] for e in converter.errors], [broken])
+
+
+class PipelineFormatsTests(unittest.TestCase):
+    def test_one_request_yields_every_format(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            directory = Path(tmpdir)
+            audio = str(directory / 'a.wav')
+            sf.write(audio, np.zeros(16000), 16000)
+            output_directory = directory / 'out'
+            files = [{'audio_filename': audio, 'text': 'een twee'}]
+            formats = ['TextGrid', 'tiers-csv', 'tiers-json']
+
+            pipeline = Pipeline(files, output_directory, 'nld-NL',
+                output_format = formats, backend = FakeBackend(),
+                converter = convert.Converter(formats[1:], max_workers = 0))
+            pipeline._run()
+            names = sorted(p.name for p in output_directory.iterdir())
+            self.assertEqual(names, ['a.TextGrid', 'a.tiers.csv',
+                'a.tiers.json'])
+            self.assertEqual(len(pipeline.done), 1)
+
+            # outputs of an earlier run only get their missing formats
+            (output_directory / 'a.tiers.json').unlink()
+            pipeline = Pipeline(files, output_directory, 'nld-NL',
+                output_format = formats + ['tables'], backend = FakeBackend())
+            pipeline._run()
+            names = sorted(p.name for p in output_directory.iterdir())
+            self.assertEqual(names, ['a.TextGrid', 'a.tables',
+                'a.tiers.csv', 'a.tiers.json'])
+            self.assertEqual(len(pipeline.skipped), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+
+from webmaus import textgrid
+from webmaus.connector import Response
+from webmaus.corpus import Corpus
+from webmaus.pipeline import Pipeline
+
+
+def make_textgrid(words, phones):
+    '''TextGrid with a word and a phone tier; every item lasts 0.1 s.'''
+    def tier(name, labels):
+        items = [(i * 0.1, (i + 1) * 0.1, label)
+            for i, label in enumerate(labels)]
+        return {'class': 'IntervalTier', 'name': name, 'xmin': 0.0,
+            'xmax': len(labels) * 0.1, 'items': items}
+    return textgrid.write_textgrid({'xmin': 0.0, 'xmax': len(phones) * 0.1,
+        'tiers': [tier('ORT-MAU', words), tier('MAU', phones)]})
+
+
+class CorpusTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, words, phones):
+        filename = self.directory / name
+        filename.write_text(make_textgrid(words, phones))
+        return filename
+
+    def test_tables_and_index_cover_all_added_files(self):
+        a = self.write('a.TextGrid', ['rood', 'rat'], ['r', 'o:', 't', 'r'])
+        b = self.write('b.TextGrid', ['raar'], ['r', 'a:', 'r'])
+        corpus = Corpus(self.directory / 'corpus', flush_files = 1)
+
+        corpus.add(a, 'a.wav')
+        corpus.add(b, 'long.wav', start_time = 10.0, end_time = 10.3)
+        phones = corpus.table('phones')
+        r = corpus.select('phones', 'r')
+
+        self.assertEqual(corpus.size('phones'), 7)
+        self.assertEqual(len(corpus.shards['phones']), 2)
+        self.assertEqual(phones['start'].dtype, np.float64)
+        self.assertEqual(len(r['start']), 4)
+        self.assertEqual([corpus.sources[i] for i in r['source']],
+            ['a.wav', 'a.wav', 'long.wav', 'long.wav'])
+        np.testing.assert_allclose(r['start'][2:], [10.0, 10.2])
+        np.testing.assert_array_equal(r['segment_end'][2:], [10.3, 10.3])
+        self.assertTrue(np.isnan(r['segment_start'][0]))
+        self.assertEqual(len(corpus.select('words', 'raar')['label']), 1)
+        self.assertEqual(len(corpus.select('phones', 'x')['label']), 0)
+
+    def test_store_is_reopened_and_appended_incrementally(self):
+        a = self.write('a.TextGrid', ['rood'], ['r', 'o:', 't'])
+        b = self.write('b.TextGrid', ['rat'], ['r', 'A', 't'])
+        corpus = Corpus(self.directory / 'corpus')
+        corpus.add(a, 'a.wav')
+        corpus.flush()
+
+        corpus = Corpus(self.directory / 'corpus')
+        self.assertFalse(corpus.add(a, 'a.wav'))
+        self.assertTrue(corpus.add(b, 'b.wav'))
+        corpus.flush()
+        corpus = Corpus(self.directory / 'corpus')
+
+        self.assertEqual(len(corpus.shards['phones']), 2)
+        self.assertEqual(len(corpus.rows('phones', 't')), 2)
+        self.assertEqual(len(corpus.select('phones', 'r',
+            min_duration = 0.05)['label']), 2)
+        self.assertEqual(len(corpus.select('phones', 'r',
+            min_duration = 0.15)['label']), 0)
+
+    def test_shards_are_merged_and_the_log_only_grows(self):
+        corpus = Corpus(self.directory / 'corpus', flush_files = 1,
+            merge_shards = 2)
+        for i in range(4):
+            filename = self.write(f'{i}.TextGrid', ['rat'], ['r', 'A', 't'])
+            corpus.add(filename, f'{i}.wav')
+        log = self.directory / 'corpus' / 'corpus.jsonl'
+        size = log.stat().st_size
+        with open(log, 'ab') as f: f.write(b'{"sources": [')
+
+        corpus = Corpus(self.directory / 'corpus')
+
+        self.assertEqual(log.stat().st_size, size)
+        self.assertEqual(len(log.read_text().splitlines()), 4)
+        self.assertEqual(len(corpus.shards['phones']), 1)
+        self.assertEqual(corpus.shards['phones'][0]['level'], 2)
+        self.assertEqual(len(list((self.directory / 'corpus' / 'phones')
+            .iterdir())), 1)
+        self.assertEqual(corpus.size('phones'), 12)
+        self.assertEqual(sorted(corpus.sources[i] for i in
+            corpus.select('phones', 'r')['source']),
+            ['0.wav', '1.wav', '2.wav', '3.wav'])
+
+    def test_pipeline_adds_finished_alignments(self):
+        response = Response.from_output(make_textgrid(['rood'],
+            ['r', 'o:', 't']))
+        files = [{'audio_filename': 'a.wav', 'text': 'rood'},
+            {'audio_filename': 'b.wav', 'text': 'rood'}]
+        pipeline = Pipeline(files, self.directory / 'out', 'nld-NL',
+            max_workers = 2, corpus = self.directory / 'corpus')
+        with patch('webmaus.pipeline.run_pipeline', return_value=response):
+            pipeline._run()
+
+        corpus = Corpus(self.directory / 'corpus')
+        self.assertEqual(sorted(corpus.sources), ['a.wav', 'b.wav'])
+        self.assertEqual(len(corpus.rows('phones', 'r')), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import soundfile as sf
+
+from webmaus import audio
+from webmaus.backends import FakeBackend
+from webmaus.pipeline import Pipeline
+from webmaus.utils import ThroughputETA
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ThroughputETATests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = patch('webmaus.utils.time.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_progress_is_weighted_by_audio_seconds(self):
+        tracker = ThroughputETA(total = 3, min_interval = 0)
+        tracker.submit('short', 2)
+        tracker.submit('long', 7200)
+        tracker.submit('medium', 798)
+        tracker.start('short')
+        self.clock.now += 1
+        tracker.complete('short')
+
+        self.assertAlmostEqual(tracker.percentage_done, 2 / 8000 * 100)
+        self.assertEqual(tracker.realtime_factor, 2.0)
+        self.assertAlmostEqual(tracker.eta, 7998 / 2)
+        self.assertEqual(tracker.queue_depth, 2)
+
+    def test_in_flight_jobs_are_credited(self):
+        tracker = ThroughputETA(total = 2, min_interval = 0)
+        tracker.submit('a', 100)
+        tracker.submit('b', 100)
+        tracker.start('a')
+        self.clock.now += 10
+        tracker.complete('a')
+        tracker.start('b')
+        self.clock.now += 5
+
+        # b runs at the realtime factor of a, so half of it is done
+        self.assertAlmostEqual(tracker.remaining_seconds, 50)
+        self.assertEqual(tracker.in_flight, 1)
+        self.clock.now += 100
+        self.assertAlmostEqual(tracker.remaining_seconds, 10)
+
+    def test_unsubmitted_jobs_count_at_the_mean_duration(self):
+        tracker = ThroughputETA(total = 4)
+        tracker.submit('a', 10)
+        tracker.submit('b', None)
+        tracker.skip()
+
+        self.assertEqual(tracker.remaining_seconds, 30)
+        self.assertIsNone(tracker.eta)
+
+    def test_throughput_is_an_ewma_of_completion_samples(self):
+        tracker = ThroughputETA(total = 3, alpha = 0.5, min_interval = 0)
+        for key, seconds, wall in (('a', 10, 1), ('b', 30, 1)):
+            tracker.submit(key, seconds)
+            self.clock.now += wall
+            tracker.complete(key)
+
+        self.assertEqual(tracker.realtime_factor, 20.0)
+
+
+class DurationTests(unittest.TestCase):
+    def test_duration_reads_header_only_without_end_time(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = str(Path(tmpdir) / 'a.wav')
+            sf.write(filename, np.zeros(16000 * 3), 16000)
+            self.assertEqual(audio.duration(filename), 3.0)
+            self.assertEqual(audio.duration(filename, 1.0), 2.0)
+        self.assertEqual(audio.duration('missing.wav', 1.0, 1.5), 0.5)
+        self.assertIsNone(audio.duration('missing.wav'))
+
+    def test_pipeline_reports_audio_weighted_progress(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = str(Path(tmpdir) / 'a.wav')
+            sf.write(filename, np.zeros(16000 * 3), 16000)
+            files = [{'audio_filename': filename, 'text': 'a',
+                'start_time': 0.0, 'end_time': 1.0},
+                {'audio_filename': filename, 'text': 'b'}]
+            pipeline = Pipeline(files, Path(tmpdir) / 'out', 'nld-NL',
+                backend = FakeBackend())
+            pipeline._run()
+
+        self.assertEqual(pipeline.tracker.done_seconds, 4.0)
+        self.assertEqual(pipeline.tracker.percentage_done, 100)
+        self.assertEqual(pipeline.tracker.queue_depth, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from webmaus.jobstore import JobStore
+
+
+class JobStoreTests(unittest.TestCase):
+    def test_views_keep_the_pipeline_list_shapes(self):
+        store = JobStore()
+        store.add('done', 'a.wav', 1.5, 2.0, 'out/a.TextGrid')
+        store.add('error', 'b.wav')
+        store.add('skipped', 'c.wav', None, None, 'out/c.TextGrid')
+
+        self.assertEqual(store.view('done')[0], ('a.wav', 1.5, 2.0,
+            'out/a.TextGrid'))
+        self.assertEqual(store.view('error'), [('b.wav', None, None)])
+        self.assertEqual(store.view('skipped')[-1][-1], 'out/c.TextGrid')
+        infos = store.view(info = True)
+        self.assertEqual(len(infos), 3)
+        self.assertEqual([i['status'] for i in infos],
+            ['done', 'error', 'skipped'])
+        self.assertIn('timestamp', infos[1])
+        self.assertEqual(store.counts(), {'done': 1, 'skipped': 1,
+            'error': 1})
+
+    def test_rows_spill_to_disk_and_page_in_order(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = str(Path(tmpdir) / 'jobs.sqlite')
+            store = JobStore(spill_threshold = 10, filename = filename)
+            for i in range(25):
+                status = 'error' if i % 5 == 0 else 'done'
+                store.add(status, f'{i}.wav', i, i + 1,
+                    None if status == 'error' else f'{i}.TextGrid')
+
+            done = store.view('done')
+            self.assertTrue(Path(filename).exists())
+            self.assertEqual(store.count('done'), 20)
+            self.assertEqual(done[8:12], [(f'{i}.wav', i, i + 1,
+                f'{i}.TextGrid') for i in (11, 12, 13, 14)])
+            self.assertEqual([job[0] for job in store.view('error')],
+                ['0.wav', '5.wav', '10.wav', '15.wav', '20.wav'])
+            self.assertEqual(len(list(store.iter(page_size = 7))), 25)
+            store.close()
+
+    def test_temporary_spill_file_is_removed_on_close(self):
+        store = JobStore(spill_threshold = 2)
+        for i in range(3): store.add('done', 'a.wav', i, i + 1, 'a')
+        filename = store.filename
+
+        self.assertEqual(len(store.view('done')), 3)
+        self.assertTrue(Path(filename).exists())
+        store.close()
+        self.assertFalse(Path(filename).exists())
+
+    def test_concurrent_adds_are_all_recorded(self):
+        store = JobStore(spill_threshold = 100)
+        def add(worker):
+            for i in range(500): store.add('done', f'{worker}.wav', i, None,
+                f'{worker}-{i}')
+        threads = [threading.Thread(target=add, args=(w,)) for w in range(8)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        outputs = [job[-1] for job in store.view('done')]
+        self.assertEqual(len(outputs), 4000)
+        self.assertEqual(len(set(outputs)), 4000)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
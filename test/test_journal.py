@@ -0,0 +1,127 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from webmaus.connector import Response
+from webmaus.journal import JobJournal
+from webmaus.pipeline import Pipeline
+
+
+def fake_run_pipeline(audio_filename, **kwargs):
+    if audio_filename == 'bad.wav':
+        return None
+    return Response.from_output('alignment ' + audio_filename)
+
+
+class JobJournalTests(unittest.TestCase):
+    def test_state_transitions_and_attempts_are_persisted(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = Path(tmpdir) / 'journal.sqlite'
+            journal = JobJournal(filename)
+            journal.add('out/a.TextGrid', ('a.wav', None, None, None, 'a',
+                'out'))
+            journal.set_state('out/a.TextGrid', 'uploading')
+            journal.set_state('out/a.TextGrid', 'failed', 'timeout')
+            journal.set_state('out/a.TextGrid', 'uploading')
+            journal.close()
+
+            journal = JobJournal(filename)
+            self.assertEqual(journal.state('out/a.TextGrid'),
+                ('uploading', 2, None))
+            self.assertEqual(journal.unfinished(),
+                [('a.wav', None, None, None, 'a', 'out')])
+            journal.set_state('out/a.TextGrid', 'written')
+            self.assertEqual(journal.unfinished(), [])
+            self.assertEqual(journal.counts()['written'], 1)
+            journal.close()
+
+
+class PipelineResumeTests(unittest.TestCase):
+    def run_with_journal(self, files, tmpdir, journal):
+        pipeline = Pipeline(files, tmpdir, 'eng-US', journal=journal)
+        with patch('webmaus.pipeline.run_pipeline',
+            side_effect=fake_run_pipeline) as run:
+            pipeline._run()
+        return pipeline, run
+
+    def test_rerun_only_schedules_unfinished_jobs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = Path(tmpdir) / 'manifest.jsonl'
+            manifest.write_text(''.join(json.dumps({'audio_filename': name,
+                'text': 'a'}) + '\n' for name in ('a.wav', 'bad.wav',
+                'b.wav')))
+            journal = Path(tmpdir) / 'journal.sqlite'
+            pipeline, _ = self.run_with_journal(str(manifest), tmpdir,
+                journal)
+            self.assertEqual(len(pipeline.done), 2)
+            self.assertEqual(pipeline.journal.state(
+                str(Path(tmpdir) / 'bad.TextGrid'))[0], 'failed')
+            self.assertTrue(pipeline.journal.manifest_loaded)
+
+            # a rerun with the unchanged manifest reads the unfinished jobs
+            # from the journal and never parses the manifest
+            with patch('webmaus.manifest.read_manifest',
+                side_effect=AssertionError):
+                pipeline, run = self.run_with_journal(str(manifest), tmpdir,
+                    journal)
+
+        run.assert_called_once()
+        self.assertEqual(run.call_args.kwargs['audio_filename'], 'bad.wav')
+        self.assertEqual(pipeline.tracker.total, 1)
+
+    def test_rows_added_to_the_manifest_are_aligned(self):
+        files = [{'audio_filename': name, 'text': 'a'}
+            for name in ['a.wav', 'bad.wav']]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            journal = Path(tmpdir) / 'journal.sqlite'
+            self.run_with_journal(files, tmpdir, journal)
+            files.append({'audio_filename': 'c.wav', 'text': 'a'})
+            pipeline, run = self.run_with_journal(files, tmpdir, journal)
+
+        self.assertEqual(sorted(c.kwargs['audio_filename']
+            for c in run.call_args_list), ['bad.wav', 'c.wav'])
+        self.assertEqual(len(pipeline.skipped), 1)
+        self.assertEqual(len(pipeline.done), 1)
+
+    def test_path_entries_are_journaled(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = [{'audio_filename': Path(name), 'text': 'a',
+                'output_directory': Path(tmpdir)}
+                for name in ('a.wav', 'bad.wav')]
+            journal = Path(tmpdir) / 'journal.sqlite'
+            pipeline, run = self.run_with_journal(files, Path(tmpdir),
+                journal)
+            self.assertIsNone(pipeline.manifest_error)
+            self.assertEqual(run.call_count, 2)
+            self.assertEqual(pipeline.journal.counts()['written'], 1)
+
+            pipeline, run = self.run_with_journal(files, Path(tmpdir),
+                journal)
+
+        self.assertEqual(run.call_count, 1)
+        self.assertEqual(len(pipeline.skipped), 1)
+
+    def test_existing_output_without_written_state_is_redone(self):
+        files = [{'audio_filename': 'a.wav', 'text': 'a'}]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = str(Path(tmpdir) / 'a.TextGrid')
+            Path(output_file).write_text('truncat')
+            journal = JobJournal(Path(tmpdir) / 'journal.sqlite')
+            journal.add(output_file, ('a.wav', None, None, None, 'a', tmpdir))
+            journal.set_state(output_file, 'downloaded')
+            pipeline = Pipeline(files, tmpdir, 'eng-US', journal=journal)
+            with patch('webmaus.pipeline.run_pipeline',
+                side_effect=fake_run_pipeline):
+                pipeline._run()
+
+            self.assertEqual(Path(output_file).read_text(),
+                'alignment a.wav')
+            self.assertEqual(journal.state(output_file)[0], 'written')
+            self.assertEqual(sorted(p.name for p in Path(tmpdir).iterdir()
+                if p.suffix == '.tmp'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import gzip
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from webmaus import manifest
+from webmaus.backends import FakeBackend
+from webmaus.pipeline import Pipeline
+
+
+class ManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_csv_rows_become_entries(self):
+        filename = self.directory / 'manifest.csv'
+        filename.write_text('audio_filename,start_time,end_time,text\n'
+            'a.wav,1.5,2,"een, twee"\nb.wav,,,drie\n')
+
+        entries = list(manifest.read_manifest(filename))
+
+        self.assertEqual(entries, [{'audio_filename': 'a.wav',
+            'start_time': 1.5, 'end_time': 2.0, 'text': 'een, twee'},
+            {'audio_filename': 'b.wav', 'text': 'drie'}])
+        self.assertEqual(manifest.count_entries(filename), 2)
+
+    def test_gzipped_jsonl_is_read_incrementally(self):
+        filename = self.directory / 'manifest.jsonl.gz'
+        with gzip.open(filename, 'wt') as f:
+            for i in range(1000):
+                f.write(json.dumps({'audio_filename': f'{i}.wav'}) + '\n')
+
+        entries, total = manifest.open_manifest(filename)
+
+        self.assertEqual(total, 1000)
+        self.assertNotIsInstance(entries, list)
+        self.assertEqual(next(iter(entries)), {'audio_filename': '0.wav'})
+
+    def test_totals_of_lists_and_iterables(self):
+        self.assertEqual(manifest.open_manifest([{}, {}])[1], 2)
+        self.assertIsNone(manifest.open_manifest(iter([{}]))[1])
+        self.assertEqual(manifest.open_manifest(iter([{}]), total = 5)[1], 5)
+        self.assertIsNone(manifest.open_manifest(
+            self.directory / 'm.csv', count = False)[1])
+
+    def test_pipeline_consumes_a_generator_lazily(self):
+        audio = str(self.directory / 'a.wav')
+        sf.write(audio, np.zeros(16000), 16000)
+        consumed = []
+        def entries():
+            for i in range(5):
+                consumed.append(i)
+                yield {'audio_filename': audio, 'start_time': i * 0.1,
+                    'end_time': i * 0.1 + 0.1, 'text': 'a'}
+
+        pipeline = Pipeline(entries(), self.directory / 'out', 'nld-NL',
+            backend = FakeBackend(), max_workers = 2)
+        self.assertEqual(consumed, [])
+        pipeline._run()
+
+        self.assertEqual(len(pipeline.done), 5)
+        self.assertIsNone(pipeline.tracker.total)
+        self.assertTrue(pipeline.status_done)
+
+    def test_pipeline_reads_a_manifest_file(self):
+        audio = str(self.directory / 'a.wav')
+        sf.write(audio, np.zeros(16000), 16000)
+        filename = self.directory / 'manifest.tsv'
+        filename.write_text(f'audio_filename\ttext\n{audio}\tdit\n')
+
+        pipeline = Pipeline(str(filename), self.directory / 'out', 'nld-NL',
+            backend = FakeBackend())
+        pipeline._run()
+
+        self.assertEqual(pipeline.tracker.total, 1)
+        self.assertEqual(len(pipeline.done), 1)
+
+    def test_broken_row_stops_scheduling_without_hanging(self):
+        def entries():
+            yield {'text': 'no audio filename'}
+
+        pipeline = Pipeline(entries(), self.directory / 'out', 'nld-NL',
+            backend = FakeBackend())
+        pipeline._run()
+
+        self.assertIsInstance(pipeline.manifest_error, KeyError)
+        self.assertFalse(pipeline.status_done)
+        self.assertTrue(pipeline.finished.is_set())
+
+    def test_missing_or_unsupported_manifest_raises_at_once(self):
+        unsupported = self.directory / 'manifest.xlsx'
+        unsupported.write_text('')
+
+        with self.assertRaises(FileNotFoundError):
+            Pipeline(self.directory / 'missing.csv', self.directory, 'nld-NL')
+        with self.assertRaises(ValueError):
+            Pipeline(unsupported, self.directory, 'nld-NL')
+
+    def test_failing_run_does_not_hang(self):
+        filename = self.directory / 'manifest.csv'
+        filename.write_text('audio_filename,text\n')
+        pipeline = Pipeline(filename, self.directory / 'out', 'nld-NL',
+            backend = FakeBackend())
+        filename.unlink()
+
+        pipeline.run()
+
+        self.assertTrue(pipeline.wait(timeout = 5))
+        self.assertIsInstance(pipeline.manifest_error, FileNotFoundError)
+        self.assertFalse(pipeline.running)
+        self.assertFalse(pipeline.status_done)
+
+
+if __name__ == '__main__':
+    unittest.main()
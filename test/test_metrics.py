@@ -0,0 +1,112 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import Mock
+
+import numpy as np
+import soundfile as sf
+from urllib3.filepost import encode_multipart_formdata
+
+from webmaus import metrics
+from webmaus.audio import UploadProfile
+from webmaus.backends import FakeBackend
+from webmaus.connector import _MultipartBody, run_pipeline
+from webmaus.pipeline import Pipeline
+
+
+XML = b'''<WebServiceResponseLink><success>true</success>
+<downloadLink>http://example.com/a.TextGrid</downloadLink>
+<output></output><warnings></warnings></WebServiceResponseLink>'''
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmpdir.name)
+        self.audio = str(self.directory / 'clip.wav')
+        sf.write(self.audio, np.zeros((32000, 2)), 32000)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_histograms_and_exports(self):
+        m = metrics.Metrics(buckets = (0.1, 1))
+        m.record(metrics.Span('a', 'upload', 0, 0.05, 100))
+        m.record(metrics.Span('b', 'upload', 0, 0.5, 300))
+        m.record(metrics.Span('c', 'upload', 0, 5.0, 0))
+
+        upload = m.snapshot()['stages']['upload']
+        text = m.to_prometheus()
+
+        self.assertEqual(upload['count'], 3)
+        self.assertEqual(upload['bytes'], 400)
+        self.assertEqual(upload['buckets'], {'0.1': 1, '1': 1, 'inf': 1})
+        self.assertIn('webmaus_stage_seconds_bucket{stage="upload",le="1"} 2',
+            text)
+        self.assertIn('webmaus_stage_seconds_count{stage="upload"} 3', text)
+        self.assertIn('webmaus_stage_bytes_total{stage="upload"} 400', text)
+        m.write(self.directory / 'metrics.json')
+        self.assertIn('"upload"', (self.directory / 'metrics.json').read_text())
+
+    def test_stages_are_not_recorded_outside_a_job(self):
+        with metrics.stage('load') as span:
+            self.assertIsNone(span)
+        self.assertFalse(metrics.active())
+
+    def test_run_pipeline_records_every_stage_with_bytes(self):
+        def post(url, data, headers, timeout):
+            while data.read(1024): pass
+            return Mock(status_code=200, content=XML)
+        session = Mock()
+        session.post.side_effect = post
+        session.get.return_value = Mock(status_code=200, content=b'grid')
+        spans = []
+        m = metrics.Metrics(hook = spans.append)
+
+        with m.job('clip'):
+            response = run_pipeline(self.audio, None, 'nld-NL', text = 'dit',
+                session = session, upload_profile = UploadProfile())
+            response.save_alignment(self.directory, self.audio)
+
+        stages = {span.stage: span for span in spans}
+        self.assertEqual(list(stages), ['encode', 'load', 'upload',
+            'server_wait', 'download', 'write'])
+        self.assertTrue(all(span.job == 'clip' for span in spans))
+        self.assertGreater(stages['upload'].bytes, stages['load'].bytes)
+        self.assertEqual(stages['download'].bytes, 4)
+        self.assertEqual(stages['write'].bytes, 4)
+        self.assertIn('multipart/form-data',
+            session.post.call_args.kwargs['headers']['Content-Type'])
+
+    def test_multipart_body_is_streamed_and_encoded_like_urllib3(self):
+        with open(self.audio, 'rb') as f:
+            body = _MultipartBody({'LANGUAGE': 'nld-NL'}, {'SIGNAL': f},
+                boundary = 'b0undary')
+            self.assertEqual(f.tell(), 0)
+            encoded = b''
+            while chunk := body.read(1000): encoded += chunk
+            f.seek(0)
+            expected, content_type = encode_multipart_formdata([
+                ('LANGUAGE', 'nld-NL'), ('SIGNAL', ('clip.wav', f.read()))],
+                boundary = 'b0undary')
+
+        self.assertEqual(encoded, expected)
+        self.assertEqual(len(body), len(expected))
+        self.assertEqual(body.content_type, content_type)
+        self.assertIsNotNone(body.sent)
+
+    def test_pipeline_records_spans_per_job(self):
+        files = [{'audio_filename': self.audio, 'text': 'dit'}]
+        pipeline = Pipeline(files, self.directory / 'out', 'nld-NL',
+            backend = FakeBackend(), metrics = True)
+        pipeline._run()
+
+        stages = pipeline.metrics.snapshot()['stages']
+        self.assertEqual(stages['load']['count'], 1)
+        self.assertEqual(stages['server_wait']['count'], 1)
+        self.assertEqual(stages['write']['count'], 1)
+        self.assertEqual(pipeline.metrics.spans[0].job, pipeline.done[0][-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import soundfile as sf
+
+from webmaus.backends import FakeBackend
+from webmaus.output_index import OutputIndex
+from webmaus.pipeline import Pipeline
+
+
+class OutputIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_directory_is_listed_once(self):
+        for name in ('a.TextGrid', 'b.TextGrid'):
+            (self.directory / name).write_text('')
+        index = OutputIndex()
+
+        with mock.patch('os.scandir', wraps = os.scandir) as scandir:
+            self.assertTrue(index.exists(self.directory / 'a.TextGrid'))
+            self.assertTrue(index.exists(self.directory / 'b.TextGrid'))
+            self.assertFalse(index.exists(self.directory / 'c.TextGrid'))
+        self.assertEqual(scandir.call_count, 1)
+
+        index.add(self.directory / 'c.TextGrid')
+        self.assertIn(self.directory / 'c.TextGrid', index)
+        self.assertFalse(index.exists(self.directory / 'missing' / 'a.txt'))
+
+    def test_persisted_index_skips_unchanged_directories(self):
+        output_directory = self.directory / 'out'
+        output_directory.mkdir()
+        (output_directory / 'a.TextGrid').write_text('')
+        filename = self.directory / 'index.json'
+        index = OutputIndex(filename)
+        index.exists(output_directory / 'a.TextGrid')
+        index.save()
+
+        warm = OutputIndex(filename)
+        self.assertTrue(warm.exists(output_directory / 'a.TextGrid'))
+        self.assertEqual(warm.scans, 0)
+
+        (output_directory / 'b.TextGrid').write_text('')
+        changed = OutputIndex(filename)
+        self.assertTrue(changed.exists(output_directory / 'b.TextGrid'))
+        self.assertEqual(changed.scans, 1)
+
+    def test_pipeline_skips_existing_outputs_without_stat_calls(self):
+        audio = str(self.directory / 'a.wav')
+        sf.write(audio, np.zeros(16000), 16000)
+        output_directory = self.directory / 'out'
+        files = [{'audio_filename': audio, 'start_time': i * 0.1,
+            'end_time': i * 0.1 + 0.1, 'text': 'a'} for i in range(4)]
+        index_filename = self.directory / 'index.json'
+        Pipeline(files, output_directory, 'nld-NL', backend = FakeBackend(),
+            output_index = index_filename)._run()
+
+        pipeline = Pipeline(files, output_directory, 'nld-NL',
+            backend = FakeBackend(), output_index = index_filename)
+        with mock.patch.object(Path, 'exists') as exists:
+            pipeline._run()
+
+        exists.assert_not_called()
+        self.assertEqual(len(pipeline.skipped), 4)
+        self.assertEqual(pipeline.output_index.scans, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,15 @@
+import asyncio
+import os
 import tempfile
+import threading
+import time
 import unittest
 from pathlib import Path
 from unittest.mock import patch
 
-from webmaus.connector import Response, _main
+from webmaus import session as session_module
+from webmaus.connector import DEFAULT_TIMEOUT, Response, _main, run_pipeline
+from webmaus.async_pipeline import AsyncPipeline
 from webmaus.pipeline import Pipeline
 from webmaus.simple_align import DEFAULT_LANGUAGE, align_text, align_texts
 
@@ -55,6 +61,89 @@ class ResponseTests(unittest.TestCase):
             self.assertEqual(path.read_text(), 'alignment')
 
 
+class SessionTests(unittest.TestCase):
+    def test_run_pipeline_uploads_and_downloads_with_given_session(self):
+        session = unittest.mock.Mock()
+        session.post.return_value = DummyHTTPResponse(
+            b'<root><success>true</success>'
+            b'<downloadLink>http://example.com/a.TextGrid</downloadLink>'
+            b'</root>'
+        )
+        session.get.return_value = DummyHTTPResponse(b'alignment')
+
+        response = run_pipeline(__file__, None, 'eng-US', text='a test',
+            session=session, url='http://example.com/run')
+
+        self.assertEqual(response.download(), 'alignment')
+        session.post.assert_called_once()
+        self.assertEqual(session.post.call_args[0][0], 'http://example.com/run')
+        session.get.assert_called_once_with('http://example.com/a.TextGrid',
+            timeout=DEFAULT_TIMEOUT)
+        self.assertEqual(session.post.call_args[1]['timeout'], DEFAULT_TIMEOUT)
+
+    def test_pipeline_shares_default_session(self):
+        pipeline = Pipeline([], 'out', 'eng-US')
+
+        self.assertIs(pipeline.session, session_module.get_session())
+
+    def test_make_session_configures_pool_limits(self):
+        session = session_module.make_session(pool_size=2, max_per_host=5,
+            keep_alive=False)
+        adapter = session.get_adapter('https://example.com')
+
+        self.assertEqual(adapter._pool_maxsize, 5)
+        self.assertEqual(adapter._pool_connections, 2)
+        self.assertEqual(session.headers['Connection'], 'close')
+
+
+class StreamingDownloadTests(unittest.TestCase):
+    def make_response(self, session):
+        return Response(
+            DummyHTTPResponse(
+                b'<root><success>true</success>'
+                b'<downloadLink>http://example.com/a.TextGrid</downloadLink>'
+                b'</root>'
+            ),
+            session=session,
+        )
+
+    def test_streamed_download_is_written_without_memory_copy(self):
+        http_response = unittest.mock.Mock(status_code=200)
+        http_response.iter_content.return_value = iter([b'ali', b'gnment'])
+        session = unittest.mock.Mock()
+        session.get.return_value = http_response
+        response = self.make_response(session)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = response.save_alignment(output_directory=tmpdir,
+                audio_filename='clip.wav', stream=True)
+
+            self.assertEqual(Path(filename).read_text(), 'alignment')
+            self.assertEqual(os.listdir(tmpdir), ['clip.TextGrid'])
+        session.get.assert_called_once_with('http://example.com/a.TextGrid',
+            stream=True, timeout=DEFAULT_TIMEOUT)
+        http_response.close.assert_called_once()
+        self.assertFalse(hasattr(response, 'download_output'))
+
+    def test_interrupted_stream_leaves_no_partial_file(self):
+        def broken_stream(chunk_size):
+            yield b'ali'
+            raise OSError('connection lost')
+        http_response = unittest.mock.Mock(status_code=200)
+        http_response.iter_content.side_effect = broken_stream
+        session = unittest.mock.Mock()
+        session.get.return_value = http_response
+        response = self.make_response(session)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = response.download_to_file(Path(tmpdir) / 'a.TextGrid',
+                keep_in_memory=True)
+
+            self.assertIsNone(filename)
+            self.assertEqual(os.listdir(tmpdir), [])
+        self.assertIsInstance(response.response.download_error, OSError)
+
+
 class PipelineTests(unittest.TestCase):
     def test_empty_pipeline_finishes_cleanly(self):
         pipeline = Pipeline([], 'out', 'eng-US')
@@ -81,9 +170,90 @@ class PipelineTests(unittest.TestCase):
             start_time=None,
             end_time=None,
             output_format='json',
+            stream=True,
         )
         self.assertEqual(pipeline.done[0][-1], 'out/clip.json')
 
+    def test_worker_pool_runs_jobs_without_fixed_sleeps(self):
+        files = [{'audio_filename': f'clip{i}.wav', 'text': 'a'}
+            for i in range(20)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pipeline = Pipeline(files, tmpdir, 'eng-US', max_workers=4)
+            with patch.object(pipeline, '_run_single') as run_single:
+                start = time.time()
+                pipeline.run()
+                self.assertTrue(pipeline.wait(timeout=5))
+
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(run_single.call_count, 20)
+        self.assertTrue(pipeline.status_done)
+        self.assertEqual(pipeline.executors, [])
+
+    def test_stalled_job_is_failed_and_its_worker_replaced(self):
+        files = [{'audio_filename': f'clip{i}.wav', 'text': 'a'}
+            for i in range(4)]
+        release = threading.Event()
+
+        def fake_run_pipeline(audio_filename, **kwargs):
+            if audio_filename == 'clip0.wav': release.wait(10)
+            response = unittest.mock.Mock(success=True, cached=True)
+            response.save_alignment.return_value = audio_filename
+            return response
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pipeline = Pipeline(files, tmpdir, 'eng-US', max_workers=1,
+                job_timeout=0.2)
+            with patch('webmaus.pipeline.run_pipeline', fake_run_pipeline):
+                pipeline.run()
+                self.assertTrue(pipeline.wait(timeout=5))
+                release.set()
+                time.sleep(0.1)
+
+        self.assertEqual(pipeline.errors, [('clip0.wav', None, None)])
+        self.assertEqual(len(pipeline.done), 3)
+        self.assertEqual(pipeline.executors, [])
+
+    def test_worker_records_error_when_job_raises(self):
+        files = [{'audio_filename': 'clip.wav', 'text': 'a'}]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pipeline = Pipeline(files, tmpdir, 'eng-US', max_workers=2)
+            with patch('webmaus.pipeline.run_pipeline',
+                side_effect=FileNotFoundError('clip.wav')):
+                pipeline._run()
+
+        self.assertEqual(pipeline.errors, [('clip.wav', None, None)])
+        self.assertEqual(pipeline.error_infos[0]['status'], 'error')
+
+
+class AsyncPipelineTests(unittest.TestCase):
+    def test_async_pipeline_aligns_skips_and_records_errors(self):
+        async def fake_arun_pipeline(audio_filename, **kwargs):
+            if audio_filename == 'bad.wav':
+                return None
+            response = unittest.mock.Mock()
+            response.success = True
+            response.adownload = unittest.mock.AsyncMock(
+                return_value='alignment')
+            response.save_alignment.return_value = 'out/' + audio_filename
+            return response
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            Path(tmpdir, 'old.TextGrid').write_text('x')
+            files = [{'audio_filename': name, 'text': 'a'}
+                for name in ['a.wav', 'bad.wav', 'old.wav', 'b.wav']]
+            pipeline = AsyncPipeline(files, tmpdir, 'eng-US',
+                session=object(), max_in_flight=2)
+            with patch('webmaus.async_pipeline.arun_pipeline',
+                side_effect=fake_arun_pipeline):
+                asyncio.run(pipeline.run())
+
+        self.assertTrue(pipeline.status_done)
+        self.assertEqual(sorted(d[-1] for d in pipeline.done),
+            ['out/a.wav', 'out/b.wav'])
+        self.assertEqual(pipeline.errors, [('bad.wav', None, None)])
+        self.assertEqual(len(pipeline.skipped_infos), 1)
+        self.assertEqual(pipeline.in_flight, 0)
+
 
 class CLITests(unittest.TestCase):
     def test_main_parses_arguments_and_calls_handler(self):
@@ -126,6 +296,9 @@ class SimpleAlignmentTests(unittest.TestCase):
             pipe='G2P_MAUS_PHO2SYL',
             preseg='true',
             text='dit is een test',
+            session=None,
+            cache=None,
+            backend=None,
         )
         response.save_output.assert_called_once_with(
             'alignment',
@@ -0,0 +1,171 @@
+import asyncio
+import io
+import unittest
+from unittest.mock import Mock, patch
+
+from requests.exceptions import ChunkedEncodingError, ConnectionError
+
+from webmaus.connector import Response, run_pipeline
+from webmaus.retry import CircuitBreaker, CircuitOpenError, RetryPolicy, \
+    acall_with_retry, call_with_retry
+
+
+SUCCESS = (b'<root><success>true</success>'
+    b'<downloadLink>http://example.com/a.TextGrid</downloadLink></root>')
+
+
+class HTTPResponse:
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+
+def no_wait_policy(max_attempts=3):
+    return RetryPolicy(max_attempts=max_attempts, base_delay=0)
+
+
+class RetryTests(unittest.TestCase):
+    def test_upload_is_resent_from_the_same_sliced_buffer(self):
+        session = Mock()
+        uploads = []
+        def post(url, files, data, timeout):
+            uploads.append(files['SIGNAL'].read())
+            if len(uploads) == 1: raise ConnectionError('reset')
+            return HTTPResponse(SUCCESS)
+        session.post.side_effect = post
+
+        with patch('webmaus.audio.load_partial_audio_in_bytes_buffer',
+            return_value=io.BytesIO(b'audio')) as load:
+            response = run_pipeline('clip.wav', None, 'eng-US', start_time=1,
+                end_time=2, text='a', session=session,
+                retry_policy=no_wait_policy(),
+                circuit_breaker=CircuitBreaker())
+
+        self.assertTrue(response.success)
+        self.assertEqual(response.attempts, 2)
+        self.assertEqual(uploads, [b'audio', b'audio'])
+        load.assert_called_once()
+
+    def test_server_errors_are_retried_but_client_errors_are_not(self):
+        session = Mock()
+        session.post.side_effect = [HTTPResponse(b'busy', 503),
+            HTTPResponse(SUCCESS)]
+        response = run_pipeline(__file__, None, 'eng-US', text='a',
+            session=session, retry_policy=no_wait_policy(),
+            circuit_breaker=CircuitBreaker())
+        self.assertTrue(response.success)
+
+        session = Mock()
+        session.post.return_value = HTTPResponse(b'bad request', 400)
+        response = run_pipeline(__file__, None, 'eng-US', text='a',
+            session=session, retry_policy=no_wait_policy(),
+            circuit_breaker=CircuitBreaker())
+        self.assertFalse(response.success)
+        session.post.assert_called_once()
+
+    def test_gives_up_after_max_attempts(self):
+        session = Mock()
+        session.post.side_effect = ConnectionError('down')
+
+        response = run_pipeline(__file__, None, 'eng-US', text='a',
+            session=session, retry_policy=no_wait_policy(max_attempts=2),
+            circuit_breaker=CircuitBreaker())
+
+        self.assertIsNone(response)
+        self.assertEqual(session.post.call_count, 2)
+
+    def test_every_transient_error_gives_up_without_raising(self):
+        session = Mock()
+        session.post.side_effect = ChunkedEncodingError('truncated')
+
+        response = run_pipeline(__file__, None, 'eng-US', text='a',
+            session=session, retry_policy=no_wait_policy(max_attempts=2),
+            circuit_breaker=CircuitBreaker())
+
+        self.assertIsNone(response)
+        self.assertEqual(session.post.call_count, 2)
+
+    def test_download_is_retried(self):
+        session = Mock()
+        session.get.side_effect = [ConnectionError('reset'),
+            HTTPResponse(b'alignment')]
+        response = Response(HTTPResponse(SUCCESS), session=session,
+            retry_policy=no_wait_policy(), circuit_breaker=CircuitBreaker())
+
+        self.assertEqual(response.download(), 'alignment')
+        self.assertEqual(response.download_attempts, 2)
+
+
+class AsyncRetryTests(unittest.TestCase):
+    def test_transient_errors_and_results_are_retried(self):
+        results = [TimeoutError('stalled'), 503, 200]
+        async def attempt():
+            result = results.pop(0)
+            if isinstance(result, Exception): raise result
+            return result
+
+        result, attempts = asyncio.run(acall_with_retry(attempt,
+            lambda status: status == 503, no_wait_policy(),
+            CircuitBreaker(), transient_errors = (TimeoutError,)))
+
+        self.assertEqual((result, attempts), (200, 3))
+
+    def test_permanent_errors_and_exhausted_attempts_raise(self):
+        def run(transient_errors):
+            calls = []
+            async def attempt():
+                calls.append(1)
+                raise TimeoutError('stalled')
+            breaker = CircuitBreaker()
+            with self.assertRaises(TimeoutError):
+                asyncio.run(acall_with_retry(attempt, lambda r: False,
+                    no_wait_policy(max_attempts=2), breaker,
+                    transient_errors = transient_errors))
+            return len(calls), breaker.failures
+
+        self.assertEqual(run(()), (1, 0))
+        self.assertEqual(run((TimeoutError,)), (2, 2))
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def test_opens_after_threshold_and_probes_after_timeout(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+
+        breaker.record_failure()
+        breaker.wait()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.wait(timeout=0.01)
+
+        breaker.wait(timeout=1)
+        self.assertEqual(breaker.state, 'half_open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.wait(timeout=0.01)
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.wait(timeout=0)
+
+    def test_permanent_error_does_not_close_a_half_open_circuit(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        def fail():
+            raise ValueError('invalid request')
+
+        with self.assertRaises(ValueError):
+            call_with_retry(fail, lambda r: False, no_wait_policy(), breaker)
+
+        self.assertEqual(breaker.state, 'half_open')
+        # the probe slot is free again
+        breaker.wait(timeout=0)
+
+    def test_backoff_grows_exponentially_and_is_capped(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5, jitter=False)
+
+        self.assertEqual([policy.delay(i) for i in range(1, 5)], [1, 2, 4, 5])
+        jittered = RetryPolicy(base_delay=1, max_delay=5)
+        self.assertTrue(0 <= jittered.delay(3) <= 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
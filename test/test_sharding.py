@@ -0,0 +1,158 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from webmaus import sharding
+from webmaus.backends import FakeBackend
+from webmaus.connector import make_output_filename
+from webmaus.pipeline import Pipeline
+
+
+class HashShardTests(unittest.TestCase):
+    def test_every_key_has_exactly_one_owner(self):
+        shards = [sharding.HashShard(i, 3) for i in range(3)]
+        keys = [f'out/{i}.TextGrid' for i in range(300)]
+        owners = [sum(shard.owns(key) for shard in shards) for key in keys]
+
+        self.assertEqual(owners, [1] * 300)
+        self.assertGreater(sum(shards[0].owns(key) for key in keys), 50)
+        self.assertEqual(sharding.shard_of('a', 7), sharding.shard_of('a', 7))
+
+    def test_invalid_index(self):
+        with self.assertRaises(ValueError): sharding.HashShard(3, 3)
+
+
+class ClaimsTests:
+    '''Tests shared by both claim stores; make_claims(node, lease_seconds)
+    is provided by the subclasses.
+    '''
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_a_job_is_claimed_once(self):
+        a, b = self.make_claims('a'), self.make_claims('b')
+
+        self.assertTrue(a.claim('job'))
+        self.assertFalse(b.claim('job'))
+        a.release('job')
+        self.assertTrue(b.claim('job'))
+        b.release('job', done = True)
+        self.assertFalse(a.claim('job'))
+
+    def test_expired_claims_are_taken_over(self):
+        a = self.make_claims('a', lease_seconds = 0.2)
+        b = self.make_claims('b', lease_seconds = 0.2)
+        self.assertTrue(a.claim('job'))
+        a.beat()
+        self.assertFalse(b.claim('job'))
+
+        time.sleep(0.3)
+        self.assertTrue(b.claim('job'))
+        self.assertFalse(a.claim('job'))
+        a.release('job')
+        self.assertFalse(self.make_claims('c').claim('job'))
+
+    def test_progress_is_aggregated(self):
+        a, b = self.make_claims('a'), self.make_claims('b')
+        a.start(lambda: {'done': 2, 'errors': 1, 'entries': 10})
+        b.start(lambda: {'done': 3, 'errors': 0, 'entries': 10})
+        a.stop()
+        b.stop()
+
+        progress = b.progress()
+
+        self.assertEqual(sorted(progress['nodes']), ['a', 'b'])
+        self.assertTrue(progress['nodes']['a']['alive'])
+        self.assertEqual(progress['total'],
+            {'done': 5, 'errors': 1, 'entries': 10})
+
+
+class LeaseClaimsTests(ClaimsTests, unittest.TestCase):
+    def make_claims(self, node, lease_seconds = 600):
+        return sharding.LeaseClaims(self.directory, node, lease_seconds)
+
+
+class SQLiteClaimsTests(ClaimsTests, unittest.TestCase):
+    def make_claims(self, node, lease_seconds = 600):
+        claims = sharding.SQLiteClaims(self.directory / 'claims.sqlite',
+            node, lease_seconds)
+        self.addCleanup(claims.close)
+        return claims
+
+
+class ShardedPipelineTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmpdir.name)
+        audio = str(self.directory / 'a.wav')
+        sf.write(audio, np.zeros(16000), 16000)
+        self.files = [{'audio_filename': audio, 'start_time': i * 0.05,
+            'end_time': i * 0.05 + 0.05, 'text': 'a'} for i in range(20)]
+        self.output_directory = self.directory / 'out'
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_node(self, **kwargs):
+        pipeline = Pipeline(self.files, self.output_directory, 'nld-NL',
+            backend = FakeBackend(), max_workers = 2, **kwargs)
+        pipeline._run()
+        return pipeline
+
+    def test_hash_shards_split_the_manifest(self):
+        nodes = [self.run_node(shard = (i, 2)) for i in range(2)]
+
+        self.assertEqual(sum(len(node.done) for node in nodes), 20)
+        self.assertEqual(len(os.listdir(self.output_directory)), 20)
+        self.assertTrue(all(node.status_done for node in nodes))
+
+    def claim_for(self, claims, entries):
+        keys = [make_output_filename(self.output_directory,
+            entry['audio_filename'], 'TextGrid', entry['start_time'],
+            entry['end_time']) for entry in entries]
+        for key in keys: claims.claim(key)
+        return keys
+
+    def test_claimed_jobs_are_not_aligned_twice(self):
+        claims = self.directory / 'claims'
+        other = sharding.LeaseClaims(claims, 'other')
+        keys = self.claim_for(other, self.files[::4])
+        # the other node finishes its jobs while this node waits for them
+        timer = threading.Timer(0.2,
+            lambda: [other.release(key, done = True) for key in keys])
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        node = self.run_node(claims = sharding.LeaseClaims(claims, 'node',
+            lease_seconds = 0.5))
+
+        self.assertEqual(len(node.done), 15)
+        self.assertTrue(node.status_done)
+        self.assertEqual(node.claims.held, set())
+        progress = node.cluster_progress()
+        self.assertEqual(progress['total']['done'], 15)
+        self.assertFalse(progress['nodes']['node']['running'])
+
+    def test_jobs_of_a_dead_node_are_retried_after_the_lease(self):
+        claims = self.directory / 'claims'
+        dead = sharding.LeaseClaims(claims, 'dead')
+        self.claim_for(dead, self.files[::4])
+
+        node = self.run_node(claims = sharding.LeaseClaims(claims, 'node',
+            lease_seconds = 0.3))
+
+        self.assertEqual(len(node.done), 20)
+        self.assertTrue(node.status_done)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from webmaus.simple_align import align_texts, iter_align_texts
+
+
+def fake_align_text(transcription, audio_filename, output_filename,
+    **kwargs):
+    '''Stand in for align_text: later inputs finish first, 'fail' fails.'''
+    time.sleep(0.01 * (5 - int(audio_filename[0])))
+    if transcription == 'fail':
+        raise RuntimeError(f'Alignment failed for {audio_filename}')
+    return output_filename
+
+
+class ConcurrentAlignTextsTests(unittest.TestCase):
+    def inputs(self, transcriptions):
+        n = len(transcriptions)
+        return (transcriptions, [f'{i}.wav' for i in range(n)],
+            [f'{i}.TextGrid' for i in range(n)])
+
+    def test_results_are_in_input_order(self):
+        with patch('webmaus.simple_align.align_text', fake_align_text):
+            results = align_texts(*self.inputs(['a'] * 5), max_workers = 5)
+
+        self.assertEqual(results, [f'{i}.TextGrid' for i in range(5)])
+
+    def test_alignments_run_concurrently(self):
+        barrier = threading.Barrier(3, timeout = 5)
+        def align_text(output_filename, **kwargs):
+            barrier.wait()
+            return output_filename
+
+        with patch('webmaus.simple_align.align_text', align_text):
+            results = align_texts(*self.inputs(['a'] * 3), max_workers = 3)
+
+        self.assertEqual(len(results), 3)
+
+    def test_collect_errors_returns_them_in_place(self):
+        with patch('webmaus.simple_align.align_text', fake_align_text):
+            results = align_texts(*self.inputs(['a', 'fail', 'a']),
+                max_workers = 3, fail_fast = False)
+
+        self.assertEqual(results[0], '0.TextGrid')
+        self.assertIsInstance(results[1], RuntimeError)
+        self.assertEqual(results[2], '2.TextGrid')
+
+    def test_fail_fast_keeps_the_finished_results(self):
+        with patch('webmaus.simple_align.align_text', fake_align_text):
+            with self.assertRaises(RuntimeError) as cm:
+                align_texts(*self.inputs(['a', 'a', 'fail']))
+
+        e = cm.exception
+        self.assertIs(type(e), RuntimeError)
+        self.assertEqual(e.index, 2)
+        self.assertEqual(e.results[:2], ['0.TextGrid', '1.TextGrid'])
+        self.assertIs(e.results[2], e)
+
+    def test_original_exception_type_is_raised(self):
+        def align_text(audio_filename, **kwargs):
+            raise FileNotFoundError(audio_filename)
+
+        with patch('webmaus.simple_align.align_text', align_text):
+            with self.assertRaises(FileNotFoundError) as cm:
+                align_texts(*self.inputs(['a', 'a']))
+
+        self.assertEqual(cm.exception.results, [cm.exception, None])
+
+    def test_arguments_are_validated_before_any_alignment(self):
+        with patch('webmaus.simple_align.align_text') as align_text:
+            with self.assertRaises(ValueError):
+                align_texts(['a', 'b'], ['0.wav', '1.wav'],
+                    ['0.TextGrid', 'no_extension'], max_workers = 2)
+
+        align_text.assert_not_called()
+
+    def test_generator_yields_in_completion_order(self):
+        with patch('webmaus.simple_align.align_text', fake_align_text):
+            results = list(iter_align_texts(*self.inputs(['a'] * 5),
+                max_workers = 5))
+
+        self.assertEqual(results[0], (4, '4.TextGrid'))
+        self.assertEqual(sorted(results),
+            [(i, f'{i}.TextGrid') for i in range(5)])
+
+    def test_generator_can_fail_fast(self):
+        with patch('webmaus.simple_align.align_text', fake_align_text):
+            with self.assertRaises(RuntimeError):
+                list(iter_align_texts(*self.inputs(['fail', 'a']),
+                    max_workers = 2, fail_fast = True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+
+import numpy as np
+
+from webmaus import textgrid
+from webmaus.connector import Response
+
+
+TEXTGRID = '''File type = "ooTextFile"
+Object class = "TextGrid"
+
+xmin = 0
+xmax = 1.5
+tiers? <exists>
+size = 2
+item []:
+    item [1]:
+        class = "IntervalTier"
+        name = "ORT-MAU"
+        xmin = 0
+        xmax = 1.5
+        intervals: size = 4
+        intervals [1]:
+            xmin = 0
+            xmax = 0.25
+            text = ""
+        intervals [2]:
+            xmin = 0.25
+            xmax = 0.8
+            text = "dit"
+        intervals [3]:
+            xmin = 0.8
+            xmax = 1.2
+            text = """is"""
+        intervals [4]:
+            xmin = 1.2
+            xmax = 1.5
+            text = ""
+    item [2]:
+        class = "TextTier"
+        name = "points"
+        xmin = 0
+        xmax = 1.5
+        points: size = 1
+        points [1]:
+            number = 0.5
+            mark = "dit"
+'''
+
+
+class AlignmentTests(unittest.TestCase):
+    def test_tiers_are_array_backed_with_interned_labels(self):
+        alignment = textgrid.Alignment.from_text(TEXTGRID)
+        words = alignment['ORT-MAU']
+
+        self.assertEqual(alignment.tier_names, ['ORT-MAU', 'points'])
+        self.assertEqual(words.start.dtype, np.float64)
+        np.testing.assert_array_equal(words.end, [0.25, 0.8, 1.2, 1.5])
+        self.assertEqual(words.labels, ['', 'dit', '"is"', ''])
+        self.assertEqual(alignment.labels, ['', 'dit', '"is"'])
+        np.testing.assert_array_equal(words.find(''), [0, 3])
+        self.assertEqual(words[1], (0.25, 0.8, 'dit'))
+        self.assertEqual(alignment['points'][0], (0.5, 'dit'))
+        self.assertEqual(alignment['points'].label_index[0],
+            words.label_index[1])
+
+    def test_header_only_read_parses_items_on_access(self):
+        alignment = textgrid.Alignment.from_text(TEXTGRID, header_only=True)
+        words = alignment['ORT-MAU']
+
+        self.assertFalse(words.loaded)
+        self.assertEqual((len(words), words.xmax), (4, 1.5))
+        self.assertEqual(alignment.labels, [])
+        self.assertAlmostEqual(words.durations.sum(), 1.5)
+        self.assertTrue(words.loaded)
+
+    def test_round_trip_through_text(self):
+        alignment = textgrid.Alignment.from_text(TEXTGRID)
+        again = textgrid.Alignment.from_text(alignment.to_text())
+
+        self.assertEqual(again.to_dict(), alignment.to_dict())
+        self.assertEqual(textgrid.Alignment.from_dict(
+            alignment.to_dict()).to_dict(), alignment.to_dict())
+
+    def test_response_returns_alignment(self):
+        response = Response.from_output(TEXTGRID)
+
+        alignment = response.alignment()
+
+        self.assertEqual(alignment['ORT-MAU'].size, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,59 @@
-from .pipeline import Pipeline
-from . import utils
-from .connector import (
-    run_pipeline,
-    run_g2p_maus_phon2syl,
-)
-from .simple_align import align_text, align_texts
+import importlib
+
+# the public names are imported on first use, so that importing webmaus (or
+# a light submodule such as webmaus.cli) does not load numpy, soundfile,
+# lxml and requests
+_exports = {
+    "Pipeline": ".pipeline",
+    "AsyncPipeline": ".async_pipeline",
+    "run_pipeline": ".connector",
+    "arun_pipeline": ".connector",
+    "run_g2p_maus_phon2syl": ".connector",
+    "align_text": ".simple_align",
+    "align_texts": ".simple_align",
+    "iter_align_texts": ".simple_align",
+    "make_session": ".session",
+    "RetryPolicy": ".retry",
+    "ResultCache": ".cache",
+    "UploadProfile": ".audio",
+    "Corpus": ".corpus",
+    "Metrics": ".metrics",
+}
 
 __all__ = [
     "Pipeline",
+    "AsyncPipeline",
     "run_pipeline",
+    "arun_pipeline",
     "run_g2p_maus_phon2syl",
     "align_text",
     "align_texts",
+    "iter_align_texts",
+    "make_session",
+    "RetryPolicy",
+    "ResultCache",
+    "UploadProfile",
+    "Corpus",
+    "Metrics",
     'utils',
 ]
+
+
+def __getattr__(name):
+    if name in _exports:
+        module = importlib.import_module(_exports[name], __name__)
+        value = getattr(module, name)
+    else:
+        # submodules (webmaus.pipeline, webmaus.connector, ...) are
+        # attributes too, as they were when they were imported eagerly
+        try: value = importlib.import_module('.' + name, __name__)
+        except ModuleNotFoundError as e:
+            if e.name != f'{__name__}.{name}': raise
+            m = f'module {__name__!r} has no attribute {name!r}'
+            raise AttributeError(m) from None
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
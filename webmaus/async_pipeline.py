@@ -0,0 +1,170 @@
+import asyncio
+
+from .connector import arun_pipeline, make_output_filename
+from .connector import DEFAULT_TIMEOUT
+from .jobstore import JobStore
+from .output_index import OutputIndex
+from .pipeline import parse_entry, language_for
+from . import manifest
+from . import session as session_module
+
+
+class AsyncPipeline:
+    def __init__(self, files, output_directory, language,
+        output_format = 'TextGrid', pipe = 'G2P_MAUS_PHO2SYL',
+        preseg = 'true', language_dict = None, overwrite = False,
+        session = None, max_in_flight = 100, job_store = None,
+        output_index = None, retry_policy = None, timeout = DEFAULT_TIMEOUT):
+        '''Asyncio counterpart of Pipeline (requires aiohttp).
+        All uploads and downloads run on one event loop; a semaphore bounds
+        the number of jobs in flight. Arguments are the same as for
+        Pipeline, except:
+        session:            aiohttp.ClientSession shared by all jobs
+                            (default: one created for the duration of run)
+        max_in_flight:      maximum number of concurrent alignments
+        job_store:          jobstore.JobStore recording finished jobs
+        output_index:       optional path (or output_index.OutputIndex)
+                            persisting the index of existing outputs
+        retry_policy:       retry.RetryPolicy for uploads and downloads
+                            (default: retry.default_policy())
+        timeout:            (connect, read) seconds for every upload and
+                            download, so a stalled connection fails (and is
+                            retried) instead of holding a slot forever
+        '''
+        self.files = files
+        self.output_directory = output_directory
+        self.language = language
+        self.output_format = output_format
+        self.pipe = pipe
+        self.preseg = preseg
+        self.language_dict = language_dict
+        self.overwrite = overwrite
+        self.session = session
+        self.max_in_flight = max_in_flight
+        self.retry_policy = retry_policy
+        self.timeout = timeout
+        if not isinstance(output_index, OutputIndex):
+            output_index = OutputIndex(output_index)
+        self.output_index = output_index
+
+        self.jobs = JobStore() if job_store is None else job_store
+        self.done = self.jobs.view('done')
+        self.skipped = self.jobs.view('skipped')
+        self.errors = self.jobs.view('error')
+        self.infos = self.jobs.view(info = True)
+        self.in_flight = 0
+        self.output_directories = set()
+        self.running = False
+        self.status_done = False
+
+    def __repr__(self):
+        m = f'AsyncPipeline(language={self.language}, '
+        m += f'format={self.output_format}, '
+        m += f'pipe={self.pipe}, '
+        m += f'preseg={self.preseg})'
+        return m
+
+    async def run(self):
+        '''Align all files; returns when every job has finished.'''
+        self.running = True
+        self.status_done = False
+        own_session = self.session is None
+        if own_session:
+            self.session = session_module.make_async_session(
+                limit = self.max_in_flight, max_per_host = self.max_in_flight)
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        try:
+            entries, _ = manifest.open_manifest(self.files, count = False)
+            for entry in entries:
+                job = parse_entry(entry, self.output_directory)
+                audio_filename, _, start_time, end_time, _, \
+                    output_directory = job
+                self.output_directories.add(output_directory)
+                output_file = make_output_filename(output_directory,
+                    audio_filename, self.output_format, start_time, end_time)
+                if not self.overwrite and \
+                    self.output_index.exists(output_file):
+                    self.jobs.add('skipped', audio_filename, start_time,
+                        end_time, str(output_file))
+                    continue
+                # acquiring before creating the task keeps the number of
+                # pending tasks bounded for very long manifests
+                await semaphore.acquire()
+                task = asyncio.create_task(self._run_single(*job))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda t: semaphore.release())
+            if tasks: await asyncio.gather(*tasks)
+        finally:
+            if own_session:
+                await self.session.close()
+                self.session = None
+            if self.output_index.filename is not None:
+                self.output_index.save()
+        self.status_done = True
+        self.running = False
+        m = f'Done: {len(self.done)}, '
+        m += f'Skipped: {len(self.skipped)}, '
+        m += f'Errors: {len(self.errors)}'
+        print(m)
+
+    async def _run_single(self, audio_filename, text_filename,
+        start_time = None, end_time = None, text = None,
+        output_directory = None):
+        '''Run the forced alignment pipeline for a single audio-text pair.
+        '''
+        self.in_flight += 1
+        try:
+            f = await self._align(audio_filename, text_filename, start_time,
+                end_time, text, output_directory)
+        except Exception as e:
+            print(f'Error aligning {audio_filename}: {e}')
+            f = None
+        finally:
+            self.in_flight -= 1
+        if f is None:
+            self.jobs.add('error', audio_filename, start_time, end_time)
+            return
+        self.output_index.add(f)
+        self.jobs.add('done', audio_filename, start_time, end_time, f)
+
+    async def _align(self, audio_filename, text_filename, start_time,
+        end_time, text, output_directory):
+        language = language_for(audio_filename, self.language,
+            self.language_dict)
+        response = await arun_pipeline(
+            audio_filename=audio_filename,
+            text_filename=text_filename,
+            start_time=start_time,
+            end_time=end_time,
+            language=language,
+            output_format=self.output_format,
+            pipe=self.pipe,
+            preseg=self.preseg,
+            text=text,
+            session=self.session,
+            retry_policy=self.retry_policy,
+            timeout=self.timeout,
+        )
+        if response is None or not response.success: return None
+        output = await response.adownload(self.session)
+        if output is None: return None
+        if output_directory is None:
+            output_directory = self.output_directory
+        return await asyncio.to_thread(response.save_alignment,
+            output_directory = output_directory,
+            audio_filename = audio_filename, start_time = start_time,
+            end_time = end_time, output_format = self.output_format)
+
+    @property
+    def done_infos(self):
+        return list(self.jobs.view('done', info = True))
+
+    @property
+    def error_infos(self):
+        return list(self.jobs.view('error', info = True))
+
+    @property
+    def skipped_infos(self):
+        return list(self.jobs.view('skipped', info = True))
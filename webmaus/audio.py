@@ -1,22 +1,258 @@
+from collections import OrderedDict
 import io
 from pathlib import Path
-import soundfile as sf
+import struct
+import threading
+
+from . import metrics
+
+# numpy and soundfile are imported by the functions that decode, encode or
+# resample, so slicing PCM WAV segments (load_pcm_segment) and importing
+# the pipeline do not load them
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
 
 def load_partial_audio_in_bytes_buffer(filename, start_time=0.0, end_time=None, 
-    format='WAV', verbose=False):
+    format='WAV', verbose=False, profile=None):
     '''Load a portion of an audio file into an in-memory bytes buffer.
     filename:           path to the audio file
     start_time:        start time in seconds to load from
     end_time:          end time in seconds to load to (None to load to end)
+    profile:           optional UploadProfile to resample, downmix and
+                       encode the audio with (overrides format)
     Returns: BytesIO buffer containing the audio data
+    Uncompressed PCM WAV files are sliced without decoding (see
+    load_pcm_segment); other formats are decoded and re-encoded.
     '''
-    signal, sample_rate = load_audio(filename, start_time, end_time)
-    buffer = audio_to_buffer(signal, sample_rate, format=format)
-    name = Path(filename).name
-    buffer.name = name
+    if start_time is None: start_time = 0.0
+    buffer = None
+    if profile is None and format.upper() == 'WAV':
+        buffer = load_pcm_segment(filename, start_time, end_time)
+    if buffer is None:
+        signal, sample_rate = load_audio(filename, start_time, end_time)
+        if profile is None:
+            buffer = audio_to_buffer(signal, sample_rate, format=format)
+        else: buffer = profile.encode(signal, sample_rate)
+    buffer.name = _buffer_name(filename, profile)
     if verbose: print('Created in-memory audio buffer')
     return buffer
 
+def load_audio_for_upload(filename, profile):
+    '''Load a whole audio file and encode it with an UploadProfile.
+    Returns: BytesIO buffer; its original_size attribute holds the size of
+             the file on disk
+    '''
+    buffer = load_partial_audio_in_bytes_buffer(filename, profile=profile)
+    buffer.original_size = Path(filename).stat().st_size
+    return buffer
+
+def _buffer_name(filename, profile = None):
+    if profile is None: return Path(filename).name
+    # the service detects the audio type from the file extension
+    return Path(filename).stem + '.' + profile.format.lower()
+
+
+# output formats that express time in (milli)seconds; sample based formats
+# (bpf, par, csv, emuDB) would refer to the uploaded sample rate
+TIME_BASED_OUTPUT_FORMATS = ('TextGrid', 'eaf', 'exb')
+
+
+class UploadProfile:
+    def __init__(self, sample_rate = 16000, mono = True, format = 'FLAC',
+        subtype = 'PCM_16'):
+        '''Reduce the size of uploaded audio; MAUS only needs 16 kHz mono.
+        sample_rate:        target sample rate (None keeps the original;
+                            audio is never upsampled)
+        mono:               downmix to a single channel
+        format:             container to upload, lossless 'FLAC' by default
+        subtype:            sample format within the container
+        '''
+        self.sample_rate = sample_rate
+        self.mono = mono
+        self.format = format
+        self.subtype = subtype
+
+    def __repr__(self):
+        m = f'UploadProfile(sample_rate={self.sample_rate}, mono={self.mono}, '
+        m += f'format={self.format})'
+        return m
+
+    def for_output_format(self, output_format):
+        '''Return the profile to use for a requested output format.
+        Resampling is only applied to formats with timestamps in seconds,
+        so sample based timestamps keep referring to the original rate.
+        '''
+        if output_format in TIME_BASED_OUTPUT_FORMATS: return self
+        return UploadProfile(None, self.mono, self.format, self.subtype)
+
+    def encode(self, signal, sample_rate):
+        '''Encode a float signal according to the profile.
+        Returns: BytesIO buffer; its original_size attribute holds the size
+                 the signal would have as 16 bit WAV
+        '''
+        import soundfile as sf
+        channels = 1 if signal.ndim == 1 else signal.shape[1]
+        original_size = 44 + len(signal) * channels * 2
+        with metrics.stage('encode') as span:
+            if self.mono and signal.ndim == 2: signal = signal.mean(axis = 1)
+            if self.sample_rate and sample_rate > self.sample_rate:
+                signal = resample(signal, sample_rate, self.sample_rate)
+                sample_rate = self.sample_rate
+            buffer = io.BytesIO()
+            sf.write(buffer, signal, sample_rate, format = self.format,
+                subtype = self.subtype)
+            if span is not None: span.bytes = buffer.tell()
+        buffer.seek(0)
+        buffer.original_size = original_size
+        return buffer
+
+
+def resample(signal, sample_rate, target_rate, zero_crossings = 16):
+    '''Downsample a signal: windowed-sinc low-pass filter below the new
+    Nyquist frequency followed by linear interpolation onto the new time
+    grid. Duration (and therefore every timestamp) is preserved.
+    signal:             numpy array (frames,) or (frames, channels)
+    sample_rate:        sample rate of signal
+    target_rate:        new (lower) sample rate
+    zero_crossings:     filter length in zero crossings of the sinc
+    Returns: float32 numpy array at target_rate
+    '''
+    import numpy as np
+    if target_rate >= sample_rate: return signal
+    if signal.ndim == 2:
+        return np.stack([resample(c, sample_rate, target_rate,
+            zero_crossings) for c in signal.T], axis = 1)
+    ratio = target_rate / sample_rate
+    cutoff = 0.5 * ratio * 0.95
+    n_taps = int(zero_crossings / ratio) | 1
+    t = np.arange(n_taps) - (n_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * t) * np.blackman(n_taps)
+    taps /= taps.sum()
+    filtered = _fir_filter(signal.astype(np.float64), taps)
+    n_out = int(round(len(signal) * ratio))
+    positions = np.arange(n_out) / ratio
+    resampled = np.interp(positions, np.arange(len(signal)), filtered)
+    return resampled.astype(np.float32)
+
+def _fir_filter(x, taps, block_size = 1 << 16):
+    '''Zero-phase FIR filter via blockwise FFT convolution (overlap-add).'''
+    import numpy as np
+    m = len(taps)
+    n_fft = 1 << int(np.ceil(np.log2(block_size + m - 1)))
+    block = n_fft - m + 1
+    spectrum = np.fft.rfft(taps, n_fft)
+    y = np.zeros(len(x) + m - 1)
+    for i in range(0, len(x), block):
+        segment = x[i:i + block]
+        n = len(segment) + m - 1
+        y[i:i + n] += np.fft.irfft(np.fft.rfft(segment, n_fft) * spectrum,
+            n_fft)[:n]
+    delay = (m - 1) // 2
+    return y[delay:delay + len(x)]
+
+class SegmentReader:
+    def __init__(self, max_open = 16):
+        '''Serve many segments of the same recordings from open handles.
+        Keeps an LRU of at most max_open open audio files, so the file is
+        opened and its header parsed once instead of for every segment.
+        Safe to use from several threads.
+        max_open:           maximum number of files kept open
+        '''
+        self.max_open = max_open
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def __repr__(self):
+        return f'SegmentReader(open={len(self._handles)}, opened={self.opened})'
+
+    def read(self, filename, start_time=0.0, end_time=None, format='WAV',
+        profile=None):
+        '''Drop-in replacement for load_partial_audio_in_bytes_buffer.'''
+        if start_time is None: start_time = 0.0
+        handle = self._handle(filename)
+        pcm = handle.info is not None and format.upper() == 'WAV' \
+            and profile is None
+        with handle.lock:
+            if handle.closed: return self.read(filename, start_time,
+                end_time, format, profile)
+            if pcm: buffer = _read_pcm_segment(handle.file, handle.info,
+                start_time, end_time)
+            else: signal, sample_rate = _read_soundfile(handle.soundfile(),
+                start_time, end_time)
+        # encoding happens outside the lock so segments of one recording
+        # can be encoded in parallel
+        if not pcm and profile is None:
+            buffer = audio_to_buffer(signal, sample_rate, format=format)
+        elif not pcm: buffer = profile.encode(signal, sample_rate)
+        buffer.name = _buffer_name(filename, profile)
+        return buffer
+
+    def close(self):
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+        for handle in handles: handle.close()
+
+    def _handle(self, filename):
+        key = str(filename)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None:
+                self._handles.move_to_end(key)
+                return handle
+            handle = _AudioHandle(key)
+            self.opened += 1
+            self._handles[key] = handle
+            evicted = []
+            while len(self._handles) > self.max_open:
+                evicted.append(self._handles.popitem(last = False)[1])
+        for old in evicted: old.close()
+        return handle
+
+
+class _AudioHandle:
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.closed = False
+        self.file = open(filename, 'rb')
+        self.info = read_wav_header(self.file)
+        self._soundfile = None
+
+    def soundfile(self):
+        import soundfile as sf
+        if self._soundfile is None:
+            self.file.seek(0)
+            self._soundfile = sf.SoundFile(self.file)
+        return self._soundfile
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self._soundfile is not None: self._soundfile.close()
+            self.file.close()
+
+
+def duration(filename, start_time=None, end_time=None):
+    '''Seconds of audio a job covers; the file header is only read when
+    the segment has no end time (PCM WAV headers without soundfile).
+    Returns: seconds or None if the file cannot be read
+    '''
+    start_time = start_time or 0.0
+    if end_time is None:
+        try: end_time = _file_duration(filename)
+        except (RuntimeError, OSError, TypeError): return None
+    return max(0.0, end_time - start_time)
+
+def _file_duration(filename):
+    with open(filename, 'rb') as f: info = read_wav_header(f)
+    if info is not None:
+        sample_rate, _, _, block_align, _, data_size = info
+        return data_size // block_align / sample_rate
+    import soundfile as sf
+    return sf.info(filename).duration
+
 def load_audio(filename, start_time=0.0, end_time=None, verbose=False):
     '''Load an audio file and return the audio data and sample rate.
     filename:           path to the audio file
@@ -28,21 +264,23 @@ def load_audio(filename, start_time=0.0, end_time=None, verbose=False):
     m = f'Loading audio from {filename}, start_time={start_time}, '
     m += f'end_time={end_time}'
     if verbose: print(m)
-    sample_rate = None
-    signal = None
+    import soundfile as sf
     with sf.SoundFile(filename) as f:
-        sample_rate = f.samplerate
-        if start_time > 0.0:
-            f.seek(int(start_time * sample_rate))
-        if end_time is not None:
-            num_frames = int((end_time - start_time) * sample_rate)
-            signal = f.read(frames=num_frames, dtype='float32')
-        else:
-            signal = f.read(dtype='float32')
+        signal, sample_rate = _read_soundfile(f, start_time, end_time)
     if signal is None:
         raise ValueError(f'Could not load audio signal from file. {filename}')
     return signal, sample_rate
 
+def _read_soundfile(f, start_time, end_time):
+    sample_rate = f.samplerate
+    f.seek(int(start_time * sample_rate) if start_time > 0.0 else 0)
+    if end_time is not None:
+        num_frames = int((end_time - start_time) * sample_rate)
+        signal = f.read(frames=num_frames, dtype='float32')
+    else:
+        signal = f.read(dtype='float32')
+    return signal, sample_rate
+
 def audio_to_buffer(signal, sample_rate, format='WAV'):
     '''Convert audio signal to an in-memory buffer.
     signal:             numpy array of audio data
@@ -51,10 +289,81 @@ def audio_to_buffer(signal, sample_rate, format='WAV'):
 
     Returns: BytesIO buffer containing the audio data
     '''
+    import soundfile as sf
     buffer = io.BytesIO()
     sf.write(buffer, signal, sample_rate, format=format)
     buffer.seek(0)
     return buffer
 
-    
+def load_pcm_segment(filename, start_time=0.0, end_time=None):
+    '''Slice a PCM WAV file into a WAV buffer without decoding samples.
+    The byte range of the segment is computed from the header and read
+    straight into a buffer behind a freshly written header.
+    filename:           path to the audio file
+    start_time:        start time in seconds
+    end_time:          end time in seconds (None to read to the end)
+
+    Returns: BytesIO buffer with the segment, or None if the file is not
+             an uncompressed PCM WAV file
+    '''
+    with open(filename, 'rb') as f:
+        info = read_wav_header(f)
+        if info is None: return None
+        return _read_pcm_segment(f, info, start_time, end_time)
+
+def _read_pcm_segment(f, info, start_time, end_time):
+    sample_rate, channels, bits, block_align, data_offset, data_size = info
+    total_frames = data_size // block_align
+    start_frame = min(int(start_time * sample_rate), total_frames)
+    if end_time is None: num_frames = total_frames - start_frame
+    else: num_frames = int((end_time - start_time) * sample_rate)
+    num_frames = max(0, min(num_frames, total_frames - start_frame))
+    size = num_frames * block_align
+    header = make_wav_header(sample_rate, channels, bits, size)
+    data = bytearray(len(header) + size)
+    data[:len(header)] = header
+    f.seek(data_offset + start_frame * block_align)
+    n = f.readinto(memoryview(data)[len(header):])
+    if n < size: del data[len(header) + n:]
+    return io.BytesIO(data)
+
+def read_wav_header(f):
+    '''Parse the header of an uncompressed PCM WAV file.
+    f:                  binary file object positioned at the start
+
+    Returns: sample_rate, channels, bits per sample, block_align,
+             data offset, data size; or None if f is not PCM WAV
+    '''
+    riff = f.read(12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        return None
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8: return None
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            fmt = f.read(chunk_size)
+            if chunk_size % 2: f.seek(1, 1)
+        elif chunk_id == b'data':
+            break
+        else: f.seek(chunk_size + chunk_size % 2, 1)
+    if fmt is None or len(fmt) < 16: return None
+    format_tag, channels, sample_rate, _, block_align, bits = struct.unpack(
+        '<HHIIHH', fmt[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        format_tag = struct.unpack('<H', fmt[24:26])[0]
+    if format_tag != WAVE_FORMAT_PCM or block_align == 0: return None
+    data_offset = f.tell()
+    file_size = f.seek(0, 2)
+    # streaming writers leave the data size at 0 or 0xFFFFFFFF
+    data_size = min(chunk_size, file_size - data_offset)
+    if chunk_size in (0, 0xFFFFFFFF): data_size = file_size - data_offset
+    return sample_rate, channels, bits, block_align, data_offset, data_size
 
+def make_wav_header(sample_rate, channels, bits, data_size):
+    '''Return a 44 byte PCM WAV header for data_size bytes of samples.'''
+    block_align = channels * ((bits + 7) // 8)
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size,
+        b'WAVE', b'fmt ', 16, WAVE_FORMAT_PCM, channels, sample_rate,
+        sample_rate * block_align, block_align, bits, b'data', data_size)
@@ -0,0 +1,223 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from . import connector
+from . import metrics
+from . import textgrid
+from .utils import process_context
+
+
+class Backend:
+    '''Interface of the services run_pipeline can dispatch an alignment to.
+    A backend implements run, which takes the arguments of run_pipeline
+    (without backend) and returns a connector.Response or None.
+    '''
+    name = 'backend'
+
+    def run(self, **kwargs):
+        raise NotImplementedError
+
+    def load_indicator(self, session = None):
+        '''Load of the service: 0 (low), 1 (medium), 2 (high) or None.'''
+        return None
+
+    def close(self):
+        '''Release the resources of the backend; a Pipeline calls it at the
+        end of every run, so a later run must reacquire them.
+        '''
+        pass
+
+
+class BASBackend(Backend):
+    name = 'bas'
+
+    def __init__(self, url = connector.PIPELINE_URL,
+        load_indicator_url = connector.LOAD_INDICATOR_URL):
+        '''The BAS runPipeline web service (the default backend).
+        url:                runPipeline url
+        load_indicator_url: getLoadIndicator url
+        '''
+        self.url = url
+        self.load_indicator_url = load_indicator_url
+
+    def __repr__(self):
+        return f'BASBackend({self.url})'
+
+    def run(self, **kwargs):
+        kwargs.setdefault('url', self.url)
+        return connector.run_pipeline(**kwargs)
+
+    def load_indicator(self, session = None):
+        return connector.get_load_indicator(session, self.load_indicator_url)
+
+
+class LocalBackend(Backend):
+    name = 'local'
+
+    def __init__(self, command, max_workers = None, timeout = None):
+        '''Run a locally installed aligner, without any http.
+        Every request is written to a temporary directory (the audio is
+        sliced and converted exactly as for an upload) and the aligner runs
+        in a process pool, so alignments use all cores and never hold the
+        GIL of the calling threads.
+        command:            list of command line arguments; the fields
+                            {audio}, {text}, {output}, {language},
+                            {output_format}, {pipe}, {preseg} and
+                            {output_symbol} are filled in per request, e.g.
+                            ['maus', 'SIGNAL={audio}', 'BPF={text}',
+                            'OUT={output}', 'LANGUAGE={language}'];
+                            or a picklable function called with the same
+                            fields as keyword arguments that writes {output}
+        max_workers:        number of processes (default: number of cores);
+                            0 runs the aligner in the calling thread
+        timeout:            seconds an alignment may take
+        '''
+        self.command = command
+        if max_workers is None: max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.command}, ' \
+            f'max_workers={self.max_workers})'
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None and self.max_workers > 0:
+                self._executor = ProcessPoolExecutor(self.max_workers,
+                    mp_context = process_context())
+            return self._executor
+
+    def close(self):
+        '''Shut down the process pool (it is restarted on the next run).'''
+        with self._lock:
+            if self._executor is not None: self._executor.shutdown()
+            self._executor = None
+
+    def run(self, audio_filename, text_filename, language, start_time = None,
+        end_time = None, output_format = 'TextGrid',
+        pipe = 'G2P_MAUS_PHO2SYL', preseg = 'true', output_symbol = 'ipa',
+        text = None, cache = None, segment_reader = None,
+        upload_profile = None, **kwargs):
+        '''Align one request locally; arguments as for run_pipeline, the
+        http related ones (session, url, retry_policy, circuit_breaker,
+        timeout) are ignored; see the timeout of the backend instead.
+        Returns: Response with the output, or a failed Response holding the
+                 error message
+        '''
+        with metrics.stage('load'):
+            files, data = connector._make_request(audio_filename,
+                text_filename, language, start_time, end_time, output_format,
+                pipe, preseg, output_symbol, text, segment_reader,
+                upload_profile)
+        directory = tempfile.mkdtemp(prefix = 'webmaus-')
+        try:
+            if cache is not None:
+                cache_key = cache.make_key(files, dict(data,
+                    BACKEND = repr(self.command)))
+                output = cache.get(cache_key)
+                if output is not None:
+                    response = connector.Response.from_output(output)
+                    response.cached = True
+                    return response
+            fields = {
+                'audio': _save(files['SIGNAL'], directory, 'signal.wav'),
+                'text': _save(files['TEXT'], directory, 'text.txt'),
+                'output': os.path.join(directory, 'output.' + output_format),
+                'language': language, 'output_format': output_format,
+                'pipe': pipe, 'preseg': preseg, 'output_symbol': output_symbol,
+                }
+            connector._close_files(files)
+            # the local aligner takes the place of the server
+            with metrics.stage('server_wait'):
+                if self.max_workers == 0:
+                    error = _align(self.command, fields, self.timeout)
+                else:
+                    error = self.executor.submit(_align, self.command, fields,
+                        self.timeout).result()
+            if error is not None:
+                return connector.Response.from_error(error)
+            output = Path(fields['output']).read_text()
+            if cache is not None: cache.put(cache_key, output)
+            return connector.Response.from_output(output)
+        finally:
+            connector._close_files(files)
+            shutil.rmtree(directory, ignore_errors = True)
+
+
+class FakeBackend(LocalBackend):
+    name = 'fake'
+
+    def __init__(self, max_workers = 0):
+        '''Local backend that needs no aligner: the words of the text are
+        spread evenly over the audio and the letters of every word over
+        the word (see fake_align). Meant for tests and dry runs.
+        max_workers:        number of processes (default: 0, run in the
+                            calling thread)
+        '''
+        super().__init__(fake_align, max_workers)
+
+    def __repr__(self):
+        return f'FakeBackend(max_workers={self.max_workers})'
+
+
+def fake_align(audio, text, output, output_format = 'TextGrid', **kwargs):
+    '''Write an evenly spaced word and phone TextGrid for audio and text.'''
+    import soundfile as sf
+    if output_format != 'TextGrid':
+        raise ValueError('the fake aligner only writes TextGrids')
+    duration = sf.info(audio).duration
+    words = Path(text).read_text().split()
+    word_items, phone_items = [], []
+    step = duration / max(1, len(words))
+    for i, word in enumerate(words):
+        start = i * step
+        word_items.append((start, start + step, word))
+        phone_step = step / len(word)
+        phone_items += [(start + j * phone_step, start + (j + 1) * phone_step,
+            letter) for j, letter in enumerate(word)]
+    if not words: word_items = phone_items = [(0.0, duration, '')]
+    tiers = [{'class': 'IntervalTier', 'name': name, 'xmin': 0.0,
+        'xmax': duration, 'items': items}
+        for name, items in (('ORT-MAU', word_items), ('MAU', phone_items))]
+    Path(output).write_text(textgrid.write_textgrid({'xmin': 0.0,
+        'xmax': duration, 'tiers': tiers}))
+
+
+def _align(command, fields, timeout = None):
+    '''Run the aligner (in a pool process).
+    Returns: None on success, otherwise the error message
+    '''
+    try:
+        if callable(command): command(**fields)
+        else:
+            arguments = [argument.format(**fields) for argument in command]
+            result = subprocess.run(arguments, capture_output = True,
+                text = True, timeout = timeout)
+            if result.returncode != 0:
+                m = f'{arguments[0]} exited with {result.returncode}: '
+                m += result.stderr.strip()
+                return m
+    except Exception as e:
+        return repr(e)
+    if not os.path.exists(fields['output']):
+        return 'the aligner did not write ' + fields['output']
+    return None
+
+
+def _save(f, directory, default_name):
+    name = Path(getattr(f, 'name', '') or default_name).name
+    if not Path(name).suffix: name = default_name
+    filename = os.path.join(directory, name)
+    f.seek(0)
+    with open(filename, 'wb') as fout:
+        shutil.copyfileobj(f, fout)
+    return filename
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+class ResultCache:
+    def __init__(self, directory, max_bytes = DEFAULT_MAX_BYTES):
+        '''Content addressed on-disk cache for alignment results.
+        Entries are keyed by a hash of the exact request payload (audio
+        bytes, text bytes and form fields). Reads refresh the modification
+        time, and the least recently used entries are evicted once the
+        cache grows beyond max_bytes.
+        directory:          directory to store the cache in
+        max_bytes:          size limit of the cache in bytes
+        '''
+        self.directory = Path(directory)
+        self.directory.mkdir(parents = True, exist_ok = True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.size = sum(p.stat().st_size for p in self._entries())
+
+    def __repr__(self):
+        m = f'ResultCache({self.directory}, hits={self.hits}, '
+        m += f'misses={self.misses}, size={self.size})'
+        return m
+
+    def __contains__(self, key):
+        return self._path(key).exists()
+
+    def make_key(self, files, data):
+        '''Hash the request payload.
+        files:              dict of file like objects that will be uploaded
+                            (read completely and rewound)
+        data:               dict of form fields
+        Returns: hex digest
+        '''
+        h = hashlib.sha256()
+        for name in sorted(data):
+            h.update(f'{name}={data[name]}\n'.encode())
+        for name in sorted(files):
+            f = files[name]
+            f.seek(0)
+            h.update(name.encode() + b'\n')
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+            f.seek(0)
+        return h.hexdigest()
+
+    def get(self, key):
+        '''Return the cached result for key or None.'''
+        path = self._path(key)
+        try:
+            output = path.read_text()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock: self.misses += 1
+            return None
+        with self._lock: self.hits += 1
+        return output
+
+    def put(self, key, output):
+        '''Store a result and evict old entries if the cache is too large.'''
+        path = self._path(key)
+        path.parent.mkdir(exist_ok = True)
+        fd, tmp = tempfile.mkstemp(dir = path.parent, suffix = '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(output.encode())
+        self._add(tmp, path)
+
+    def put_file(self, key, filename):
+        '''Store a result that was saved to filename (without reading it
+        into memory).
+        '''
+        path = self._path(key)
+        path.parent.mkdir(exist_ok = True)
+        fd, tmp = tempfile.mkstemp(dir = path.parent, suffix = '.tmp')
+        os.close(fd)
+        shutil.copyfile(filename, tmp)
+        self._add(tmp, path)
+
+    def _add(self, tmp, path):
+        size = os.path.getsize(tmp)
+        old_size = path.stat().st_size if path.exists() else 0
+        os.replace(tmp, path)
+        with self._lock:
+            self.size += size - old_size
+            if self.size > self.max_bytes: self._evict()
+
+    def _evict(self):
+        entries = []
+        for p in self._entries():
+            try: stat = p.stat()
+            except FileNotFoundError: continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, p in entries:
+            if self.size <= target: break
+            try: p.unlink()
+            except FileNotFoundError: pass
+            self.size -= size
+
+    def _entries(self):
+        return (p for p in self.directory.glob('??/*') if p.suffix != '.tmp')
+
+    def _path(self, key):
+        return self.directory / key[:2] / key
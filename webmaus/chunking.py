@@ -0,0 +1,183 @@
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from . import textgrid
+from .connector import make_output_filename, _write_atomic
+from .pipeline import Pipeline
+
+
+def frame_samples(hop, sample_rate):
+    '''Number of samples of a frame of hop seconds; the frames are a whole
+    number of samples, so their true duration is frame_samples / sample_rate
+    rather than hop.
+    '''
+    return max(1, int(round(hop * sample_rate)))
+
+
+def frame_energy(filename, hop = 0.01, block_seconds = 600):
+    '''Compute the energy (dB) of consecutive non-overlapping frames of
+    frame_samples(hop, sample_rate) samples each.
+    The recording is read in blocks of whole frames, downmixed and framed
+    with a reshape, so multi-hour files never sit in memory whole and frame
+    i always starts at sample i * frame_samples.
+    filename:           path to the audio file
+    hop:                frame length in seconds
+    block_seconds:      seconds of audio read per block
+    Returns: numpy array with the energy of every frame in dB
+    '''
+    energies = []
+    with sf.SoundFile(filename) as f:
+        frame_length = frame_samples(hop, f.samplerate)
+        block_frames = max(1,
+            int(block_seconds * f.samplerate) // frame_length)
+        while True:
+            signal = f.read(block_frames * frame_length)
+            if signal.ndim == 2: signal = signal.mean(axis = 1)
+            n = len(signal) // frame_length
+            if n == 0: break
+            frames = signal[:n * frame_length].reshape(n, frame_length)
+            energies.append(10 * np.log10(np.mean(frames ** 2, axis = 1)
+                + 1e-10))
+    if not energies: return np.zeros(0)
+    return np.concatenate(energies)
+
+
+def find_split_points(energy, hop = 0.01, max_chunk_seconds = 300,
+    search_seconds = 60, smooth_seconds = 0.3, sample_rate = None):
+    '''Choose split times at low-energy points (pauses).
+    Each chunk is at most max_chunk_seconds long; the split is placed at
+    the quietest point of the last search_seconds before that limit.
+    energy:             frame energies in dB (see frame_energy)
+    hop:                frame length in seconds
+    max_chunk_seconds:  maximum chunk duration
+    search_seconds:     length of the window searched for a pause
+    smooth_seconds:     energy is averaged over this many seconds so a
+                        pause is preferred over a single quiet frame
+    sample_rate:        sample rate the energy was computed at; the split
+                        times are then the exact times of the first sample
+                        of a frame (split sample / sample_rate) instead of
+                        multiples of hop, which drift from the frames
+    Returns: list of split times in seconds
+    '''
+    if sample_rate is not None:
+        frame_length = frame_samples(hop, sample_rate)
+        hop = frame_length / sample_rate
+    k = max(1, int(round(smooth_seconds / hop)))
+    smoothed = np.convolve(energy, np.ones(k) / k, mode = 'same')
+    max_frames = int(max_chunk_seconds / hop)
+    search_frames = min(int(search_seconds / hop), max_frames - 1)
+    splits = []
+    start = 0
+    while len(energy) - start > max_frames:
+        window_start = start + max_frames - search_frames
+        window = smoothed[window_start:start + max_frames]
+        split = window_start + int(np.argmin(window))
+        if sample_rate is None: splits.append(split * hop)
+        else: splits.append(split * frame_length / sample_rate)
+        start = split
+    return splits
+
+
+def distribute_words(words, energy, splits, hop = 0.01, threshold_db = 10):
+    '''Divide the transcript over the chunks by their amount of speech.
+    Assuming a constant speaking rate, the share of words of a chunk equals
+    its share of frames that are threshold_db above the noise floor.
+    A chunk without speech gets an empty transcript (see
+    merge_empty_chunks).
+    words:              list of words of the transcript
+    energy:             frame energies in dB
+    splits:             split times in seconds
+    hop:                frame duration in seconds
+    Returns: list with one transcript string per chunk
+    '''
+    floor = np.percentile(energy, 10) if len(energy) else 0
+    active = np.cumsum(energy > floor + threshold_db)
+    total = active[-1] if len(active) and active[-1] > 0 else 1
+    boundaries = [0]
+    for split in splits:
+        index = min(len(active) - 1, int(round(split / hop)))
+        boundaries.append(int(round(len(words) * active[index] / total)))
+    boundaries.append(len(words))
+    return [' '.join(words[a:b]) for a, b in zip(boundaries, boundaries[1:])]
+
+
+def merge_empty_chunks(splits, texts):
+    '''Remove the splits next to chunks without words, joining each such
+    chunk to the following chunk (the last one to the preceding chunk), as
+    an empty transcript can not be aligned. A merged chunk can be longer
+    than max_chunk_seconds.
+    splits:             split times in seconds
+    texts:              transcript of every chunk (len(splits) + 1)
+    Returns: splits; texts
+    '''
+    splits, texts = list(splits), list(texts)
+    i = 0
+    while len(texts) > 1 and i < len(texts):
+        if texts[i].strip():
+            i += 1
+            continue
+        if i < len(splits): del splits[i]
+        else: del splits[i - 1]
+        del texts[i]
+    return splits, texts
+
+
+def align_long_recording(audio_filename, output_directory, language,
+    text = None, text_filename = None, max_chunk_seconds = 300,
+    search_seconds = 60, hop = 0.01, **pipeline_kwargs):
+    '''Align a long recording by splitting it into chunks at pauses.
+    The chunks are aligned in parallel with Pipeline and the per-chunk
+    TextGrids are stitched into one TextGrid with corrected time offsets,
+    saved under the same name a single request would produce.
+    audio_filename:     path to the audio file
+    output_directory:   directory to save the merged TextGrid
+    language:           language code
+    text:               transcription string (or use text_filename)
+    text_filename:      path to the transcription
+    max_chunk_seconds:  maximum chunk duration
+    search_seconds:     window before the limit searched for a pause
+    hop:                energy frame length in seconds
+    pipeline_kwargs:    passed on to Pipeline (e.g. max_workers, pipe)
+    Returns: filename of the merged TextGrid
+    '''
+    if text is None:
+        if text_filename is None:
+            raise ValueError('provide text or text_filename')
+        text = Path(text_filename).read_text()
+    info = sf.info(audio_filename)
+    duration = info.duration
+    energy = frame_energy(audio_filename, hop)
+    splits = find_split_points(energy, hop, max_chunk_seconds, search_seconds,
+        sample_rate = info.samplerate)
+    # the true frame duration, to map split times back to frames
+    frame_hop = frame_samples(hop, info.samplerate) / info.samplerate
+    texts = distribute_words(text.split(), energy, splits, frame_hop)
+    splits, texts = merge_empty_chunks(splits, texts)
+    bounds = list(zip([0.0] + splits, splits + [duration]))
+    with tempfile.TemporaryDirectory() as chunk_directory:
+        files = [{'audio_filename': audio_filename, 'start_time': start,
+            'end_time': end, 'text': chunk_text}
+            for (start, end), chunk_text in zip(bounds, texts)]
+        pipeline = Pipeline(files, chunk_directory, language,
+            output_format = 'TextGrid', **pipeline_kwargs)
+        pipeline.run()
+        pipeline.wait()
+        textgrids = []
+        for start, end in bounds:
+            filename = Path(make_output_filename(chunk_directory,
+                audio_filename, 'TextGrid', start, end))
+            if not filename.exists():
+                m = f'Alignment failed for chunk {start:.2f}-{end:.2f} s '
+                m += f'of {audio_filename}'
+                raise RuntimeError(m)
+            textgrids.append(textgrid.read_textgrid(filename.read_text()))
+    merged = textgrid.merge_textgrids(textgrids, [b[0] for b in bounds],
+        xmax = duration)
+    Path(output_directory).mkdir(parents = True, exist_ok = True)
+    output_file = make_output_filename(output_directory, audio_filename,
+        'TextGrid')
+    _write_atomic(output_file, [textgrid.write_textgrid(merged).encode()])
+    return output_file
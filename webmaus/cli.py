@@ -0,0 +1,211 @@
+'''Align all entries of a manifest in one process.
+
+The manifest is a CSV, TSV or JSONL file (optionally gzipped; - reads JSONL
+from stdin) with the keys of a Pipeline entry: audio_filename and
+text_filename or text, optionally start_time, end_time and
+output_directory. Entries are streamed into a Pipeline, so the interpreter
+and the imports are paid once for the whole batch instead of once per file.
+Progress is written to stderr while the jobs run, a throughput summary at
+the end.
+
+usage: webmaus MANIFEST OUTPUT_DIRECTORY LANGUAGE [--workers 9] [--adaptive]
+       [--journal jobs.sqlite] [--output-index index.json] [--overwrite]
+       [--cache DIRECTORY] [--upload-profile] [--local COMMAND | --fake]
+       [--shard I/N] [--claims PATH] [--progress-interval 10]
+'''
+import argparse
+import json
+import sys
+import time
+
+from .utils import languages, seconds_to_dd_hh_mm_ss
+
+# the Pipeline and everything it needs (numpy, soundfile, lxml, requests)
+# are imported in make_pipeline, after the arguments are parsed, so --help
+# and usage errors return at once
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(prog = 'webmaus',
+        description = __doc__.split('\n')[0])
+    parser.add_argument('manifest', help = 'csv, tsv or jsonl manifest '
+        '(optionally .gz), - for jsonl on stdin')
+    parser.add_argument('output_directory', help = 'directory to save output '
+        '(entries may set their own)')
+    parser.add_argument('language', help = 'language code (e.g. nld-NL) or '
+        'name (e.g. dutch)')
+    parser.add_argument('--output-format', default = 'TextGrid',
+        help = 'output format, or a comma separated list: the TextGrid is '
+        'then requested once and tiers-csv, tiers-json and tables are '
+        'derived locally')
+    parser.add_argument('--pipe', default = 'G2P_MAUS_PHO2SYL')
+    parser.add_argument('--preseg', default = 'true')
+    parser.add_argument('--workers', type = int, default = 9,
+        help = 'maximum number of concurrent alignments')
+    parser.add_argument('--adaptive', action = 'store_true',
+        help = 'adapt concurrency to the server load')
+    parser.add_argument('--journal', help = 'sqlite job journal; a rerun '
+        'resumes the unfinished jobs')
+    parser.add_argument('--output-index', help = 'json file persisting the '
+        'index of existing outputs between runs')
+    parser.add_argument('--overwrite', action = 'store_true',
+        help = 're-align entries whose output exists')
+    parser.add_argument('--cache', help = 'directory of a result cache')
+    parser.add_argument('--upload-profile', action = 'store_true',
+        help = 'upload 16 kHz mono FLAC')
+    parser.add_argument('--corpus', help = 'directory of a corpus every '
+        'TextGrid is added to')
+    parser.add_argument('--metrics', help = 'file the stage metrics are '
+        'written to (.json or prometheus text)')
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument('--local', metavar = 'COMMAND', help = 'align with '
+        'a local aligner instead of the BAS web service, e.g. "maus '
+        'SIGNAL={audio} BPF={text} OUT={output} LANGUAGE={language}"')
+    backend.add_argument('--fake', action = 'store_true', help = 'evenly '
+        'spaced dummy alignments (dry run, no aligner needed)')
+    parser.add_argument('--shard', type = parse_shard, metavar = 'I/N',
+        help = 'only align shard I of N (0 <= I < N)')
+    parser.add_argument('--claims', help = 'shared directory or .sqlite file '
+        'nodes claim jobs through')
+    parser.add_argument('--total', type = int, help = 'number of entries '
+        '(for progress when the manifest is read from stdin)')
+    parser.add_argument('--progress-interval', type = float, default = 10,
+        help = 'seconds between progress lines (0: none)')
+    parser.add_argument('--summary', help = 'json file the final summary is '
+        'written to')
+    return parser.parse_args(argv)
+
+
+def parse_shard(value):
+    try: index, count = map(int, value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected I/N, got {value!r}')
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f'shard {index} not in 0..{count-1}')
+    return index, count
+
+
+def make_pipeline(args):
+    '''Build the Pipeline for the parsed arguments.'''
+    from .pipeline import Pipeline
+    files = args.manifest
+    if files == '-':
+        files = (json.loads(line) for line in sys.stdin if line.strip())
+    backend = None
+    if args.local:
+        import shlex
+        from .backends import LocalBackend
+        backend = LocalBackend(shlex.split(args.local))
+    elif args.fake:
+        from .backends import FakeBackend
+        backend = FakeBackend()
+    cache = upload_profile = None
+    if args.cache:
+        from .cache import ResultCache
+        cache = ResultCache(args.cache)
+    if args.upload_profile:
+        from .audio import UploadProfile
+        upload_profile = UploadProfile()
+    output_format = args.output_format
+    if ',' in output_format: output_format = output_format.split(',')
+    return Pipeline(files, args.output_directory,
+        languages.get(args.language.lower(), args.language),
+        output_format = output_format, pipe = args.pipe,
+        preseg = args.preseg, overwrite = args.overwrite,
+        max_workers = args.workers, adaptive = args.adaptive,
+        cache = cache, journal = args.journal, upload_profile = upload_profile,
+        corpus = args.corpus, backend = backend,
+        metrics = True if args.metrics else None, total = args.total,
+        output_index = args.output_index, shard = args.shard,
+        claims = args.claims)
+
+
+def run(args, pipeline = None):
+    '''Run the batch; returns the summary dict.
+    pipeline:           Pipeline to run (default: make_pipeline(args))
+    '''
+    if pipeline is None: pipeline = make_pipeline(args)
+    start = time.time()
+    pipeline.run()
+    try:
+        interval = args.progress_interval
+        # also ends when the run thread died without finishing the run
+        while not pipeline.wait(interval or 1):
+            if not pipeline.run_thread.is_alive(): break
+            if interval:
+                print(progress_line(pipeline, start), file = sys.stderr,
+                    flush = True)
+    except KeyboardInterrupt:
+        print('Interrupted, waiting for started jobs...', file = sys.stderr)
+        pipeline.stop()
+        pipeline.wait()
+    if pipeline.manifest_error is not None:
+        print(f'error: {pipeline.manifest_error}', file = sys.stderr)
+    if args.metrics: pipeline.metrics.write(args.metrics)
+    return summary(pipeline, time.time() - start)
+
+
+def progress_line(pipeline, start):
+    tracker = getattr(pipeline, 'tracker', None)
+    elapsed = time.time() - start
+    done, errors = len(pipeline.done), len(pipeline.errors)
+    m = f'[{seconds_to_dd_hh_mm_ss(elapsed)}] done: {done}, '
+    m += f'skipped: {len(pipeline.skipped)}, errors: {errors}, '
+    m += f'{(done + errors) / max(elapsed, 1e-9):.2f} jobs/s'
+    if tracker is None: return m
+    if tracker.total: m += f', {tracker.percentage_done:.1f}%'
+    m += f', in flight: {tracker.in_flight}, ETA: {tracker.pretty_eta}'
+    return m
+
+
+def summary(pipeline, seconds):
+    '''Throughput summary of a finished run.'''
+    # no tracker if the run failed before scheduling a job
+    tracker = getattr(pipeline, 'tracker', None)
+    audio_seconds = 0.0 if tracker is None else tracker.done_seconds
+    done = len(pipeline.done)
+    error = pipeline.manifest_error
+    return {'done': done, 'skipped': len(pipeline.skipped),
+        'errors': len(pipeline.errors), 'seconds': seconds,
+        'jobs_per_second': done / seconds if seconds else 0.0,
+        'audio_seconds': audio_seconds,
+        'realtime_factor': audio_seconds / seconds if seconds else 0.0,
+        'bytes_uploaded': pipeline.upload_stats['bytes_uploaded'],
+        'complete': pipeline.status_done,
+        'error': None if error is None else str(error)}
+
+
+def print_summary(s, file = None):
+    m = f'aligned {s["done"]} files in '
+    m += f'{seconds_to_dd_hh_mm_ss(s["seconds"])} '
+    m += f'({s["jobs_per_second"]:.2f} files/s), '
+    m += f'{seconds_to_dd_hh_mm_ss(s["audio_seconds"])} of audio '
+    m += f'({s["realtime_factor"]:.1f}x realtime)\n'
+    m += f'skipped: {s["skipped"]}, errors: {s["errors"]}, '
+    m += f'uploaded: {s["bytes_uploaded"] / 1024 ** 2:.1f} MiB, '
+    m += f'complete: {s["complete"]}'
+    print(m, file = file)
+
+
+def main(argv = None):
+    '''Command line entry point; returns the exit status: 0 if every entry
+    was aligned or skipped, 1 if there were errors, the manifest could not
+    be read or the run did not complete, 2 if the manifest is missing or
+    its format unknown.
+    '''
+    args = parse_args(argv)
+    try: pipeline = make_pipeline(args)
+    except (OSError, ValueError) as e:
+        print(f'webmaus: error: {e}', file = sys.stderr)
+        return 2
+    s = run(args, pipeline)
+    print_summary(s, sys.stderr)
+    if args.summary:
+        from .connector import _write_atomic
+        _write_atomic(args.summary, [json.dumps(s).encode()])
+    ok = s['errors'] == 0 and s['complete'] and s['error'] is None
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import deque
+
+
+class AdaptiveConcurrency:
+    def __init__(self, min_limit = 1, max_limit = 32, initial_limit = 4,
+        increase = 1.0, decrease_factor = 0.5, latency_tolerance = 3.0,
+        cooldown = 10, load_indicator = None, poll_interval = 30,
+        latency_window = 100):
+        '''AIMD controller for the number of jobs in flight.
+        Every successful job grows the limit additively (by increase per
+        limit jobs, so roughly +increase per round trip). An error, a
+        latency well above the baseline latency, or a busy load indicator
+        shrinks it multiplicatively, at most once per cooldown.
+        Latencies are server seconds per second of audio (see
+        observe_latency); the baseline is the 10th percentile of the last
+        latency_window of them, so it follows a lasting change of the
+        server speed instead of holding on to one lucky request.
+        min_limit:          lower bound for the limit
+        max_limit:          upper bound for the limit (the worker pool size)
+        initial_limit:      limit to start with
+        increase:           additive increase per round of jobs
+        decrease_factor:    multiplicative decrease on congestion
+        latency_tolerance:  latency EWMA / baseline latency ratio that
+                            counts as congestion
+        cooldown:           minimum seconds between two decreases
+        load_indicator:     optional callable returning the server load
+                            (0 low, 1 medium, 2 high) or None if unknown
+        poll_interval:      seconds between load indicator polls
+        latency_window:     number of recent latencies the baseline is
+                            taken from
+        '''
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.load_indicator = load_indicator
+        self.poll_interval = poll_interval
+
+        self.in_flight = 0
+        self.load = None
+        self.latency = None
+        self.baseline_latency = None
+        self._latencies = deque(maxlen = latency_window)
+        self.error_rate = 0.0
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._poll_thread = None
+
+    def __repr__(self):
+        m = f'AdaptiveConcurrency(current={self.in_flight}, '
+        m += f'target={self.target}, load={self.load})'
+        return m
+
+    @property
+    def target(self):
+        return int(self.limit)
+
+    def start(self):
+        '''Start polling the load indicator in a background thread.'''
+        if self.load_indicator is None or self._poll_thread is not None:
+            return
+        self._stop.clear()
+        self._poll_thread = threading.Thread(target=self._poll, daemon=True)
+        self._poll_thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._poll_thread is not None:
+            self._poll_thread.join()
+            self._poll_thread = None
+
+    def acquire(self):
+        '''Block until a job may start.'''
+        with self._condition:
+            while self.in_flight >= self.target:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, success):
+        '''Report a finished job and adapt the limit.
+        success:            whether the job succeeded
+        '''
+        with self._condition:
+            self.in_flight -= 1
+            self.error_rate = 0.9 * self.error_rate + 0.1 * (not success)
+            if not success or self._latency_congested():
+                self._decrease()
+            elif self.load is None or self.load == 0:
+                self.limit = min(self.max_limit,
+                    self.limit + self.increase / self.limit)
+            self._condition.notify_all()
+
+    def observe_latency(self, latency):
+        '''Record the latency of a request that reached the server.
+        latency:            upload and server seconds per second of audio;
+                            cache hits and local work are not observed, as
+                            they say nothing about the server load
+        '''
+        with self._condition:
+            if self.latency is None: self.latency = latency
+            else: self.latency = 0.8 * self.latency + 0.2 * latency
+            self._latencies.append(latency)
+            latencies = sorted(self._latencies)
+            self.baseline_latency = latencies[len(latencies) // 10]
+
+    def update_load(self, load):
+        '''Take a new load indicator value into account.'''
+        with self._condition:
+            self.load = load
+            if load is not None and load >= 2: self._decrease()
+            self._condition.notify_all()
+
+    def _latency_congested(self):
+        if self.latency is None or not self.baseline_latency: return False
+        return self.latency > self.baseline_latency * self.latency_tolerance
+
+    def _decrease(self):
+        now = time.time()
+        if now - self._last_decrease < self.cooldown: return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+    def _poll(self):
+        while not self._stop.is_set():
+            try: load = self.load_indicator()
+            except Exception: load = None
+            self.update_load(load)
+            self._stop.wait(self.poll_interval)
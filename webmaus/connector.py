@@ -1,22 +1,57 @@
 from . import audio
 import argparse
-from lxml import etree
+import asyncio
+import io
+import os
+import tempfile
+import time
 from pathlib import Path
-import requests
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, Timeout
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+from . import metrics
+from . import retry
+from . import session as session_module
 from . import text_utils
 
 
 PIPELINE_URL = 'https://clarin.phonetik.uni-muenchen.de/'
 PIPELINE_URL += 'BASWebServices/services/runPipeline'
+LOAD_INDICATOR_URL = 'https://clarin.phonetik.uni-muenchen.de/'
+LOAD_INDICATOR_URL += 'BASWebServices/services/getLoadIndicator'
+# (connect, read) seconds; the read timeout bounds the silence between two
+# received bytes, so it must cover the server time of a long alignment
+DEFAULT_TIMEOUT = (10, 600)
 
 
 class Response:
     '''class to interact with the webmaus api response'''
-    def __init__(self, response):
+    def __init__(self, response, session = None, retry_policy = None,
+        circuit_breaker = None, timeout = DEFAULT_TIMEOUT):
         '''Initialize the Response object to parse the webmaus api response.
+        response:           requests response from the runPipeline call
+        session:            requests session used to download the result
+                            (default: the shared webmaus session)
+        retry_policy:       retry.RetryPolicy for the download
+                            (default: retry.default_policy())
+        circuit_breaker:    retry.CircuitBreaker (default: process wide)
+        timeout:            (connect, read) seconds for the download
         '''
         self.response = response
+        self.session = session
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.timeout = timeout
+        self.attempts = 1
+        self.cache = None
+        self.cache_key = None
+        self.cached = False
+        self.upload_bytes = 0
+        self.original_upload_bytes = 0
+        self.upload_seconds = 0.0
+        # seconds of the successful attempt alone: upload and server time,
+        # without the failed attempts and the backoff between them
+        self.request_seconds = None
         self.content = response.content.decode()
         self.type = 'unknown'
         self.success = False
@@ -39,12 +74,36 @@ class Response:
                 m += ' | output_filename: ' + self.output_filename
         return m
 
+    @classmethod
+    def from_output(cls, output):
+        '''Create a successful Response for an alignment that is already
+        available locally (e.g. from the result cache).
+        '''
+        self = cls(_LocalHTTPResponse())
+        self.type = 'pipeline'
+        self.success = True
+        self.download_output = output
+        self.download_connection_ok = True
+        return self
+
+    @classmethod
+    def from_error(cls, message):
+        '''Create a failed pipeline Response with message as its output
+        (e.g. for an alignment that failed locally).
+        '''
+        self = cls(_LocalHTTPResponse())
+        self.type = 'pipeline'
+        self.output = message
+        return self
+
     def _handle_load_indicator_response(self):
         self.type = 'load_indicator'
         self.load = int(self.content)
 
     def _handle_pipeline_response(self):
         self.type = 'pipeline'
+        # imported on first use, so importing webmaus stays fast
+        from lxml import etree
         self.xml = etree.fromstring(self.content.encode())
         success = self.xml.find('success')
         self.success = success is not None and success.text == 'true'
@@ -57,17 +116,34 @@ class Response:
         self.output = None if output is None else output.text
         self.warnings = None if warnings is None else warnings.text
 
-    def download(self):
+    def download(self, session = None):
         if hasattr(self,'download_output'):
             return self.download_output
         self.download_output = None
         self.download_connection_ok = None
+        if session is None: session = self.session
+        if session is None: session = session_module.get_session()
         if self.success and self.type == 'pipeline' and self.download_link:
+            policy = self.retry_policy or retry.default_policy()
             try:
-                self.download_response = requests.get(self.download_link)
+                with metrics.stage('download') as span:
+                    self.download_response, self.download_attempts = \
+                        retry.call_with_retry(
+                        lambda: session.get(self.download_link,
+                            timeout = self.timeout),
+                        lambda r: policy.is_transient_status(_status_code(r)),
+                        policy, self.circuit_breaker)
+                    if span is not None:
+                        span.bytes = len(self.download_response.content)
+                if _status_code(self.download_response) >= 400:
+                    m = 'download failed with status '
+                    m += f'{_status_code(self.download_response)}'
+                    raise ValueError(m)
                 self.download_output = self.download_response.content.decode()
                 self.download_connection_ok = True
-            except ConnectionError as e:
+                if self.cache is not None:
+                    self.cache.put(self.cache_key, self.download_output)
+            except (ConnectionError, Timeout) as e:
                 print('ConnectionError')#, print(e))
                 self.download_connection_ok = False
                 self.response.download_connection_error = e
@@ -75,24 +151,152 @@ class Response:
                 self.response.download_error = e
         return self.download_output
 
+    def alignment(self, header_only = False):
+        '''Return the downloaded TextGrid as a compact textgrid.Alignment.
+        header_only:        parse only the tier headers up front (see
+                            textgrid.Alignment.from_text)
+        Returns: Alignment or None if the download failed
+        '''
+        from . import textgrid
+        output = self.download()
+        if output is None: return None
+        return textgrid.Alignment.from_text(output, header_only)
+
+    async def adownload(self, session = None):
+        '''Asyncio counterpart of download (requires aiohttp).
+        Uses the timeout, retry policy and circuit breaker of the response,
+        like download.
+        session:            aiohttp.ClientSession (default: a session
+                            created and closed for this download)
+        '''
+        if hasattr(self,'download_output'):
+            return self.download_output
+        aiohttp = session_module.import_aiohttp()
+        self.download_output = None
+        self.download_connection_ok = None
+        if not (self.success and self.type == 'pipeline' and self.download_link):
+            return self.download_output
+        policy = self.retry_policy or retry.default_policy()
+        client_timeout = _client_timeout(aiohttp, self.timeout)
+        own_session = session is None
+        if own_session: session = session_module.make_async_session()
+
+        async def fetch():
+            async with session.get(self.download_link,
+                timeout = client_timeout) as http_response:
+                content = await http_response.read()
+            return _AsyncHTTPResponse(content, http_response)
+
+        try:
+            download_response, self.download_attempts = \
+                await retry.acall_with_retry(fetch,
+                lambda r: policy.is_transient_status(r.status_code),
+                policy, self.circuit_breaker, _transient_errors(aiohttp))
+            if download_response.status_code >= 400:
+                m = 'download failed with status '
+                m += f'{download_response.status_code}'
+                raise ValueError(m)
+            self.download_output = download_response.content.decode()
+            self.download_connection_ok = True
+        except _transient_errors(aiohttp) as e:
+            print('ConnectionError')
+            self.download_connection_ok = False
+            self.response.download_connection_error = e
+        except Exception as e:
+            self.response.download_error = e
+        finally:
+            if own_session: await session.close()
+        return self.download_output
+
+    def download_to_file(self, filename, session = None,
+        chunk_size = 64 * 1024, keep_in_memory = False):
+        '''Stream the result to filename without holding it in memory.
+        Chunks are written to a temp file next to filename, which is renamed
+        into place once the download is complete.
+        filename:           path to save the result to
+        session:            requests session (default: the session of the
+                            upload or the shared webmaus session)
+        chunk_size:         number of bytes per chunk
+        keep_in_memory:     also keep the decoded result, as download does
+        Returns: filename or None if the download failed
+        '''
+        if getattr(self, 'download_output', None) is not None:
+            self.save_output(self.download_output, filename)
+            return str(filename)
+        self.download_connection_ok = None
+        if not (self.success and self.type == 'pipeline' and self.download_link):
+            return None
+        if session is None: session = self.session
+        if session is None: session = session_module.get_session()
+        policy = self.retry_policy or retry.default_policy()
+        chunks = [] if keep_in_memory else None
+
+        def fetch():
+            http_response = session.get(self.download_link, stream = True,
+                timeout = self.timeout)
+            try:
+                if _status_code(http_response) < 400:
+                    if chunks is not None: chunks.clear()
+                    content = http_response.iter_content(chunk_size)
+                    if chunks is not None: content = _collect(content, chunks)
+                    _write_atomic(filename, content, stage = 'download')
+            finally:
+                http_response.close()
+            return http_response
+
+        try:
+            self.download_response, self.download_attempts = \
+                retry.call_with_retry(fetch,
+                lambda r: policy.is_transient_status(_status_code(r)),
+                policy, self.circuit_breaker)
+            if _status_code(self.download_response) >= 400:
+                m = 'download failed with status '
+                m += f'{_status_code(self.download_response)}'
+                raise ValueError(m)
+        except (ConnectionError, Timeout) as e:
+            print('ConnectionError')
+            self.download_connection_ok = False
+            self.response.download_connection_error = e
+            return None
+        except Exception as e:
+            self.response.download_error = e
+            return None
+        self.download_connection_ok = True
+        if chunks is not None: self.download_output = b''.join(chunks).decode()
+        if self.cache is not None: self.cache.put_file(self.cache_key, filename)
+        return str(filename)
+
     def save_output(self, output, filename):
-        with open(filename, 'w') as f:
-            f.write(output)
+        '''Write output atomically: a partially written file is never
+        visible under filename.
+        '''
+        _write_atomic(filename, [output.encode()], stage = 'write')
 
     def save_alignment(self, output_directory = '', audio_filename = None,
-        start_time = None, end_time = None, output_format = 'TextGrid'):
-        output = self.download()
+        start_time = None, end_time = None, output_format = 'TextGrid',
+        stream = False):
+        '''Download the alignment and save it under the name given by
+        make_output_filename.
+        stream:             stream the download straight to disk instead of
+                            keeping it in memory (see download_to_file)
+        Returns: the output filename (None if a streamed download failed)
+        '''
         if output_directory:
             Path(output_directory).mkdir(parents=True, exist_ok=True)
         filename = make_output_filename(output_directory, audio_filename,
             output_format, start_time, end_time)
+        if stream: return self.download_to_file(filename)
+        output = self.download()
         self.save_output(output, filename)
         return filename
 
 
 def run_pipeline(audio_filename, text_filename, language, start_time=None,
     end_time=None, output_format = 'TextGrid', pipe = 'G2P_MAUS_PHO2SYL', 
-    preseg = 'true', output_symbol = 'ipa', text = None):
+    preseg = 'true', output_symbol = 'ipa', text = None, session = None,
+    url = PIPELINE_URL, retry_policy = None, circuit_breaker = None,
+    cache = None, segment_reader = None, upload_profile = None,
+    backend = None, timeout = DEFAULT_TIMEOUT):
     ''' Run the forced alignment pipeline via the webmaus API.
     audio_filename:     path to the audio file
     text_filename:      path to the text file
@@ -105,36 +309,157 @@ def run_pipeline(audio_filename, text_filename, language, start_time=None,
     preseg:            whether to use pre-segmentation (default: 'true')
     output_symbol:     output symbol set: 'sampa', 'ipa', 'manner', 'place'
     text:              optional text input as string (overrides text_filename)
+    session:           requests session to use for upload and download
+                       (default: the shared keep-alive webmaus session)
+    url:               runPipeline url (default: PIPELINE_URL)
+    retry_policy:      retry.RetryPolicy for transient failures (connection
+                       errors, timeouts, 5xx/429, unparsable replies);
+                       (default: retry.default_policy(), pass
+                       RetryPolicy(max_attempts=1) to disable retries)
+    circuit_breaker:   retry.CircuitBreaker (default: the process wide
+                       breaker shared by all workers)
+    cache:             optional cache.ResultCache; a hit is served without
+                       any network round-trip, a miss is stored on download
+    segment_reader:    optional audio.SegmentReader used to slice segments
+                       from already open recordings
+    upload_profile:    optional audio.UploadProfile (e.g. 16 kHz mono FLAC)
+                       applied to whole files and segments before upload
+    backend:           optional backends.Backend to run the alignment with
+                       instead of the BAS web service, e.g. a LocalBackend
+    timeout:           (connect, read) seconds for the upload and the
+                       download; a stalled request fails as a (retried)
+                       timeout instead of hanging
+    Returns: Response or None if every attempt failed with a transient error
     '''
-    if not output_symbol in ['sampa', 'ipa', 'manner', 'place']:
-        raise ValueError('output_symbol must be one of: '
-            "'x-sampa', 'ipa', 'manner', 'place'")
-    if start_time is None and end_time is None:
-        signal = open(audio_filename, 'rb')
-    else: signal = audio.load_partial_audio_in_bytes_buffer(
-        audio_filename, start_time, end_time, format='WAV')
-    if text is not None:
-        if text_filename is not None:
-            m = f'Warning: text input provided as string, '
-            m += f'ignoring text_filename: {text_filename}'
-        else:text_filename = '.txt'
-        fin = text_utils.string_to_bytes_buffer(text, filename=text_filename)
-    else: fin = open(text_filename, 'rb')
-        
-    files = {'SIGNAL': signal,
-        'TEXT': fin }
-    data = {'LANGUAGE': language, 'OUTFORMAT': output_format, 'PIPE': pipe,
-        'PRESEG': preseg, 'OUTSYMBOL': output_symbol}
+    if backend is not None:
+        return backend.run(audio_filename = audio_filename,
+            text_filename = text_filename, language = language,
+            start_time = start_time, end_time = end_time,
+            output_format = output_format, pipe = pipe, preseg = preseg,
+            output_symbol = output_symbol, text = text, session = session,
+            retry_policy = retry_policy, circuit_breaker = circuit_breaker,
+            cache = cache, segment_reader = segment_reader,
+            upload_profile = upload_profile, timeout = timeout)
+    with metrics.stage('load') as span:
+        files, data = _make_request(audio_filename, text_filename, language,
+            start_time, end_time, output_format, pipe, preseg, output_symbol,
+            text, segment_reader, upload_profile)
+        if span is not None: span.bytes = _file_size(files['SIGNAL'])
+    if cache is not None:
+        cache_key = cache.make_key(files, dict(data, URL = url))
+        output = cache.get(cache_key)
+        if output is not None:
+            _close_files(files)
+            response = Response.from_output(output)
+            response.cached = True
+            return response
+    if session is None: session = session_module.get_session()
+    if retry_policy is None: retry_policy = retry.default_policy()
+
+    upload_bytes = _file_size(files['SIGNAL'])
+    original_bytes = getattr(files['SIGNAL'], 'original_size', upload_bytes)
+    start = time.time()
+
+    def post():
+        # the buffers are sliced / opened once and rewound for every attempt
+        for f in files.values(): f.seek(0)
+        attempt_start = time.time()
+        response = Response(_post(session, url, files, data, timeout),
+            session = session, retry_policy = retry_policy,
+            circuit_breaker = circuit_breaker, timeout = timeout)
+        response.request_seconds = time.time() - attempt_start
+        return response
+
     try:
-        response = requests.post(PIPELINE_URL, files=files, data=data)
-    except ConnectionError:
+        response, attempts = retry.call_with_retry(post,
+            lambda r: _is_transient_response(r, retry_policy),
+            retry_policy, circuit_breaker)
+    except Exception as e:
+        # every attempt failed; permanent errors propagate
+        if not retry_policy.is_transient_error(e): raise
+        return None
+    finally:
         _close_files(files)
+    response.attempts = attempts
+    response.upload_bytes = upload_bytes
+    response.original_upload_bytes = original_bytes
+    response.upload_seconds = time.time() - start
+    if cache is not None:
+        response.cache = cache
+        response.cache_key = cache_key
+    return response
+
+async def arun_pipeline(audio_filename, text_filename, language,
+    start_time=None, end_time=None, output_format = 'TextGrid',
+    pipe = 'G2P_MAUS_PHO2SYL', preseg = 'true', output_symbol = 'ipa',
+    text = None, session = None, url = PIPELINE_URL, retry_policy = None,
+    circuit_breaker = None, timeout = DEFAULT_TIMEOUT):
+    ''' Asyncio counterpart of run_pipeline (requires aiohttp).
+    Reading and slicing the audio runs in a worker thread so the event loop
+    is never blocked. Arguments are the same as for run_pipeline, except:
+    session:           aiohttp.ClientSession to use for upload and download
+                       (default: a session created and closed for this call,
+                       pass session.make_async_session() to reuse one)
+    Returns: Response or None on a connection error
+    '''
+    aiohttp = session_module.import_aiohttp()
+    if retry_policy is None: retry_policy = retry.default_policy()
+    files, data = await asyncio.to_thread(_read_request, audio_filename,
+        text_filename, language, start_time, end_time, output_format, pipe,
+        preseg, output_symbol, text)
+    client_timeout = _client_timeout(aiohttp, timeout)
+    own_session = session is None
+    if own_session: session = session_module.make_async_session()
+
+    async def post():
+        # a FormData is consumed when it is sent, so every attempt builds
+        # its own
+        form = aiohttp.FormData()
+        for key, value in data.items():
+            form.add_field(key, value)
+        for key, (filename, content) in files.items():
+            form.add_field(key, content, filename = filename)
+        attempt_start = time.time()
+        async with session.post(url, data = form,
+            timeout = client_timeout) as http_response:
+            content = await http_response.read()
+        response = Response(_AsyncHTTPResponse(content, http_response),
+            retry_policy = retry_policy, circuit_breaker = circuit_breaker,
+            timeout = timeout)
+        response.request_seconds = time.time() - attempt_start
+        return response
+
+    try:
+        response, attempts = await retry.acall_with_retry(post,
+            lambda r: _is_transient_response(r, retry_policy),
+            retry_policy, circuit_breaker, _transient_errors(aiohttp))
+    except _transient_errors(aiohttp):
+        return None
+    finally:
+        if own_session: await session.close()
+    response.attempts = attempts
+    return response
+
+def get_load_indicator(session = None, url = LOAD_INDICATOR_URL,
+    timeout = (10, 30)):
+    ''' Query the BAS load indicator.
+    session:           requests session to use (default: shared session)
+    url:               getLoadIndicator url (default: LOAD_INDICATOR_URL)
+    timeout:           (connect, read) seconds
+    Returns: 0 (low), 1 (medium) or 2 (high load); None if unavailable
+    '''
+    if session is None: session = session_module.get_session()
+    try:
+        response = Response(session.get(url, timeout = timeout),
+            session = session)
+    except (ConnectionError, Timeout):
         return None
-    _close_files(files)
-    return Response(response)
+    if response.type != 'load_indicator': return None
+    return response.load
 
 def run_g2p_maus_phon2syl(audio_filename, text_filename, language, 
-    start_time = None, end_time = None, output_format='TextGrid', preseg='true'):
+    start_time = None, end_time = None, output_format='TextGrid', preseg='true',
+    session = None):
     ''' Run the G2P_MAUS_PHO2SYL pipeline via the webmaus API.
     audio_filename:     path to the audio file
     text_filename:      path to the text file
@@ -143,9 +468,11 @@ def run_g2p_maus_phon2syl(audio_filename, text_filename, language,
     end_time:          end time in seconds (optional)
     output_format:     desired output format (default: 'TextGrid')
     preseg:            whether to use pre-segmentation (default: 'true')
+    session:           requests session to use (default: shared session)
     '''
     return run_pipeline(audio_filename, text_filename, language, start_time,
-         end_time, output_format, pipe='G2P_MAUS_PHO2SYL', preseg=preseg)
+         end_time, output_format, pipe='G2P_MAUS_PHO2SYL', preseg=preseg,
+         session = session)
 
 
 def make_output_filename(output_directory, audio_filename, output_format,
@@ -166,6 +493,207 @@ def make_output_filename(output_directory, audio_filename, output_format,
         stem += '-ms'
     return str(Path(output_directory) / f'{stem}.{output_format}')
 
+def _make_request(audio_filename, text_filename, language, start_time,
+    end_time, output_format, pipe, preseg, output_symbol, text,
+    segment_reader = None, upload_profile = None):
+    '''Open the upload files and build the form data for runPipeline.
+    Returns: dict of open file objects; dict of form fields
+    '''
+    if not output_symbol in ['sampa', 'ipa', 'manner', 'place']:
+        raise ValueError('output_symbol must be one of: '
+            "'x-sampa', 'ipa', 'manner', 'place'")
+    if upload_profile is not None:
+        upload_profile = upload_profile.for_output_format(output_format)
+    if start_time is None and end_time is None:
+        if upload_profile is None: signal = open(audio_filename, 'rb')
+        else: signal = audio.load_audio_for_upload(audio_filename,
+            upload_profile)
+    elif segment_reader is not None:
+        signal = segment_reader.read(audio_filename, start_time, end_time,
+            format='WAV', profile=upload_profile)
+    else: signal = audio.load_partial_audio_in_bytes_buffer(
+        audio_filename, start_time, end_time, format='WAV',
+        profile=upload_profile)
+    if text is not None:
+        if text_filename is not None:
+            m = 'Warning: text input provided as string, '
+            m += f'ignoring text_filename: {text_filename}'
+        else:text_filename = '.txt'
+        fin = text_utils.string_to_bytes_buffer(text, filename=text_filename)
+    else: fin = open(text_filename, 'rb')
+        
+    files = {'SIGNAL': signal,
+        'TEXT': fin }
+    data = {'LANGUAGE': language, 'OUTFORMAT': output_format, 'PIPE': pipe,
+        'PRESEG': preseg, 'OUTSYMBOL': output_symbol}
+    return files, data
+
+def _post(session, url, files, data, timeout = DEFAULT_TIMEOUT):
+    '''POST the runPipeline request.
+    While metrics are recorded (see metrics.Metrics.job) the multipart body
+    is sent from a _MultipartBody, which streams the upload files and
+    notes when it was read to the end; that marks the end of the upload,
+    which separates the upload from the server wait.
+    '''
+    if not metrics.active():
+        return session.post(url, files=files, data=data, timeout=timeout)
+    upload = _MultipartBody(data, files)
+    start_time = time.time()
+    start = time.perf_counter()
+    http_response = session.post(url, data = upload,
+        headers = {'Content-Type': upload.content_type}, timeout = timeout)
+    end = time.perf_counter()
+    sent = end if upload.sent is None else upload.sent
+    metrics.record('upload', start_time, sent - start, len(upload))
+    metrics.record('server_wait', start_time + sent - start, end - sent)
+    return http_response
+
+class _MultipartBody:
+    '''multipart/form-data request body (the encoding of urllib3's
+    encode_multipart_formdata) that reads the upload files while it is
+    sent instead of copying them into memory first. Its length is known up
+    front, so it is sent with a Content-Length. sent is the time of the
+    first read past the end, which http.client only does once it sent the
+    last block.
+    '''
+    def __init__(self, data, files, boundary = None):
+        if boundary is None: boundary = choose_boundary()
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        self.sent = None
+        fields = [(RequestField.from_tuples(key, value), value.encode())
+            for key, value in data.items()]
+        fields += [(RequestField.from_tuples(key, (Path(f.name).name, b'')),
+            f) for key, f in files.items()]
+        self._parts = []
+        for field, value in fields:
+            head = f'--{boundary}\r\n'.encode('latin-1')
+            head += field.render_headers().encode()
+            self._parts += [io.BytesIO(head),
+                value if hasattr(value, 'read') else io.BytesIO(value),
+                io.BytesIO(b'\r\n')]
+        self._parts.append(io.BytesIO(f'--{boundary}--\r\n'.encode(
+            'latin-1')))
+        self._length = sum(_file_size(part) - part.tell()
+            for part in self._parts)
+        self._index = 0
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size = -1):
+        chunks = []
+        while self._index < len(self._parts) and size != 0:
+            chunk = self._parts[self._index].read(size)
+            if not chunk:
+                self._index += 1
+                continue
+            chunks.append(chunk)
+            if size > 0: size -= len(chunk)
+        if not chunks and self.sent is None: self.sent = time.perf_counter()
+        return b''.join(chunks)
+
+def _read_request(*args):
+    '''Like _make_request, but reads the upload files into memory.
+    Returns: dict of (filename, bytes) tuples; dict of form fields
+    '''
+    files, data = _make_request(*args)
+    try:
+        contents = {key: (Path(f.name).name, f.read())
+            for key, f in files.items()}
+    finally:
+        _close_files(files)
+    return contents, data
+
+def _is_transient_response(response, retry_policy):
+    '''True if a runPipeline response is worth retrying: a transient
+    status code or a server error without a parsable body.
+    '''
+    status_code = _status_code(response.response)
+    if retry_policy.is_transient_status(status_code): return True
+    if 400 <= status_code < 500: return False
+    return response.type == 'unknown'
+
+def _transient_errors(aiohttp):
+    '''aiohttp errors worth retrying (the counterparts of the requests
+    ConnectionError, Timeout and ChunkedEncodingError).
+    '''
+    return (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+        asyncio.TimeoutError)
+
+def _client_timeout(aiohttp, timeout):
+    '''aiohttp.ClientTimeout for a requests timeout: (connect, read)
+    seconds, one number for both or None for no timeout. The read timeout
+    bounds the silence between two received chunks, as with requests.
+    '''
+    if timeout is None: return aiohttp.ClientTimeout(total = None)
+    if not isinstance(timeout, (tuple, list)): timeout = (timeout, timeout)
+    connect, read = timeout
+    return aiohttp.ClientTimeout(total = None, sock_connect = connect,
+        sock_read = read)
+
+class _LocalHTTPResponse:
+    content = b''
+    status_code = 200
+
+class _AsyncHTTPResponse:
+    '''Holds the body read from an aiohttp response, so Response can
+    parse it exactly like a requests response.
+    '''
+    def __init__(self, content, http_response):
+        self.content = content
+        self.status_code = http_response.status
+
+def _write_atomic(filename, chunks, stage = None):
+    '''Write byte chunks to a temp file and rename it to filename.
+    stage:              record the write as a metrics stage of the current
+                        job: 'write', or 'download' for chunks streamed from
+                        the network (the time spent waiting for chunks is
+                        then recorded as download, the rest as write)
+    '''
+    filename = Path(filename)
+    record = stage is not None and metrics.active()
+    start_time = time.time()
+    start = time.perf_counter()
+    write_seconds = 0.0
+    n_bytes = 0
+    fd, tmp = tempfile.mkstemp(dir = filename.parent,
+        prefix = '.' + filename.name, suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                if record:
+                    t = time.perf_counter()
+                    f.write(chunk)
+                    write_seconds += time.perf_counter() - t
+                    n_bytes += len(chunk)
+                else: f.write(chunk)
+        t = time.perf_counter()
+        os.replace(tmp, filename)
+        write_seconds += time.perf_counter() - t
+    except BaseException:
+        Path(tmp).unlink(missing_ok = True)
+        raise
+    if not record: return
+    total = time.perf_counter() - start
+    if stage == 'download':
+        metrics.record('download', start_time, total - write_seconds, n_bytes)
+        metrics.record('write', start_time, write_seconds, n_bytes)
+    else: metrics.record('write', start_time, total, n_bytes)
+
+def _collect(chunks, collected):
+    for chunk in chunks:
+        collected.append(chunk)
+        yield chunk
+
+def _file_size(f):
+    position = f.tell()
+    size = f.seek(0, 2)
+    f.seek(position)
+    return size
+
+def _status_code(response):
+    return getattr(response, 'status_code', 200)
+
 def _close_files(files):
     for f in files.values():
         f.close()
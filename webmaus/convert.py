@@ -0,0 +1,161 @@
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+from .connector import _write_atomic
+from .utils import process_context
+
+
+# formats derived locally from a TextGrid and their filename suffixes. They
+# are named apart from the BAS OUTFORMAT values csv and json, whose layout
+# differs: tiers-csv is one table of all tiers (tier, start, end, label),
+# tiers-json the TextGrid dict and tables a directory with one csv file per
+# tier
+SUFFIXES = {'tiers-csv': '.tiers.csv', 'tiers-json': '.tiers.json',
+    'tables': '.tables'}
+FORMATS = tuple(SUFFIXES)
+
+
+def derived_filename(textgrid_filename, output_format):
+    '''Filename of a format derived from a TextGrid output, e.g.
+    out/a.TextGrid -> out/a.tiers.csv.
+    '''
+    return str(Path(textgrid_filename).with_suffix(SUFFIXES[output_format]))
+
+
+def convert(textgrid_filename, output_formats):
+    '''Read a TextGrid once and write it in every output format, each
+    atomically, next to the TextGrid (see derived_filename).
+    output_formats:     list of formats from FORMATS
+    Returns: list of the written filenames
+    '''
+    # runs in the worker processes; importing it here keeps numpy out of
+    # the pipeline process until a TextGrid is read there
+    from . import textgrid
+    alignment = textgrid.Alignment.read(textgrid_filename)
+    filenames = []
+    for output_format in output_formats:
+        filename = derived_filename(textgrid_filename, output_format)
+        _WRITERS[output_format](alignment, filename)
+        filenames.append(filename)
+    return filenames
+
+
+class Converter:
+    def __init__(self, output_formats, max_workers = None):
+        '''Convert TextGrid outputs to other formats in a process pool, so
+        one server request yields every format and the conversions never
+        hold the GIL of the pipeline threads.
+        output_formats:     list of formats from FORMATS
+        max_workers:        number of processes (default: number of cores);
+                            0 converts in the calling thread
+        '''
+        unknown = [f for f in output_formats if f not in FORMATS]
+        if unknown:
+            m = f'cannot derive {", ".join(unknown)} from a TextGrid, '
+            m += f'supported: {", ".join(FORMATS)}'
+            raise ValueError(m)
+        self.output_formats = list(output_formats)
+        if max_workers is None: max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        self.errors = []
+        self._executor = None
+        self._lock = threading.Lock()
+        self._errors_lock = threading.Lock()
+
+    def __repr__(self):
+        return f'Converter({self.output_formats}, ' \
+            f'max_workers={self.max_workers})'
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None and self.max_workers > 0:
+                self._executor = ProcessPoolExecutor(self.max_workers,
+                    mp_context = process_context())
+            return self._executor
+
+    def submit(self, textgrid_filename, output_formats = None):
+        '''Start converting a TextGrid (to every format by default).
+        Failures are reported and kept in errors.
+        Returns: Future of the list of written filenames
+        '''
+        if output_formats is None: output_formats = self.output_formats
+        if self.max_workers == 0:
+            future = Future()
+            try: future.set_result(convert(textgrid_filename, output_formats))
+            except Exception as e: future.set_exception(e)
+        else:
+            future = self.executor.submit(convert, textgrid_filename,
+                output_formats)
+        future.add_done_callback(lambda f: self._check(f, textgrid_filename))
+        return future
+
+    def close(self):
+        '''Wait for the pending conversions and shut down the process pool
+        (it is restarted on the next submit).
+        '''
+        with self._lock:
+            if self._executor is not None: self._executor.shutdown()
+            self._executor = None
+
+    def _check(self, future, textgrid_filename):
+        e = future.exception()
+        if e is None: return
+        print(f'Could not convert {textgrid_filename}: {e}')
+        with self._errors_lock:
+            self.errors.append((textgrid_filename, repr(e)))
+
+
+def write_csv(alignment, filename):
+    '''All tiers in one table: tier, start, end, label (end equals start
+    for point tiers).
+    '''
+    f = io.StringIO()
+    writer = csv.writer(f, lineterminator = '\n')
+    writer.writerow(('tier', 'start', 'end', 'label'))
+    for tier in alignment.tiers:
+        writer.writerows(zip([tier.name] * len(tier), tier.start.tolist(),
+            tier.end.tolist(), tier.labels))
+    _write_atomic(filename, [f.getvalue().encode()])
+
+
+def write_json(alignment, filename):
+    '''The TextGrid dict of write_textgrid (xmin, xmax and tiers with their
+    items) as json.
+    '''
+    text = json.dumps(alignment.to_dict(), ensure_ascii = False)
+    _write_atomic(filename, [text.encode()])
+
+
+def write_tables(alignment, directory):
+    '''A directory with one csv table (start, end, label) per tier; the
+    directory is filled under a temporary name and then renamed.
+    '''
+    directory = Path(directory)
+    tmp = tempfile.mkdtemp(dir = directory.parent,
+        prefix = '.' + directory.name, suffix = '.tmp')
+    try:
+        for tier in alignment.tiers:
+            name = tier.name.replace(os.sep, '_') or 'tier'
+            with open(os.path.join(tmp, name + '.csv'), 'w',
+                newline = '') as f:
+                writer = csv.writer(f, lineterminator = '\n')
+                writer.writerow(('start', 'end', 'label'))
+                writer.writerows(zip(tier.start.tolist(), tier.end.tolist(),
+                    tier.labels))
+        if directory.exists(): shutil.rmtree(directory)
+        os.replace(tmp, directory)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors = True)
+        raise
+
+
+_WRITERS = {'tiers-csv': write_csv, 'tiers-json': write_json,
+    'tables': write_tables}
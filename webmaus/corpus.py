@@ -0,0 +1,336 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from . import textgrid
+
+
+# tables and the MAUS tiers they are filled from (first tier present wins)
+TABLE_TIERS = {
+    'words': ('ORT-MAU', 'ORT'),
+    'phones': ('MAU',),
+    'syllables': ('MAS',),
+    }
+COLUMNS = ('source', 'segment_start', 'segment_end', 'start', 'end', 'label')
+
+
+class Corpus:
+    def __init__(self, directory, table_tiers = None, flush_files = 100,
+        merge_shards = 8):
+        '''Columnar store of alignments for corpus wide queries.
+        Every table (words, phones, syllables) is stored as shards of
+        memory mappable .npy columns: source (index into sources),
+        segment_start and segment_end of the aligned segment (nan for whole
+        files), start and end in seconds from the start of the recording and
+        label (index into labels). Every shard has an inverted index from
+        label to rows. New alignments are buffered and written as a new
+        shard, so the store grows without rebuilding existing shards.
+        Shards are merged like an LSM tree: once the newest merge_shards
+        shards of a table are of the same level they become one shard of
+        the next level, so a table has O(log n) shards and every row is
+        rewritten O(log n) times.
+        The metadata (sources, labels, ingested files and shard lists) is
+        an append only log, corpus.jsonl: every flush appends one line with
+        only the new entries. The corpus.json of older stores is read
+        first.
+        directory:          directory of the store (created if missing)
+        table_tiers:        dict mapping table names to the TextGrid tier
+                            names they are filled from (default:
+                            TABLE_TIERS)
+        flush_files:        number of buffered alignments that triggers
+                            writing a shard
+        merge_shards:       number of shards of one level that are merged
+        '''
+        self.directory = Path(directory)
+        self.directory.mkdir(parents = True, exist_ok = True)
+        self.table_tiers = TABLE_TIERS if table_tiers is None else table_tiers
+        self.flush_files = flush_files
+        self.merge_shards = merge_shards
+        self._lock = threading.Lock()
+        self._log_file = self.directory / 'corpus.jsonl'
+        self.sources = []
+        self.labels = []
+        self.shards = {table: [] for table in self.table_tiers}
+        self._ingested = set()
+        self._logged_sources = self._logged_labels = 0
+        meta_file = self.directory / 'corpus.json'
+        if meta_file.exists(): self._apply(json.loads(meta_file.read_text()))
+        if self._log_file.exists(): self._read_log()
+        self._source_ids = {s: i for i, s in enumerate(self.sources)}
+        self._label_ids = {label: i for i, label in enumerate(self.labels)}
+        self._buffer = {table: [] for table in self.table_tiers}
+        self._buffered = []
+        self._columns = {}
+
+    def __repr__(self):
+        counts = ', '.join(f'{table}={self.size(table)}'
+            for table in self.table_tiers)
+        return f'Corpus({self.directory}, {counts})'
+
+    def __contains__(self, output_file):
+        return str(output_file) in self._ingested
+
+    def add(self, output_file, audio_filename, start_time = None,
+        end_time = None):
+        '''Buffer the rows of an aligned TextGrid.
+        Files that were added before are ignored. A shard is written once
+        flush_files alignments are buffered.
+        output_file:        TextGrid produced for the audio (segment)
+        audio_filename:     path to the source recording
+        start_time:         start of the aligned segment in the recording
+        end_time:           end of the aligned segment in the recording
+        Returns: True if the file was added
+        '''
+        output_file = str(output_file)
+        if output_file in self: return False
+        alignment = textgrid.Alignment.read(output_file)
+        offset = 0.0 if start_time is None else float(start_time)
+        segment = (np.nan if start_time is None else float(start_time),
+            np.nan if end_time is None else float(end_time))
+        with self._lock:
+            if output_file in self._ingested: return False
+            source = self._intern_source(str(audio_filename))
+            label_map = np.array([self._intern_label(label)
+                for label in alignment.labels], dtype = np.int32)
+            for table, tier_names in self.table_tiers.items():
+                tier = _first_tier(alignment, tier_names)
+                if tier is None or tier.size == 0: continue
+                self._buffer[table].append((source, segment,
+                    tier.start + offset, tier.end + offset,
+                    label_map[tier.label_index]))
+            self._ingested.add(output_file)
+            self._buffered.append(output_file)
+            if len(self._buffered) >= self.flush_files: self._flush()
+        return True
+
+    def add_infos(self, infos):
+        '''Add the outputs of pipeline infos (e.g. Pipeline.done_infos).
+        Returns: number of files added
+        '''
+        added = 0
+        for info in infos:
+            if info['status'] != 'done' or info['output_file'] is None:
+                continue
+            added += self.add(info['output_file'], info['audio_filename'],
+                info['start_time'], info['end_time'])
+        return added
+
+    def flush(self):
+        '''Write the buffered rows as new shards.'''
+        with self._lock: self._flush()
+
+    def size(self, table):
+        '''Number of rows of a table, including buffered rows.'''
+        rows = sum(shard['rows'] for shard in self.shards[table])
+        return rows + sum(len(rows[-1]) for rows in self._buffer[table])
+
+    def table(self, table):
+        '''Return all written rows of a table.
+        Returns: dict mapping column names to (memory mapped) arrays
+        '''
+        shards = self.shards[table]
+        columns = {}
+        for column in COLUMNS:
+            arrays = [self._load(table, shard['name'], column)
+                for shard in shards]
+            if len(arrays) == 1: columns[column] = arrays[0]
+            elif arrays: columns[column] = np.concatenate(arrays)
+            else: columns[column] = np.zeros(0, dtype = _dtype(column))
+        return columns
+
+    def rows(self, table, label):
+        '''Return the row numbers of a table with the given label, using
+        the inverted index of every shard.
+        '''
+        label_id = self._label_ids.get(label)
+        rows = []
+        offset = 0
+        for shard in self.shards[table]:
+            if label_id is not None:
+                keys = self._load(table, shard['name'], 'index_labels')
+                i = np.searchsorted(keys, label_id)
+                if i < len(keys) and keys[i] == label_id:
+                    bounds = self._load(table, shard['name'], 'index_offsets')
+                    order = self._load(table, shard['name'], 'index_rows')
+                    rows.append(order[bounds[i]:bounds[i + 1]] + offset)
+            offset += shard['rows']
+        if not rows: return np.zeros(0, dtype = np.int64)
+        return np.concatenate(rows)
+
+    def select(self, table, label = None, min_duration = None,
+        max_duration = None):
+        '''Select rows of a table.
+        table:              'words', 'phones' or 'syllables'
+        label:              only rows with this label (uses the index)
+        min_duration:       only rows lasting at least this many seconds
+        max_duration:       only rows lasting at most this many seconds
+        Returns: dict mapping column names to arrays, with the source and
+                 label columns as indices into sources and labels
+        '''
+        columns = self.table(table)
+        if label is not None: rows = self.rows(table, label)
+        else: rows = np.arange(len(columns['label']))
+        durations = columns['end'][rows] - columns['start'][rows]
+        keep = np.ones(len(rows), dtype = bool)
+        if min_duration is not None: keep &= durations >= min_duration
+        if max_duration is not None: keep &= durations <= max_duration
+        rows = rows[keep]
+        return {column: np.asarray(values[rows])
+            for column, values in columns.items()}
+
+    def _flush(self):
+        if not self._buffered: return
+        entry = {'sources': self.sources[self._logged_sources:],
+            'labels': self.labels[self._logged_labels:],
+            'ingested': self._buffered, 'shards': {}}
+        removed = []
+        for table, rows in self._buffer.items():
+            if not rows: continue
+            shards = self.shards[table]
+            name = self._shard_name(table)
+            n_rows = self._write_shard(table, name, _columns(rows))
+            shards.append({'name': name, 'rows': n_rows, 'level': 0})
+            self._buffer[table] = []
+            removed.extend((table, shard['name'])
+                for shard in self._merge(table))
+            entry['shards'][table] = shards
+        self._append_log(entry)
+        self._buffered = []
+        # only now the merged shards are no longer referenced
+        for table, name in removed:
+            for key in [k for k in self._columns if k[:2] == (table, name)]:
+                del self._columns[key]
+            shutil.rmtree(self.directory / table / name, ignore_errors = True)
+
+    def _merge(self, table):
+        '''Merge the newest shards of a table while merge_shards of them
+        share a level.
+        Returns: the shards that were merged away
+        '''
+        shards = self.shards[table]
+        removed = []
+        while len(shards) >= self.merge_shards > 1:
+            tail = shards[-self.merge_shards:]
+            level = tail[0].get('level', 0)
+            if any(shard.get('level', 0) != level for shard in tail): break
+            columns = {column: np.concatenate([self._load(table,
+                shard['name'], column) for shard in tail])
+                for column in COLUMNS}
+            name = self._shard_name(table)
+            n_rows = self._write_shard(table, name, columns)
+            del shards[-self.merge_shards:]
+            shards.append({'name': name, 'rows': n_rows, 'level': level + 1})
+            removed.extend(tail)
+        return removed
+
+    def _shard_name(self, table):
+        names = [int(shard['name']) for shard in self.shards[table]]
+        return f'{max(names, default = -1) + 1:06d}'
+
+    def _write_shard(self, table, name, columns):
+        '''Write the columns and the inverted index of a shard to a
+        temporary directory and move it into place; the shard only becomes
+        part of the store when the metadata is written.
+        '''
+        columns = dict(columns)
+        order = np.argsort(columns['label'], kind = 'stable')
+        keys, starts = np.unique(columns['label'][order], return_index = True)
+        columns['index_labels'] = keys
+        columns['index_offsets'] = np.append(starts, len(order))
+        columns['index_rows'] = order
+        table_directory = self.directory / table
+        table_directory.mkdir(exist_ok = True)
+        tmp = tempfile.mkdtemp(dir = table_directory, prefix = '.tmp')
+        for column, values in columns.items():
+            np.save(os.path.join(tmp, column + '.npy'), values)
+        shard_directory = table_directory / name
+        if shard_directory.exists(): shutil.rmtree(shard_directory)
+        os.replace(tmp, shard_directory)
+        return len(order)
+
+    def _apply(self, entry):
+        '''Apply a metadata entry (the corpus.json of older stores or a log
+        line): sources, labels and ingested files are appended, the shard
+        lists of the tables in the entry are replaced.
+        '''
+        self.sources.extend(entry['sources'])
+        self.labels.extend(entry['labels'])
+        self._ingested.update(entry['ingested'])
+        self.shards.update(entry['shards'])
+        self._logged_sources = len(self.sources)
+        self._logged_labels = len(self.labels)
+
+    def _read_log(self):
+        '''Apply the log lines; a last line cut short by a crash is
+        truncated, so the next append starts on a fresh line.
+        '''
+        valid = 0
+        with open(self._log_file, 'rb') as f:
+            for line in f:
+                try: entry = json.loads(line)
+                except ValueError: break
+                if not line.endswith(b'\n'): break
+                self._apply(entry)
+                valid += len(line)
+        if valid < self._log_file.stat().st_size:
+            os.truncate(self._log_file, valid)
+
+    def _append_log(self, entry):
+        with open(self._log_file, 'ab') as f:
+            f.write(json.dumps(entry).encode() + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._logged_sources = len(self.sources)
+        self._logged_labels = len(self.labels)
+
+    def _load(self, table, shard, column):
+        key = (table, shard, column)
+        if key not in self._columns:
+            filename = self.directory / table / shard / (column + '.npy')
+            self._columns[key] = np.load(filename, mmap_mode = 'r')
+        return self._columns[key]
+
+    def _intern_source(self, source):
+        index = self._source_ids.get(source)
+        if index is None:
+            index = self._source_ids[source] = len(self.sources)
+            self.sources.append(source)
+        return index
+
+    def _intern_label(self, label):
+        index = self._label_ids.get(label)
+        if index is None:
+            index = self._label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        return index
+
+
+def _columns(rows):
+    '''Columns of buffered rows: (source, segment, start, end, labels) per
+    alignment.
+    '''
+    lengths = [len(r[-1]) for r in rows]
+    return {
+        'source': np.repeat([r[0] for r in rows], lengths).astype(np.int32),
+        'segment_start': np.repeat([r[1][0] for r in rows], lengths),
+        'segment_end': np.repeat([r[1][1] for r in rows], lengths),
+        'start': np.concatenate([r[2] for r in rows]),
+        'end': np.concatenate([r[3] for r in rows]),
+        'label': np.concatenate([r[4] for r in rows]),
+        }
+
+
+def _first_tier(alignment, tier_names):
+    for name in tier_names:
+        if name in alignment: return alignment[name]
+    return None
+
+
+def _dtype(column):
+    if column in ('source', 'label'): return np.int32
+    return np.float64
@@ -0,0 +1,248 @@
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import weakref
+from array import array
+
+
+STATUSES = ('done', 'skipped', 'error')
+
+
+class JobStore:
+    def __init__(self, spill_threshold = 100000, filename = None):
+        '''Compact, thread safe record of finished pipeline jobs.
+        Jobs are stored as columns (struct of arrays): the status as a
+        byte, the audio filename as an index into a table of distinct
+        filenames, start, end and completion time as doubles and the output
+        filename. Every status keeps an index of its rows, so counts are
+        constant time and paging through one status never scans the
+        others. Past spill_threshold rows the oldest rows are moved to a
+        SQLite file; only the row indexes stay in memory.
+        spill_threshold:    number of rows kept in memory
+        filename:           sqlite file rows are spilled to (default: a
+                            temporary file removed by close)
+        '''
+        self.spill_threshold = spill_threshold
+        self.filename = filename
+        self._own_file = filename is None
+        self._lock = threading.Lock()
+        self._audio_filenames = []
+        self._audio_ids = {}
+        self._index = {status: array('q') for status in STATUSES}
+        self._spilled = 0
+        self._connection = None
+        self._clear_columns()
+
+    def __repr__(self):
+        counts = ', '.join(f'{s}={n}' for s, n in self.counts().items())
+        return f'JobStore({counts}, spilled={self._spilled})'
+
+    def __len__(self):
+        return self._spilled + len(self._status)
+
+    def add(self, status, audio_filename, start_time = None, end_time = None,
+        output_file = None, time = None):
+        '''Record a finished job.
+        status:             'done', 'skipped' or 'error'
+        time:               completion time (default: now)
+        Returns: row number
+        '''
+        code = STATUSES.index(status)
+        with self._lock:
+            audio_id = self._audio_ids.get(audio_filename)
+            if audio_id is None:
+                audio_id = self._audio_ids[audio_filename] = \
+                    len(self._audio_filenames)
+                self._audio_filenames.append(audio_filename)
+            row = self._spilled + len(self._status)
+            self._status.append(code)
+            self._audio.append(audio_id)
+            self._start.append(_to_float(start_time))
+            self._end.append(_to_float(end_time))
+            self._time.append(_now() if time is None else time)
+            self._output.append(output_file)
+            self._index[status].append(row)
+            if len(self._status) >= self.spill_threshold: self._spill()
+        return row
+
+    def count(self, status):
+        return len(self._index[status])
+
+    def counts(self):
+        return {status: len(index) for status, index in self._index.items()}
+
+    def page(self, status = None, offset = 0, limit = 1000):
+        '''Return up to limit jobs from offset, in completion order.
+        status:             only jobs with this status (default: all)
+        Returns: list of (status, audio_filename, start_time, end_time,
+                 output_file, time) tuples
+        '''
+        with self._lock:
+            if status is None:
+                stop = min(len(self), offset + limit)
+                rows = range(offset, max(offset, stop))
+            else: rows = self._index[status][offset:offset + limit]
+            return self._rows(rows)
+
+    def iter(self, status = None, page_size = 1000):
+        '''Iterate over the jobs (see page) one page at a time.'''
+        offset = 0
+        while True:
+            page = self.page(status, offset, page_size)
+            yield from page
+            if len(page) < page_size: return
+            offset += page_size
+
+    def view(self, status = None, info = False):
+        '''Read only sequence of the jobs with a status.
+        info:               items are make_info dicts instead of the tuples
+                            Pipeline.done, skipped and errors hold
+        '''
+        return JobView(self, status, info)
+
+    def close(self):
+        '''Close the spill file (a temporary one is removed); the store can
+        not be read afterwards if rows were spilled.
+        '''
+        with self._lock:
+            if self._connection is None: return
+            self._finalizer()
+            self._connection = None
+
+    def _clear_columns(self):
+        self._status = array('B')
+        self._audio = array('l')
+        self._start = array('d')
+        self._end = array('d')
+        self._time = array('d')
+        self._output = []
+
+    def _spill(self):
+        if self._connection is None:
+            if self.filename is None:
+                fd, self.filename = tempfile.mkstemp(prefix = 'webmaus-jobs-',
+                    suffix = '.sqlite')
+                os.close(fd)
+            self._connection = sqlite3.connect(self.filename,
+                check_same_thread = False, isolation_level = None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                row INTEGER PRIMARY KEY, status INTEGER, audio INTEGER,
+                start REAL, end REAL, time REAL, output TEXT)''')
+            self._finalizer = weakref.finalize(self, _close_spill_file,
+                self._connection, self.filename if self._own_file else None)
+        first = self._spilled
+        rows = zip(range(first, first + len(self._status)), self._status,
+            self._audio, self._start, self._end, self._time, self._output)
+        self._connection.execute('BEGIN')
+        self._connection.executemany('''INSERT INTO jobs
+            VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+        self._connection.execute('COMMIT')
+        self._spilled += len(self._status)
+        self._clear_columns()
+
+    def _rows(self, rows):
+        spilled = [row for row in rows if row < self._spilled]
+        on_disk = {}
+        for i in range(0, len(spilled), 500):
+            chunk = spilled[i:i + 500]
+            query = 'SELECT row, status, audio, start, end, time, output '
+            query += 'FROM jobs WHERE row IN (' + ','.join('?' * len(chunk))
+            query += ')'
+            for values in self._connection.execute(query, chunk):
+                on_disk[values[0]] = values[1:]
+        output = []
+        for row in rows:
+            if row < self._spilled: values = on_disk[row]
+            else:
+                i = row - self._spilled
+                values = (self._status[i], self._audio[i], self._start[i],
+                    self._end[i], self._time[i], self._output[i])
+            status, audio, start, end, t, output_file = values
+            output.append((STATUSES[status], self._audio_filenames[audio],
+                _from_float(start), _from_float(end), output_file, t))
+        return output
+
+
+class JobView:
+    def __init__(self, store, status = None, info = False):
+        '''Sequence of the jobs with a status, read from a JobStore; it
+        supports len, indexing, slicing and iteration without copying the
+        store.
+        '''
+        self.store = store
+        self.status = status
+        self.info = info
+
+    def __repr__(self):
+        return f'JobView({self.status}, {len(self)} jobs)'
+
+    def __len__(self):
+        if self.status is None: return len(self.store)
+        return self.store.count(self.status)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1: return list(self)[index]
+            page = self.store.page(self.status, start, max(0, stop - start))
+            return [self._item(job) for job in page]
+        if index < 0: index += len(self)
+        if not 0 <= index < len(self): raise IndexError(index)
+        return self._item(self.store.page(self.status, index, 1)[0])
+
+    def __iter__(self):
+        for job in self.store.iter(self.status):
+            yield self._item(job)
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, JobView)): return False
+        return list(self) == list(other)
+
+    def _item(self, job):
+        status, audio_filename, start_time, end_time, output_file, t = job
+        if self.info:
+            return make_info(audio_filename, start_time, end_time,
+                output_file, status, t)
+        if status == 'error': return (audio_filename, start_time, end_time)
+        return (audio_filename, start_time, end_time, output_file)
+
+
+def make_info(audio_filename, start_time, end_time, output_file, status,
+    t = None):
+    '''Info dict of a job, as in Pipeline.infos.
+    t:                  time the job finished (default: now)
+    '''
+    if t is None: t = _now()
+    return {'audio_filename': audio_filename, 'start_time': start_time,
+        'end_time': end_time, 'output_file': output_file, 'status': status,
+        'timestamp': readable_timestamp(t), 'time': t}
+
+
+def readable_timestamp(t = None):
+    if t is None: t = _now()
+    return time.strftime('%a %d %b %Y, %H:%M', time.localtime(t))
+
+
+def _close_spill_file(connection, temporary_filename = None):
+    connection.close()
+    if temporary_filename is None: return
+    for suffix in ('', '-wal', '-shm'):
+        try: os.remove(temporary_filename + suffix)
+        except FileNotFoundError: pass
+
+
+def _to_float(value):
+    return math.nan if value is None else float(value)
+
+
+def _from_float(value):
+    return None if value is None or math.isnan(value) else value
+
+
+def _now():
+    return time.time()
+
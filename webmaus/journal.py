@@ -0,0 +1,130 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+STATES = ('queued', 'uploading', 'downloaded', 'written', 'failed')
+UNFINISHED_STATES = ('queued', 'uploading', 'downloaded', 'failed')
+
+
+class JobJournal:
+    def __init__(self, filename, batch_size = 500):
+        '''Persistent SQLite journal of pipeline jobs and their state.
+        Every job is keyed by its output filename and moves through the
+        states queued -> uploading -> downloaded -> written, or failed
+        (with a reason). Only written jobs, whose output was committed
+        atomically, count as done.
+        filename:           path to the sqlite database
+        batch_size:         number of newly queued jobs inserted per
+                            transaction
+        '''
+        self.filename = str(filename)
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending = []
+        self.connection = sqlite3.connect(self.filename,
+            check_same_thread = False, isolation_level = None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            key TEXT PRIMARY KEY, state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0, reason TEXT,
+            job TEXT NOT NULL, updated REAL NOT NULL)''')
+        self.connection.execute('''CREATE INDEX IF NOT EXISTS jobs_state
+            ON jobs (state)''')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY, value TEXT)''')
+
+    def __repr__(self):
+        return f'JobJournal({self.filename}, {self.counts()})'
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self.connection.close()
+
+    @property
+    def manifest_loaded(self):
+        '''True once every manifest entry has been recorded, so a resume
+        with the same manifest only needs the unfinished jobs.
+        '''
+        return self._meta('manifest_loaded') == '1'
+
+    @property
+    def manifest_fingerprint(self):
+        '''manifest.fingerprint of the manifest that was loaded, or None.'''
+        return self._meta('manifest_fingerprint')
+
+    def set_manifest_loaded(self, loaded = True, fingerprint = None):
+        with self._lock:
+            self._flush()
+            self.connection.executemany('''INSERT OR REPLACE INTO meta
+                VALUES (?, ?)''', [('manifest_loaded', '1' if loaded else '0'),
+                ('manifest_fingerprint', fingerprint)])
+
+    def _meta(self, name):
+        row = self.connection.execute('''SELECT value FROM meta
+            WHERE name = ?''', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def add(self, key, job):
+        '''Record a queued job; jobs that are already known keep their state.
+        key:                output filename of the job
+        job:                job tuple (see pipeline.parse_entry)
+        '''
+        with self._lock:
+            self._pending.append((key, json.dumps(job), time.time()))
+            if len(self._pending) >= self.batch_size: self._flush()
+
+    def set_state(self, key, state, reason = None):
+        '''Record a state transition; entering uploading counts an attempt.'''
+        if state not in STATES: raise ValueError(f'unknown state: {state}')
+        attempt = 1 if state == 'uploading' else 0
+        with self._lock:
+            self._flush()
+            self.connection.execute('''UPDATE jobs SET state = ?,
+                attempts = attempts + ?, reason = ?, updated = ?
+                WHERE key = ?''', (state, attempt, reason, time.time(), key))
+
+    def state(self, key):
+        '''Return (state, attempts, reason) of a job or None if unknown.'''
+        with self._lock:
+            self._flush()
+            return self.connection.execute('''SELECT state, attempts, reason
+                FROM jobs WHERE key = ?''', (key,)).fetchone()
+
+    def is_written(self, key):
+        state = self.state(key)
+        return state is not None and state[0] == 'written'
+
+    def unfinished(self):
+        '''Return the job tuples of all jobs that are not written.
+        Uses the state index, so the cost scales with the number of
+        unfinished jobs, not with the size of the manifest.
+        '''
+        with self._lock:
+            self._flush()
+            rows = self.connection.execute('''SELECT job FROM jobs
+                WHERE state IN (?, ?, ?, ?) ORDER BY rowid''',
+                UNFINISHED_STATES).fetchall()
+        return [tuple(json.loads(row[0])) for row in rows]
+
+    def counts(self):
+        '''Return a dict mapping each state to its number of jobs.'''
+        with self._lock:
+            self._flush()
+            rows = self.connection.execute('''SELECT state, count(*)
+                FROM jobs GROUP BY state''').fetchall()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(rows)
+        return counts
+
+    def _flush(self):
+        if not self._pending: return
+        self.connection.execute('BEGIN')
+        self.connection.executemany('''INSERT OR IGNORE INTO jobs
+            (key, state, job, updated) VALUES (?, 'queued', ?, ?)''',
+            self._pending)
+        self.connection.execute('COMMIT')
+        self._pending = []
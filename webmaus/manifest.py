@@ -0,0 +1,109 @@
+import csv
+import gzip
+import io
+import json
+import os
+from collections.abc import Sized
+from pathlib import Path
+
+
+NUMBER_FIELDS = ('start_time', 'end_time')
+
+
+def open_manifest(files, total = None, count = True):
+    '''Return the entries of a manifest as an iterable and their number.
+    files:              list of entry dicts, any iterable of entry dicts
+                        (read lazily) or the path of a CSV, TSV or JSONL
+                        manifest, optionally gzipped (read incrementally)
+    total:              number of entries if known; otherwise the length
+                        of a list or a line count of a manifest file
+    count:              count the lines of a manifest file when total is
+                        not given (False leaves the total unknown)
+    Returns: iterable of entry dicts; number of entries or None if unknown
+    '''
+    if isinstance(files, (str, Path)):
+        if total is None and count: total = count_entries(files)
+        return read_manifest(files), total
+    if total is None and isinstance(files, Sized): total = len(files)
+    return files, total
+
+
+def check_manifest(filename):
+    '''Raise FileNotFoundError if a manifest file does not exist and
+    ValueError if its format is unknown, before any job is scheduled.
+    '''
+    _kind(filename)
+    if not os.path.isfile(filename):
+        raise FileNotFoundError(f'manifest not found: {filename}')
+
+
+def fingerprint(files):
+    '''Identity of a manifest file (path, size and modification time), to
+    tell whether it changed since a journal recorded it.
+    Returns: string, or None for lists and iterables, which can not be
+             compared without reading them
+    '''
+    if not isinstance(files, (str, Path)): return None
+    stat = os.stat(files)
+    return f'{os.path.abspath(files)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def read_manifest(filename):
+    '''Yield the entries of a CSV, TSV or JSONL manifest one at a time.
+    CSV and TSV files need a header with the entry keys (audio_filename,
+    text_filename, start_time, end_time, text, output_directory); empty
+    cells are left out, so they take their default.
+    filename:           path; a .gz suffix is decompressed on the fly
+    '''
+    kind = _kind(filename)
+    with _open_text(filename) as f:
+        if kind == 'jsonl':
+            for line in f:
+                if line.strip(): yield json.loads(line)
+            return
+        delimiter = '\t' if kind == 'tsv' else ','
+        for row in csv.DictReader(f, delimiter = delimiter):
+            entry = {key: value for key, value in row.items()
+                if key is not None and value not in ('', None)}
+            for key in NUMBER_FIELDS:
+                if key in entry: entry[key] = float(entry[key])
+            yield entry
+
+
+def count_entries(filename, block_size = 1 << 20):
+    '''Count the entries of a manifest file by counting newlines in large
+    binary blocks (without parsing); blank lines and quoted newlines in
+    CSV cells are counted too, so the result is an estimate for such files.
+    Returns: number of entries
+    '''
+    lines = 0
+    last = b'\n'
+    with _open_binary(filename) as f:
+        while True:
+            block = f.read(block_size)
+            if not block: break
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n': lines += 1
+    if _kind(filename) != 'jsonl': lines -= 1
+    return max(0, lines)
+
+
+def _kind(filename):
+    suffixes = [s.lower() for s in Path(filename).suffixes]
+    if suffixes and suffixes[-1] == '.gz': suffixes = suffixes[:-1]
+    suffix = suffixes[-1] if suffixes else ''
+    if suffix in ('.jsonl', '.ndjson'): return 'jsonl'
+    if suffix in ('.tsv', '.tab'): return 'tsv'
+    if suffix == '.csv': return 'csv'
+    raise ValueError(f'unknown manifest format: {filename}')
+
+
+def _open_binary(filename):
+    if str(filename).lower().endswith('.gz'): return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def _open_text(filename):
+    return io.TextIOWrapper(_open_binary(filename), encoding = 'utf-8',
+        newline = '')
@@ -0,0 +1,169 @@
+import bisect
+import contextlib
+import contextvars
+import json
+import threading
+import time
+from collections import deque
+
+
+STAGES = ('load', 'encode', 'upload', 'server_wait', 'download', 'write')
+# upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    30, 60, 120, 300)
+
+_current = contextvars.ContextVar('webmaus_metrics_job', default = None)
+
+
+class Span:
+    __slots__ = ('job', 'stage', 'start', 'duration', 'bytes')
+
+    def __init__(self, job, stage, start, duration = 0.0, bytes = 0):
+        '''Time spent by one job in one stage.
+        job:                job name (e.g. the output filename)
+        stage:              one of STAGES
+        start:              wall clock time the stage started
+        duration:           seconds spent in the stage
+        bytes:              bytes read, uploaded, downloaded or written
+        '''
+        self.job = job
+        self.stage = stage
+        self.start = start
+        self.duration = duration
+        self.bytes = bytes
+
+    def __repr__(self):
+        m = f'Span({self.job}, {self.stage}, {self.duration * 1000:.1f} ms, '
+        m += f'{self.bytes} bytes)'
+        return m
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Metrics:
+    def __init__(self, hook = None, buckets = DEFAULT_BUCKETS,
+        max_spans = 10000):
+        '''Per stage timing of alignment jobs.
+        Spans of the stages load (reading and slicing audio, includes
+        encode), encode (upload profile conversion), upload, server_wait
+        (from the last uploaded byte to the reply), download and write are
+        aggregated into histograms per stage. Snapshots can be taken at
+        any time, also while a Pipeline is running.
+        hook:               optional callable receiving every Span, e.g. to
+                            forward spans to a tracing system
+        buckets:            upper bounds (seconds) of the histogram buckets
+        max_spans:          number of most recent spans kept in spans
+        '''
+        self.hook = hook
+        self.buckets = tuple(buckets)
+        self.spans = deque(maxlen = max_spans)
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def __repr__(self):
+        counts = ', '.join(f'{stage}={s["count"]}'
+            for stage, s in self._stages.items())
+        return f'Metrics({counts})'
+
+    @contextlib.contextmanager
+    def job(self, name):
+        '''Attribute the stages timed in this context (and in code it
+        calls in the same thread) to the job name.
+        '''
+        token = _current.set((self, name))
+        try: yield
+        finally: _current.reset(token)
+
+    def record(self, span):
+        with self._lock:
+            stage = self._stages.get(span.stage)
+            if stage is None:
+                stage = self._stages[span.stage] = {'count': 0, 'sum': 0.0,
+                    'bytes': 0, 'buckets': [0] * (len(self.buckets) + 1)}
+            stage['count'] += 1
+            stage['sum'] += span.duration
+            stage['bytes'] += span.bytes
+            stage['buckets'][bisect.bisect_left(self.buckets,
+                span.duration)] += 1
+            self.spans.append(span)
+        if self.hook is not None: self.hook(span)
+
+    def snapshot(self):
+        '''Return the histograms as a dict: for every stage the count, the
+        total seconds, the total bytes and the (non cumulative) count per
+        bucket upper bound ('inf' for the last bucket).
+        '''
+        bounds = [str(b) for b in self.buckets] + ['inf']
+        with self._lock:
+            return {'stages': {stage: {'count': s['count'], 'sum': s['sum'],
+                'bytes': s['bytes'], 'buckets': dict(zip(bounds,
+                s['buckets']))} for stage, s in self._stages.items()},
+                'time': time.time()}
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self, prefix = 'webmaus'):
+        '''Return the histograms in the Prometheus text exposition format.'''
+        snapshot = self.snapshot()['stages']
+        name = f'{prefix}_stage_seconds'
+        lines = [f'# HELP {name} Seconds spent per job in a stage.',
+            f'# TYPE {name} histogram']
+        for stage, s in snapshot.items():
+            total = 0
+            for bound, count in s['buckets'].items():
+                total += count
+                le = '+Inf' if bound == 'inf' else bound
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} '
+                    f'{total}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {s["sum"]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {s["count"]}')
+        name = f'{prefix}_stage_bytes_total'
+        lines += [f'# HELP {name} Bytes handled in a stage.',
+            f'# TYPE {name} counter']
+        for stage, s in snapshot.items():
+            lines.append(f'{name}{{stage="{stage}"}} {s["bytes"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        '''Write a snapshot atomically, as JSON if filename ends with .json
+        and in the Prometheus format otherwise (e.g. for the node exporter
+        textfile collector).
+        '''
+        from .connector import _write_atomic
+        if str(filename).endswith('.json'): text = self.to_json()
+        else: text = self.to_prometheus()
+        _write_atomic(filename, [text.encode()])
+
+
+@contextlib.contextmanager
+def stage(name, bytes = 0):
+    '''Time a stage of the current job (see Metrics.job).
+    Yields the Span, so the byte count can be set once it is known; does
+    nothing (and yields None) outside a job context.
+    '''
+    current = _current.get()
+    if current is None:
+        yield None
+        return
+    metrics, job = current
+    span = Span(job, name, time.time(), bytes = bytes)
+    start = time.perf_counter()
+    try: yield span
+    finally:
+        span.duration = time.perf_counter() - start
+        metrics.record(span)
+
+
+def record(name, start, duration, bytes = 0):
+    '''Record a stage of the current job that was timed by the caller.'''
+    current = _current.get()
+    if current is None: return
+    metrics, job = current
+    metrics.record(Span(job, name, start, duration, bytes))
+
+
+def active():
+    '''True inside a job context, i.e. when stages are being recorded.'''
+    return _current.get() is not None
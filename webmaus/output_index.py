@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+
+class OutputIndex:
+    def __init__(self, filename = None):
+        '''In memory index of the files in output directories, used to skip
+        jobs whose output exists without a stat call per job.
+        Every directory is listed once, with a single scandir, the first
+        time a file in it is looked up; outputs written afterwards are added
+        as jobs complete. With a filename the index is saved by save and
+        loaded on the next run: a directory whose modification time did not
+        change since the save is not listed again, so a warm restart costs
+        one stat per output directory.
+        The index assumes the pipeline is the only writer to its output
+        directories while it runs.
+        filename:           optional json file to persist the index in;
+                            keep it outside the output directories (saving
+                            it changes the modification time of its
+                            directory)
+        '''
+        self.filename = filename
+        self.scans = 0
+        self._lock = threading.Lock()
+        self._directories = {}
+        self._stored = {}
+        if filename is not None and Path(filename).exists(): self._load()
+
+    def __repr__(self):
+        n_files = sum(len(names) for names in self._directories.values())
+        m = f'OutputIndex({len(self._directories)} directories, '
+        m += f'{n_files} files)'
+        return m
+
+    def __contains__(self, filename):
+        return self.exists(filename)
+
+    def exists(self, filename):
+        '''True if filename exists (according to the index).'''
+        directory, name = _split(filename)
+        return name in self._names(directory)
+
+    def add(self, filename):
+        '''Record a file written after its directory was indexed.'''
+        directory, name = _split(filename)
+        names = self._names(directory)
+        with self._lock: names.add(name)
+
+    def discard(self, filename):
+        directory, name = _split(filename)
+        names = self._names(directory)
+        with self._lock: names.discard(name)
+
+    def save(self, filename = None):
+        '''Write the index atomically to filename (default: self.filename).
+        Directories that were loaded but not used in this run are kept.
+        '''
+        from .connector import _write_atomic
+        filename = self.filename if filename is None else filename
+        if filename is None: raise ValueError('no filename to save to')
+        with self._lock:
+            directories = dict(self._stored)
+            for directory, names in self._directories.items():
+                mtime = _mtime(directory)
+                if mtime is None: continue
+                directories[directory] = {'mtime_ns': mtime,
+                    'names': sorted(names)}
+        text = json.dumps({'directories': directories})
+        _write_atomic(filename, [text.encode()])
+
+    def _names(self, directory):
+        names = self._directories.get(directory)
+        if names is not None: return names
+        with self._lock:
+            names = self._directories.get(directory)
+            if names is None:
+                names = self._directories[directory] = self._scan(directory)
+            return names
+
+    def _scan(self, directory):
+        mtime = _mtime(directory)
+        stored = self._stored.pop(directory, None)
+        if mtime is None: return set()
+        if stored is not None and stored['mtime_ns'] == mtime:
+            return set(stored['names'])
+        self.scans += 1
+        with os.scandir(directory) as entries:
+            return {entry.name for entry in entries}
+
+    def _load(self):
+        with open(self.filename) as f:
+            self._stored = json.load(f)['directories']
+
+
+def _split(filename):
+    return os.path.split(os.path.abspath(filename))
+
+
+def _mtime(directory):
+    try: return os.stat(directory).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError): return None
@@ -1,47 +1,191 @@
+import queue
 import threading
 import time
+from collections import deque
 from pathlib import Path
-from progressbar import progressbar
 
-from .connector import run_pipeline, make_output_filename
+from . import audio
+from .audio import SegmentReader
+from .concurrency import AdaptiveConcurrency
+from .convert import Converter, derived_filename
+from .connector import run_pipeline, make_output_filename, get_load_indicator
+from .connector import DEFAULT_TIMEOUT
+from .jobstore import JobStore
+from .journal import JobJournal
+from .metrics import Metrics
+from .output_index import OutputIndex
+from . import manifest
+from . import session as session_module
+from . import sharding
 from . import utils
 
 
 class Pipeline:
     def __init__(self, files, output_directory, language, 
         output_format = 'TextGrid', pipe = 'G2P_MAUS_PHO2SYL',
-        preseg = 'true', language_dict = None, overwrite = False):
+        preseg = 'true', language_dict = None, overwrite = False,
+        session = None, max_workers = 9, adaptive = False,
+        retry_policy = None, cache = None, journal = None,
+        stream_downloads = True, upload_profile = None, corpus = None,
+        backend = None, metrics = None, job_store = None, total = None,
+        output_index = None, shard = None, claims = None, converter = None,
+        timeout = DEFAULT_TIMEOUT, job_timeout = 7200):
         '''Initialize the Pipeline object to handle forced alignment of
         orthographically annotated speech recordings.
         files:              list of dicts with 'audio_filename' and 
-                            'text_filename' keys
+                            'text_filename' keys, any iterable of such
+                            dicts (consumed lazily while jobs run) or the
+                            path of a CSV, TSV or JSONL manifest, optionally
+                            gzipped (see manifest.read_manifest)
         output_directory:   directory to save the output files
         language:           language code for the input files
-        output_format:      desired output format (default: 'TextGrid')
+        output_format:      desired output format (default: 'TextGrid'),
+                            or a list of formats: the TextGrid is then
+                            requested once and always written, the other
+                            formats (see convert.FORMATS) are derived from
+                            it locally
         pipe:               processing pipeline to use 
                             (default: 'G2P_MAUS_PHO2SYL')
         preseg:             whether to use pre-segmentation (default: 'true')
         language_dict:      optional dict mapping file IDs to language codes
+        overwrite:          re-align files whose output already exists
+        session:            requests session shared by all workers
+                            (default: the shared keep-alive webmaus session)
+        max_workers:        number of long-lived worker threads, i.e. the
+                            maximum number of concurrent alignments
+        adaptive:           adapt the number of concurrent alignments
+                            between 1 and max_workers to the BAS load
+                            indicator, latency and errors (AIMD); pass an
+                            AdaptiveConcurrency object to tune it
+        retry_policy:       retry.RetryPolicy for uploads and downloads
+                            (default: retry.default_policy())
+        cache:              optional cache.ResultCache serving repeated
+                            requests locally
+        journal:            optional path to a sqlite job journal (or a
+                            JobJournal); records every job state so a
+                            rerun resumes exactly the unfinished jobs
+        stream_downloads:   stream results straight to disk instead of
+                            holding them in memory (default: True)
+        upload_profile:     optional audio.UploadProfile to shrink uploads,
+                            e.g. UploadProfile() for 16 kHz mono FLAC
+        corpus:             optional corpus.Corpus (or its directory);
+                            every finished TextGrid is added to it
+        backend:            optional backends.Backend to align with instead
+                            of the BAS web service (e.g. a LocalBackend
+                            running a local MAUS install)
+        metrics:            optional metrics.Metrics (or True) recording the
+                            time every job spends loading, encoding,
+                            uploading, waiting for the server, downloading
+                            and writing
+        job_store:          jobstore.JobStore recording finished jobs
+                            (default: one spilling to a temporary file past
+                            100000 jobs); done, skipped, errors and infos
+                            are read only views of it (jobstore.JobView):
+                            they support len, indexing, slicing, iteration
+                            and comparison with lists, but unlike the lists
+                            of earlier versions they can not be appended
+                            to or changed; list(pipeline.done) copies one
+        total:              number of entries in files, for progress and
+                            ETA of iterables (default: len of a list, a
+                            line count of a manifest file, else unknown)
+        output_index:       optional path of a json file (or an
+                            output_index.OutputIndex) persisting the index
+                            of existing outputs, so a rerun does not list
+                            unchanged output directories again; without it
+                            every output directory is listed once per
+                            Pipeline instead of a stat call per job
+        shard:              (index, count) or sharding.HashShard: only align
+                            the entries whose output filename hashes to
+                            shard index of count (static multi-node split)
+        claims:             sharding.LeaseClaims or SQLiteClaims, or the
+                            path of a shared directory (lease files) or a
+                            .sqlite file: nodes running the same manifest
+                            claim every job before aligning it, and claims
+                            of dead nodes expire (dynamic multi-node split);
+                            a job claimed by another node is retried after
+                            lease_seconds until it is done there or
+                            claimed here
+        converter:          convert.Converter deriving the extra formats of
+                            an output_format list (default: one with a
+                            process per core)
+        timeout:            (connect, read) seconds for every upload and
+                            download, so a stalled connection fails (and is
+                            retried) instead of blocking a worker
+        job_timeout:        seconds after which a job that is still running
+                            is recorded as an error and its worker, which
+                            may be stuck in a call that never returns, is
+                            replaced (None: wait for every job)
         '''
 
+        if isinstance(files, (str, Path)): manifest.check_manifest(files)
         self.files = files
+        self.total = total
+        self.manifest_error = None
         self.output_directory = output_directory
         self.language = language
+        if isinstance(output_format, (list, tuple)):
+            derived = [f for f in output_format if f != 'TextGrid']
+            output_format = 'TextGrid'
+            if derived and converter is None: converter = Converter(derived)
         self.output_format = output_format
+        self.converter = converter
         self.pipe = pipe
         self.preseg = preseg
         self.language_dict = language_dict
         self.overwrite = overwrite
+        self.backend = backend
+        if metrics is True: metrics = Metrics()
+        self.metrics = metrics or None
+        if session is None: session = session_module.get_session()
+        self.session = session
+        self.retry_policy = retry_policy
+        self.timeout = timeout
+        self.job_timeout = job_timeout
+        self.cache = cache
+        if journal is not None and not isinstance(journal, JobJournal):
+            journal = JobJournal(journal)
+        self.journal = journal
+        self.stream_downloads = stream_downloads
+        self.segment_reader = None
+        self.upload_profile = upload_profile
+        if corpus is not None:
+            if output_format != 'TextGrid':
+                raise ValueError('a corpus can only be built from TextGrids')
+            # imported here, as it needs numpy
+            from .corpus import Corpus
+            if not isinstance(corpus, Corpus): corpus = Corpus(corpus)
+        self.corpus = corpus
+        if not isinstance(output_index, OutputIndex):
+            output_index = OutputIndex(output_index)
+        self.output_index = output_index
+        self.shard = sharding.make_shard(shard)
+        self.claims = sharding.make_claims(claims)
+        self.upload_stats = {'uploads': 0, 'bytes_uploaded': 0,
+            'bytes_original': 0, 'upload_seconds': 0.0}
+        self._stats_lock = threading.Lock()
 
-        self.done = []
-        self.skipped = []
-        self.errors = []
-        self.infos = []
-        self._max_concurrent_executors = 9
+        self.jobs = JobStore() if job_store is None else job_store
+        self.done = self.jobs.view('done')
+        self.skipped = self.jobs.view('skipped')
+        self.errors = self.jobs.view('error')
+        self.infos = self.jobs.view(info = True)
+        self._max_concurrent_executors = max_workers
+        if adaptive is True:
+            adaptive = AdaptiveConcurrency(max_limit = max_workers,
+                load_indicator = self._load_indicator)
+        self.concurrency = adaptive or None
         self.executors = []
         self.output_directories = set()
-        self.wait_time = 1
         self._stop_run = False
+        self._active = 0
+        self._active_lock = threading.Lock()
+        # worker thread -> (start time, job) of the jobs being aligned
+        self._running_jobs = {}
+        # workers given up on by the watchdog
+        self._abandoned = set()
+        self._watchdog_thread = None
+        self._watchdog_stop = threading.Event()
+        self.finished = threading.Event()
         self.running = False
         self.status_done = False
 
@@ -56,13 +200,21 @@ class Pipeline:
         self._stop_run = False
         self.running = True
         self.status_done = False
+        self.finished.clear()
         self.run_thread = threading.Thread(target=self._run)
         self.run_thread.start()
 
     def stop(self):
+        '''Stop scheduling new jobs; jobs that already started complete.'''
         self._stop_run = True
         self.running = False
 
+    def wait(self, timeout = None):
+        '''Block until the current run has finished.
+        Returns: True if the run finished, False on timeout
+        '''
+        return self.finished.wait(timeout)
+
     @property
     def eta_seconds(self):
         eta = self.tracker.eta
@@ -70,67 +222,97 @@ class Pipeline:
         
     @property
     def eta(self):
-        t = f'ETA: {self.tracker.pretty_eta}\n'
-        t += f'working executors: {len(self.executors)}\n'
+        tracker = self.tracker
+        t = f'ETA: {tracker.pretty_eta}\n'
+        rtf = tracker.realtime_factor
+        rtf = 'N/A' if rtf is None else f'{rtf:.2f}x'
+        t += f'realtime factor: {rtf}\n'
+        t += f'audio done: {utils.seconds_to_dd_hh_mm_ss(tracker.done_seconds)}'
+        t += ', remaining (estimate): '
+        t += f'{utils.seconds_to_dd_hh_mm_ss(tracker.remaining_seconds)}\n'
+        t += f'queue depth: {tracker.queue_depth}, '
+        t += f'in flight: {tracker.in_flight}\n'
+        t += f'working executors: {self._active} of '
+        t += f'{self._max_concurrent_executors}\n'
+        if self.concurrency is not None:
+            t += f'concurrency current: {self.concurrency.in_flight}, '
+            t += f'target: {self.concurrency.target}, '
+            t += f'server load: {self.concurrency.load}\n'
         t += f'files done: {len(self.done)}\n'
         t += f'files skipped: {len(self.skipped)}\n'
         t += f'errors: {len(self.errors)}\n'
-        t += f'at file number: {self.tracker._i} of {self.tracker.total}\n'
-        t += f'percentage done: {self.tracker.percentage_done:.2f}%\n'
+        t += f'at file number: {tracker._i} of {tracker.total}\n'
+        t += f'percentage done: {tracker.percentage_done:.2f}%\n'
         t += f'running: {self.running}\n'
         t += f'status done: {self.status_done}\n'
+        if self.claims is not None:
+            cluster = self.cluster_progress()
+            alive = sum(p['alive'] for p in cluster['nodes'].values())
+            total = cluster['total']
+            t += f'nodes: {len(cluster["nodes"])} ({alive} alive), '
+            t += f'done on all nodes: {total.get("done", 0)}, '
+            t += f'errors on all nodes: {total.get("errors", 0)}\n'
         print(t)
 
     def _run(self, show_progress = False):
-        self.tracker = utils.LoopETA(total=len(self.files), 
+        self.finished.clear()
+        try: self._run_jobs(show_progress)
+        except Exception as e:
+            # e.g. an unreadable manifest: the run ends with the error
+            # instead of leaving wait() blocked
+            print(f'Error running jobs: {e}')
+            self.manifest_error = e
+        finally:
+            self.running = False
+            self.finished.set()
+
+    def _run_jobs(self, show_progress):
+        jobs, total = self._jobs()
+        self.tracker = utils.ThroughputETA(total=total,
             show_progress=show_progress)
+        self._queue = queue.Queue(maxsize=self._max_concurrent_executors * 2)
+        self._start_workers()
+        if self.claims is not None: self.claims.start(self.progress)
+        # (retry time, job, output file) of jobs claimed by other nodes
+        self._deferred = deque()
         processed = 0
-        for index, entry in enumerate(self.files):
-            processed = index + 1
-            self.tracker.update(index + 1)
-            if self._stop_run: 
-                print("Work interrupted by user, started jobs will complete.")
-                break
-            audio_filename = entry['audio_filename']
-            text_filename = entry.get('text_filename', None)
-            start_time = entry.get('start_time', None)
-            end_time = entry.get('end_time', None)
-            text = entry.get('text', None)
-            output_directory = entry.get('output_directory', None)
-            if output_directory is None:
-                output_directory = self.output_directory
-            self.output_directories.add(output_directory)
-            
-            output_file = make_output_filename(output_directory,
-                audio_filename, self.output_format, start_time, end_time)
-
-            if Path(output_file).exists() and not self.overwrite:
-                self.skipped.append((audio_filename, start_time, end_time,
-                    str(output_file)))
-                self.infos.append(make_info(audio_filename, start_time,
-                    end_time, str(output_file), 'skipped'))
-                continue
+        exhausted = False
+        try:
+            for index, job in enumerate(jobs):
+                if self._stop_run: 
+                    print('Work interrupted by user, started jobs will '
+                        'complete.')
+                    break
+                processed = index + 1
+                self.tracker.update(index + 1)
+                self._schedule(job)
+                self._schedule_deferred(wait = False)
+            else: exhausted = True
+            if exhausted: self._schedule_deferred()
+        except Exception as e:
+            # e.g. a broken manifest row: stop scheduling, queued jobs
+            # still complete
+            print(f'Error scheduling jobs: {e}')
+            self.manifest_error = e
+        if self.journal is not None and exhausted and not self._stop_run:
+            self.journal.set_manifest_loaded(fingerprint = self._fingerprint)
+        print("Waiting for all jobs to complete...")
+        self._queue.join()
+        self._stop_workers()
+        # shuts down the process pool of a local aligner
+        if self.backend is not None: self.backend.close()
+        # waits for the pending conversions
+        if self.converter is not None: self.converter.close()
+        self.running = False
+        if self.claims is not None: self.claims.stop()
+        self.tracker.finish()
+        if self.segment_reader is not None:
+            self.segment_reader.close()
+            self.segment_reader = None
+        if self.corpus is not None: self.corpus.flush()
+        if self.output_index.filename is not None: self.output_index.save()
 
-            ok = self._throttle()
-            if not ok: 
-                print("Work interrupted due to thread pool restart.")
-                break
-
-            thread = threading.Thread(target=self._run_single,
-                args=(audio_filename, text_filename, start_time, end_time,
-                    text, output_directory))
-            thread.start()
-            self.executors.append(thread)
-            time.sleep(self.wait_time)
-        print("Waiting for all threads to complete...")
-        while len(self.executors) > 0:
-            time.sleep(self.wait_time)
-            ok = self._throttle()
-            if not ok:
-                print("Work interrupted due to thread pool restart.")
-                break
-
-        if processed == self.tracker.total:
+        if exhausted and not self._stop_run:
             self.status_done = True
         print("audio files processed.")
         m = f'Done: {len(self.done)}, '
@@ -138,22 +320,265 @@ class Pipeline:
         m += f'Errors: {len(self.errors)}'
         m += f'\nFiles can be found in : {self.output_directories}'
         m += f'\nfiles processed: {processed} of {self.tracker.total}'
+        if self.upload_profile is not None:
+            saved, seconds = self.upload_savings
+            m += f'\nupload bytes saved: {saved / 1024 ** 2:.1f} MiB, '
+            m += 'upload time saved (estimate): '
+            m += f'{utils.seconds_to_dd_hh_mm_ss(seconds)}'
+        if self.converter is not None:
+            m += f'\nconversion errors: {len(self.converter.errors)}'
+        if self.cache is not None:
+            m += f'\ncache hits: {self.cache.hits}, '
+            m += f'cache misses: {self.cache.misses}'
         m += f'\nstatus done: {self.status_done}'
         print(m)
-        self.running = False
+
+    def _schedule(self, job):
+        '''Queue a job, or record it as skipped if its output exists.'''
+        audio_filename, text_filename, start_time, end_time, text, \
+            output_directory = job
+        self.output_directories.add(output_directory)
+
+        output_file = make_output_filename(output_directory,
+            audio_filename, self.output_format, start_time, end_time)
+
+        if self.shard is not None and not self.shard.owns(output_file):
+            self.tracker.skip()
+            return
+
+        if not self.overwrite and self._is_finished(output_file):
+            self.jobs.add('skipped', audio_filename, start_time, end_time,
+                str(output_file))
+            # outputs of earlier runs that are not in the corpus yet
+            self._add_to_corpus(output_file, audio_filename, start_time,
+                end_time)
+            self._convert(output_file, missing_only = True)
+            self.tracker.skip()
+            return
+
+        if self.claims is None: self._enqueue(job, output_file)
+        else: self._claim(job, output_file)
+
+    def _claim(self, job, output_file):
+        '''Queue a job if this node claims it. A job another node aligns is
+        looked at again once its lease could have expired.
+        '''
+        if self.claims.claim(output_file): self._enqueue(job, output_file)
+        elif self.claims.is_done(output_file): self.tracker.skip()
+        else:
+            retry_at = time.time() + self.claims.lease_seconds
+            self._deferred.append((retry_at, job, output_file))
+
+    def _enqueue(self, job, output_file):
+        audio_filename, _, start_time, end_time = job[:4]
+        self.tracker.submit(output_file, audio.duration(audio_filename,
+            start_time, end_time))
+
+        if self.journal is not None: self.journal.add(output_file, job)
+        # blocks while the queue is full, so at most a few jobs wait
+        # ahead of the workers
+        self._queue.put(job)
+
+    def _schedule_deferred(self, wait = True):
+        '''Retry the jobs claimed by other nodes whose retry time passed.
+        wait:               wait for the other deferred jobs too, until each
+                            is done by another node or claimed here (e.g.
+                            after its node died)
+        '''
+        while self._deferred and not self._stop_run:
+            retry_at, job, output_file = self._deferred[0]
+            delay = retry_at - time.time()
+            if delay > 0:
+                if not wait: return
+                # short sleeps, so stop() is noticed
+                time.sleep(min(delay, 1))
+                continue
+            self._deferred.popleft()
+            self._claim(job, output_file)
+
+    def _jobs(self):
+        '''Return the jobs to schedule and their number.
+        When the journal holds the complete manifest and the manifest file
+        did not change since, only its unfinished jobs are returned.
+        Otherwise every manifest entry is parsed and checked against the
+        journal (see _is_finished), so rows added to the manifest are
+        aligned and rows already written are skipped.
+        '''
+        self._fingerprint = manifest.fingerprint(self.files)
+        if self.journal is not None and self.journal.manifest_loaded \
+            and not self.overwrite and self._fingerprint is not None \
+            and self._fingerprint == self.journal.manifest_fingerprint:
+            jobs = self.journal.unfinished()
+            return jobs, len(jobs)
+        entries, total = manifest.open_manifest(self.files, self.total)
+        if not isinstance(entries, (list, tuple)):
+            # parsed lazily, so reading the manifest overlaps with the
+            # alignments; segments of one recording can not be grouped, but
+            # recently used recordings stay open
+            self.segment_reader = SegmentReader()
+            return (parse_entry(entry, self.output_directory)
+                for entry in entries), total
+        jobs = [parse_entry(entry, self.output_directory)
+            for entry in entries]
+        if _shares_audio_files(jobs):
+            # serve segments of the same recording from one open handle,
+            # in time order
+            jobs.sort(key = lambda job: (str(job[0]), job[2] or 0))
+            self.segment_reader = SegmentReader()
+        return jobs, len(jobs)
+
+    def _is_finished(self, output_file):
+        '''With a journal only jobs recorded as written are finished;
+        outputs that predate the journal are adopted if they exist.
+        '''
+        if self.journal is None: return self.output_index.exists(output_file)
+        state = self.journal.state(output_file)
+        if state is not None: return state[0] == 'written'
+        return self.output_index.exists(output_file)
+
+    def _load_indicator(self):
+        if self.backend is None: return get_load_indicator(self.session)
+        return self.backend.load_indicator(self.session)
+
+    def _start_workers(self):
+        if self.concurrency is not None: self.concurrency.start()
+        self.executors = []
+        for _ in range(self._max_concurrent_executors):
+            self._start_worker()
+        if self.job_timeout is not None:
+            self._watchdog_stop.clear()
+            self._watchdog_thread = threading.Thread(target=self._watchdog,
+                daemon=True)
+            self._watchdog_thread.start()
+
+    def _start_worker(self):
+        worker = threading.Thread(target=self._worker, daemon=True)
+        worker.start()
+        self.executors.append(worker)
+
+    def _stop_workers(self):
+        if self._watchdog_thread is not None:
+            self._watchdog_stop.set()
+            self._watchdog_thread.join()
+            self._watchdog_thread = None
+        for _ in self.executors:
+            self._queue.put(None)
+        for worker in self.executors:
+            worker.join()
+        self.executors = []
+        if self.concurrency is not None: self.concurrency.stop()
+
+    def _worker(self):
+        '''Long-lived worker: takes jobs from the queue until it receives
+        the None sentinel. Jobs queued after stop() are dropped.
+        '''
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            try:
+                if not self._stop_run: self._run_job(job)
+                elif self.claims is not None:
+                    self.claims.release(self._job_name(job))
+            except Exception as e:
+                audio_filename, _, start_time, end_time = job[:4]
+                print(f'Error aligning {audio_filename}: {e}')
+                self._record_error(audio_filename, start_time, end_time,
+                    job[-1], repr(e))
+            # the watchdog failed the job and replaced this worker
+            if self._is_abandoned(): return
+            self._queue.task_done()
+
+    def _run_job(self, job):
+        if self.concurrency is not None: self.concurrency.acquire()
+        worker = threading.current_thread()
+        start = time.time()
+        with self._active_lock:
+            self._active += 1
+            self._running_jobs[worker] = (start, job)
+        output_file = None
+        name = self._job_name(job)
+        self.tracker.start(name)
+        try:
+            if self.metrics is None: output_file = self._run_single(*job)
+            else:
+                with self.metrics.job(name):
+                    output_file = self._run_single(*job)
+        finally:
+            with self._active_lock:
+                abandoned = worker in self._abandoned
+                if not abandoned:
+                    self._active -= 1
+                    del self._running_jobs[worker]
+            if not abandoned:
+                self._finish_job(name, output_file is not None)
+
+    def _finish_job(self, name, success):
+        self.tracker.complete(name)
+        if self.claims is not None: self.claims.release(name, done = success)
+        if self.concurrency is not None:
+            self.concurrency.release(success)
+
+    def _watchdog(self):
+        '''Fail the jobs running longer than job_timeout, so a worker stuck
+        in a call that never returns can not keep the run from finishing.
+        '''
+        interval = min(60, self.job_timeout / 4)
+        while not self._watchdog_stop.wait(interval):
+            try: self._fail_stalled_jobs()
+            except Exception as e: print(f'Watchdog error: {e}')
+
+    def _fail_stalled_jobs(self):
+        now = time.time()
+        with self._active_lock:
+            stalled = [(worker, job) for worker, (start, job)
+                in self._running_jobs.items()
+                if now - start > self.job_timeout]
+            for worker, _ in stalled:
+                del self._running_jobs[worker]
+                self._abandoned.add(worker)
+                self._active -= 1
+                self.executors.remove(worker)
+        for _, job in stalled:
+            name = self._job_name(job)
+            m = f'{name} still running after {self.job_timeout} seconds, '
+            m += 'recorded as an error, starting a new worker'
+            print(m)
+            audio_filename, _, start_time, end_time = job[:4]
+            self._record_error(audio_filename, start_time, end_time,
+                job[-1], f'stalled for more than {self.job_timeout} seconds')
+            self._finish_job(name, False)
+            self._start_worker()
+            self._queue.task_done()
+
+    def _is_abandoned(self):
+        '''True in a worker the watchdog gave up on: the results of its
+        late job are not recorded, the job already counts as an error.
+        '''
+        return threading.current_thread() in self._abandoned
+
+    def _job_name(self, job):
+        audio_filename, _, start_time, end_time, _, output_directory = job
+        if output_directory is None: output_directory = self.output_directory
+        return make_output_filename(output_directory, audio_filename,
+            self.output_format, start_time, end_time)
 
     def _run_single(self, audio_filename, text_filename, start_time = None, 
         end_time = None, text=None, output_directory = None):
         '''Run the forced alignment pipeline for a single audio-text pair.
         audio_filename:     path to the audio file
         text_filename:      path to the text file
+        Returns: the output filename, or None on error
         '''
-        language = self.language
-
-        if self.language_dict:
-            sid = Path(audio_filename).stem
-            language = self.language_dict.get(sid, language)
+        language = language_for(audio_filename, self.language,
+            self.language_dict)
+        if output_directory is None:
+            output_directory = self.output_directory
+        output_file = make_output_filename(output_directory, audio_filename,
+            self.output_format, start_time, end_time)
 
+        self._set_job_state(output_file, 'uploading')
         response = run_pipeline(
             audio_filename=audio_filename,
             text_filename=text_filename,
@@ -164,82 +589,185 @@ class Pipeline:
             pipe=self.pipe,
             preseg=self.preseg,
             text=text,
+            session=self.session,
+            retry_policy=self.retry_policy,
+            cache=self.cache,
+            segment_reader=self.segment_reader,
+            upload_profile=self.upload_profile,
+            backend=self.backend,
+            timeout=self.timeout,
         )
+        self._update_upload_stats(response)
+        self._observe_latency(response, audio_filename, start_time, end_time)
 
         if response is None or not response.success:
-            self.errors.append((audio_filename, start_time, end_time))
-            self.infos.append(make_info(audio_filename, start_time, end_time,
-                None, 'error'))
-            return
+            reason = 'no response' if response is None else response.output
+            self._record_error(audio_filename, start_time, end_time,
+                output_directory, reason)
+            return None
 
-        if output_directory is None:
-            output_directory = self.output_directory
+        if not self.stream_downloads:
+            if response.download() is None:
+                self._record_error(audio_filename, start_time, end_time,
+                    output_directory, 'download failed')
+                return None
+            self._set_job_state(output_file, 'downloaded')
         f = response.save_alignment(output_directory = output_directory,
             audio_filename = audio_filename, start_time = start_time,
-            end_time = end_time, output_format = self.output_format)
-        self.done.append((audio_filename, start_time, end_time, f))
-        self.infos.append(make_info(audio_filename, start_time, end_time,
-            f, 'done'))
-
-    def _throttle(self):
-        '''Throttle the number of concurrent threads to avoid overloading 
-        the system.
-        checks the number of active threads every second, and if there are
-        more than 6 active threads for more than 20 minutes, it restarts
-        (assuming some threads are stuck).
-        cleans ups finished threads from the executor list.
+            end_time = end_time, output_format = self.output_format,
+            stream = self.stream_downloads)
+        if f is None:
+            self._record_error(audio_filename, start_time, end_time,
+                output_directory, 'download failed')
+            return None
+        self._set_job_state(output_file, 'written')
+        self.output_index.add(f)
+        if self._is_abandoned(): return f
+        self.jobs.add('done', audio_filename, start_time, end_time, f)
+        self._add_to_corpus(f, audio_filename, start_time, end_time)
+        self._convert(f)
+        return f
+
+    def _add_to_corpus(self, output_file, audio_filename, start_time,
+        end_time):
+        '''Add an output to the corpus; the alignment itself succeeded, so
+        a corpus error is reported without failing the job.
+        '''
+        if self.corpus is None or output_file in self.corpus: return
+        try:
+            self.corpus.add(output_file, audio_filename, start_time, end_time)
+        except Exception as e:
+            print(f'Could not add {output_file} to the corpus: {e}')
+
+    def _convert(self, output_file, missing_only = False):
+        '''Derive the other output formats from a TextGrid in the
+        converter's process pool.
+        missing_only:       only the formats whose file does not exist
+                            (for outputs of earlier runs)
         '''
-        self.executors = [e for e in self.executors if e.is_alive()]
-        self.start = time.time()
-        do_restart = False
-        while len(self.executors) >= self._max_concurrent_executors:
-            time.sleep(1)
-            self.executors = [e for e in self.executors if e.is_alive()]
-            if time.time() - self.start > 1200:
-                print("Timeout waiting for threads to complete.")
-                do_restart = True
-                break
-        if do_restart:
-            print("Restarting thread pool...")
-            self.executors = []
-            time.sleep(3)
-            self.run()
-            return False
-        return True
+        if self.converter is None: return
+        formats = self.converter.output_formats
+        if missing_only:
+            formats = [f for f in formats if not self.output_index.exists(
+                derived_filename(output_file, f))]
+            if not formats: return
+        future = self.converter.submit(output_file, formats)
+        future.add_done_callback(self._converted)
 
+    def _converted(self, future):
+        if future.exception() is not None: return
+        for filename in future.result(): self.output_index.add(filename)
+
+    def _observe_latency(self, response, audio_filename, start_time,
+        end_time):
+        '''Feed the server time of an uncached request, per second of
+        audio, to the adaptive concurrency.
+        '''
+        if self.concurrency is None or response is None: return
+        if response.cached or response.request_seconds is None: return
+        if not response.success: return
+        seconds = audio.duration(audio_filename, start_time, end_time)
+        if not seconds: return
+        self.concurrency.observe_latency(response.request_seconds / seconds)
+
+    def _update_upload_stats(self, response):
+        if response is None or response.cached: return
+        with self._stats_lock:
+            stats = self.upload_stats
+            stats['uploads'] += 1
+            stats['bytes_uploaded'] += response.upload_bytes
+            stats['bytes_original'] += response.original_upload_bytes
+            stats['upload_seconds'] += response.upload_seconds
+
+    @property
+    def upload_savings(self):
+        '''Bytes saved by the upload profile and an estimate of the upload
+        time saved, extrapolated from the observed seconds per uploaded
+        byte (which includes server time, so it is an upper bound).
+        Returns: bytes saved; seconds saved
+        '''
+        stats = self.upload_stats
+        saved = stats['bytes_original'] - stats['bytes_uploaded']
+        if stats['bytes_uploaded'] == 0: return saved, 0.0
+        seconds_per_byte = stats['upload_seconds'] / stats['bytes_uploaded']
+        return saved, saved * seconds_per_byte
+
+    def _record_error(self, audio_filename, start_time, end_time,
+        output_directory, reason = None):
+        if self._is_abandoned(): return
+        self.jobs.add('error', audio_filename, start_time, end_time)
+        if output_directory is None:
+            output_directory = self.output_directory
+        output_file = make_output_filename(output_directory, audio_filename,
+            self.output_format, start_time, end_time)
+        self._set_job_state(output_file, 'failed', reason)
+
+    def _set_job_state(self, output_file, state, reason = None):
+        if self.journal is not None:
+            self.journal.set_state(output_file, state, reason)
+
+    def progress(self):
+        '''Counts of this run, as published to the other nodes.'''
+        tracker = self.tracker
+        return {'done': len(self.done), 'skipped': len(self.skipped),
+            'errors': len(self.errors), 'in_flight': tracker.in_flight,
+            'entries': tracker.total or 0, 'running': self.running}
+
+    def cluster_progress(self):
+        '''Progress of all nodes sharing the claims (see
+        sharding.Claims.progress), or None without claims.
+        '''
+        if self.claims is None: return None
+        return self.claims.progress()
 
     @property
     def done_infos(self):
-        infos = [info for info in self.infos if info['status'] == 'done']
-        return infos 
+        return list(self.jobs.view('done', info = True))
 
     @property
     def error_infos(self):
-        infos = [info for info in self.infos if info['status'] == 'error']
-        return infos
+        return list(self.jobs.view('error', info = True))
 
     @property
     def skipped_infos(self):
-        infos = [info for info in self.infos if info['status'] == 'skipped']
-        return infos
-        
+        return list(self.jobs.view('skipped', info = True))
 
 
 
     
             
 
-def make_info(audio_filename, start_time, end_time, output_file, status):
-    info = {
-        'audio_filename': audio_filename,
-        'start_time': start_time,
-        'end_time': end_time,
-        'output_file': output_file,
-        'status': status,
-        'timestamp': readable_timestamp(),
-        'time': time.time(),
-        }
-    return info
-
-def readable_timestamp():
-    return time.strftime('%a %d %b %Y, %H:%M', time.localtime())
+def parse_entry(entry, output_directory):
+    '''Turn a manifest entry into the job tuple handled by the workers.
+    entry:              dict with an 'audio_filename' key and optional
+                        'text_filename', 'start_time', 'end_time', 'text'
+                        and 'output_directory' keys
+    output_directory:   directory used when the entry does not set one
+    Returns: (audio_filename, text_filename, start_time, end_time, text,
+             output_directory); filenames are strings (pathlib.Path
+             entries are converted), so a job can be journaled as json
+    '''
+    entry_output_directory = entry.get('output_directory', None)
+    if entry_output_directory is None:
+        entry_output_directory = output_directory
+    text_filename = entry.get('text_filename', None)
+    if text_filename is not None: text_filename = str(text_filename)
+    return (str(entry['audio_filename']), text_filename,
+        entry.get('start_time', None), entry.get('end_time', None),
+        entry.get('text', None), str(entry_output_directory))
+
+def _shares_audio_files(jobs):
+    '''True if several segment jobs point into the same recording.'''
+    seen = set()
+    for audio_filename, _, start_time, end_time, _, _ in jobs:
+        if start_time is None and end_time is None: continue
+        if audio_filename in seen: return True
+        seen.add(audio_filename)
+    return False
+
+def language_for(audio_filename, language, language_dict = None):
+    '''Look up the language of a file by its stem in language_dict.'''
+    if language_dict:
+        sid = Path(audio_filename).stem
+        language = language_dict.get(sid, language)
+    return language
@@ -0,0 +1,213 @@
+import asyncio
+import random
+import threading
+import time
+
+from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
+
+
+TRANSIENT_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    '''Raised when the circuit breaker does not allow a request.'''
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts = 5, base_delay = 2.0, max_delay = 120.0,
+        jitter = True, transient_status_codes = TRANSIENT_STATUS_CODES):
+        '''Retry policy with exponential backoff and full jitter.
+        max_attempts:       total number of attempts (1 disables retries)
+        base_delay:         delay in seconds before the first retry
+        max_delay:          upper bound for the delay in seconds
+        jitter:             draw the delay uniformly between 0 and the
+                            exponential backoff, so workers that failed
+                            together do not retry together
+        transient_status_codes: http status codes worth retrying
+        '''
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.transient_status_codes = transient_status_codes
+
+    def __repr__(self):
+        m = f'RetryPolicy(max_attempts={self.max_attempts}, '
+        m += f'base_delay={self.base_delay}, max_delay={self.max_delay})'
+        return m
+
+    def delay(self, attempt):
+        '''Seconds to wait after the given (1 based) failed attempt.'''
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if self.jitter: delay = random.uniform(0, delay)
+        return delay
+
+    def is_transient_error(self, error):
+        return isinstance(error, (ConnectionError, Timeout,
+            ChunkedEncodingError))
+
+    def is_transient_status(self, status_code):
+        return status_code in self.transient_status_codes
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold = 5, reset_timeout = 60):
+        '''Stops all callers after repeated transient failures.
+        After failure_threshold consecutive failures the circuit opens and
+        callers wait. After reset_timeout seconds a single caller is let
+        through as a probe; its success closes the circuit, its failure
+        opens it again.
+        failure_threshold:  consecutive failures that open the circuit
+        reset_timeout:      seconds to wait before probing the service
+        '''
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return f'CircuitBreaker(state={self.state}, failures={self.failures})'
+
+    def wait(self, timeout = None):
+        '''Block until a request may be sent.
+        timeout:            maximum seconds to wait (None waits forever)
+        Raises CircuitOpenError if the circuit is still open after timeout.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while True:
+                if self.state == 'closed': return
+                now = time.time()
+                if self.state == 'open':
+                    reopen = self.opened_at + self.reset_timeout
+                    if now >= reopen:
+                        self.state = 'half_open'
+                        continue
+                    wait = reopen - now
+                elif not self._probing:
+                    self._probing = True
+                    return
+                else: wait = None
+                if deadline is not None:
+                    if now >= deadline:
+                        raise CircuitOpenError('webmaus service unavailable')
+                    wait = deadline - now if wait is None else min(wait,
+                        deadline - now)
+                self._condition.wait(wait)
+
+    def record_success(self):
+        with self._condition:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+            self._condition.notify_all()
+
+    def record_neutral(self):
+        '''End an attempt that says nothing about the health of the
+        service (e.g. a request rejected as invalid): the state is kept,
+        but a half open circuit lets the next probe through.
+        '''
+        with self._condition:
+            self._probing = False
+            self._condition.notify_all()
+
+    def record_failure(self):
+        with self._condition:
+            self.failures += 1
+            if self.state == 'half_open' or \
+                self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print('webmaus service unavailable, pausing requests for',
+                        self.reset_timeout, 'seconds')
+                self.state = 'open'
+                self.opened_at = time.time()
+            self._probing = False
+            self._condition.notify_all()
+
+
+_default_policy = RetryPolicy()
+_circuit_breaker = CircuitBreaker()
+
+
+def default_policy():
+    return _default_policy
+
+
+def get_circuit_breaker():
+    '''Return the process wide circuit breaker shared by all workers.'''
+    return _circuit_breaker
+
+
+def call_with_retry(func, is_transient_result, policy = None,
+    circuit_breaker = None):
+    '''Call func until it succeeds, fails permanently or attempts run out.
+    func:               callable without arguments performing one attempt
+    is_transient_result: callable returning True if a result should be
+                        retried
+    policy:             RetryPolicy (default: the default policy)
+    circuit_breaker:    CircuitBreaker (default: the process wide breaker)
+    Returns: result of the last attempt; number of attempts
+    Raises the last transient error if every attempt raised one; other
+    errors are permanent and raised immediately.
+    '''
+    if policy is None: policy = default_policy()
+    if circuit_breaker is None: circuit_breaker = get_circuit_breaker()
+    attempt = 0
+    while True:
+        attempt += 1
+        circuit_breaker.wait()
+        try:
+            result = func()
+        except Exception as e:
+            if not policy.is_transient_error(e):
+                circuit_breaker.record_neutral()
+                raise
+            circuit_breaker.record_failure()
+            if attempt >= policy.max_attempts: raise
+        else:
+            if not is_transient_result(result):
+                circuit_breaker.record_success()
+                return result, attempt
+            circuit_breaker.record_failure()
+            if attempt >= policy.max_attempts: return result, attempt
+        time.sleep(policy.delay(attempt))
+
+
+async def acall_with_retry(func, is_transient_result, policy = None,
+    circuit_breaker = None, transient_errors = ()):
+    '''Asyncio counterpart of call_with_retry; the backoff is awaited and
+    an open circuit is waited for in a worker thread, so the event loop
+    is never blocked.
+    func:               coroutine function without arguments performing
+                        one attempt
+    transient_errors:   exception types retried besides those of
+                        policy.is_transient_error (e.g. aiohttp connection
+                        errors)
+    Returns: result of the last attempt; number of attempts
+    '''
+    if policy is None: policy = default_policy()
+    if circuit_breaker is None: circuit_breaker = get_circuit_breaker()
+    attempt = 0
+    while True:
+        attempt += 1
+        try: circuit_breaker.wait(0)
+        except CircuitOpenError: await asyncio.to_thread(circuit_breaker.wait)
+        try:
+            result = await func()
+        except Exception as e:
+            if not (isinstance(e, transient_errors) or
+                policy.is_transient_error(e)):
+                circuit_breaker.record_neutral()
+                raise
+            circuit_breaker.record_failure()
+            if attempt >= policy.max_attempts: raise
+        else:
+            if not is_transient_result(result):
+                circuit_breaker.record_success()
+                return result, attempt
+            circuit_breaker.record_failure()
+            if attempt >= policy.max_attempts: return result, attempt
+        await asyncio.sleep(policy.delay(attempt))
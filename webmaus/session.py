@@ -0,0 +1,79 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_PER_HOST = 16
+DEFAULT_ASYNC_LIMIT = 1000
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def make_session(pool_size = DEFAULT_POOL_SIZE,
+    max_per_host = DEFAULT_MAX_PER_HOST, keep_alive = True, block = False):
+    '''Create a requests session backed by a keep-alive connection pool.
+    pool_size:          number of per-host connection pools to cache
+    max_per_host:       maximum number of connections kept open per host
+    keep_alive:         reuse connections between requests (default: True)
+    block:              wait for a free connection instead of opening an
+                        extra one when max_per_host is reached
+    Returns: requests.Session
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = pool_size,
+        pool_maxsize = max_per_host, pool_block = block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def get_session():
+    '''Return the process wide session shared by all webmaus calls.
+    The session is created on first use with the default pool settings.
+    '''
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = make_session()
+        return _default_session
+
+
+def set_session(session):
+    '''Replace the process wide session (e.g. with one from make_session
+    with a larger pool). Returns the previous session.
+    '''
+    global _default_session
+    with _default_session_lock:
+        previous = _default_session
+        _default_session = session
+    return previous
+
+
+def import_aiohttp():
+    '''Import aiohttp, which is only needed for the asyncio api.'''
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise ImportError('the asyncio api requires aiohttp, install it '
+            'with: pip install "webmaus[async]"') from e
+    return aiohttp
+
+
+def make_async_session(limit = DEFAULT_ASYNC_LIMIT,
+    max_per_host = DEFAULT_ASYNC_LIMIT, keep_alive = True):
+    '''Create an aiohttp session backed by a keep-alive connection pool.
+    Must be called from a running event loop.
+    limit:              maximum number of open connections in total
+    max_per_host:       maximum number of open connections per host
+    keep_alive:         reuse connections between requests (default: True)
+    Returns: aiohttp.ClientSession
+    '''
+    aiohttp = import_aiohttp()
+    connector = aiohttp.TCPConnector(limit = limit,
+        limit_per_host = max_per_host, force_close = not keep_alive)
+    return aiohttp.ClientSession(connector = connector)
@@ -0,0 +1,355 @@
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+def shard_of(key, count):
+    '''Stable shard number of a job key (the same on every machine and in
+    every Python process, unlike hash).
+    key:                job key, e.g. the output filename
+    count:              number of shards
+    '''
+    digest = hashlib.blake2b(str(key).encode(), digest_size = 8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+class HashShard:
+    def __init__(self, index, count):
+        '''Static partition of a manifest: the shard owns the jobs whose
+        key hashes to index (see shard_of). Every node runs the full
+        manifest with its own index; no coordination is needed, but a
+        dead node's jobs are only done when its shard is rerun.
+        index:              shard of this node, 0 <= index < count
+        count:              number of shards (nodes)
+        '''
+        if not 0 <= index < count:
+            raise ValueError(f'shard index {index} not in 0..{count - 1}')
+        self.index = index
+        self.count = count
+
+    def __repr__(self):
+        return f'HashShard({self.index} of {self.count})'
+
+    def owns(self, key):
+        return shard_of(key, self.count) == self.index
+
+
+def make_shard(shard):
+    '''Return a HashShard for a HashShard, an (index, count) tuple or None.'''
+    if shard is None or isinstance(shard, HashShard): return shard
+    return HashShard(*shard)
+
+
+def make_claims(claims, **kwargs):
+    '''Return claims for a Claims object, a path to a .sqlite or .db file
+    (SQLiteClaims) or a directory (LeaseClaims), or None.
+    '''
+    if claims is None or isinstance(claims, Claims): return claims
+    if Path(claims).suffix in ('.sqlite', '.db'):
+        return SQLiteClaims(claims, **kwargs)
+    return LeaseClaims(claims, **kwargs)
+
+
+def default_node():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class Claims:
+    '''Dynamic work sharing between nodes running the same manifest.
+    A node claims a job before aligning it and releases the claim when the
+    job is finished (done, so no node aligns it again) or failed (so any
+    node may retry it). A claim is a lease: the node renews it while the
+    job runs and a claim that is not renewed for lease_seconds expires,
+    so the jobs of a dead node are picked up by the others. Every node
+    also publishes its progress, which progress aggregates.
+    Subclasses implement claim, release, progress, _renew and _report.
+    '''
+    def __init__(self, node = None, lease_seconds = 600):
+        '''node:               name of this node (default: host-pid)
+        lease_seconds:      seconds after which an unrenewed claim expires;
+                            should be well above the clock skew between
+                            nodes
+        '''
+        self.node = default_node() if node is None else node
+        self.lease_seconds = lease_seconds
+        self.held = set()
+        self._held_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._progress = None
+
+    def claim(self, key):
+        '''Claim a job; returns True if this node should run it.'''
+        raise NotImplementedError
+
+    def release(self, key, done = False):
+        '''Release a claim; done marks the job as finished for all nodes.
+        A claim another node took over meanwhile is left to that node.
+        '''
+        raise NotImplementedError
+
+    def is_done(self, key):
+        '''True if some node finished the job.'''
+        raise NotImplementedError
+
+    def progress(self):
+        '''Return the published progress of all nodes: a dict with 'nodes'
+        (node name -> progress dict, with 'alive' False for nodes that did
+        not report within lease_seconds) and 'total' (the sum of the
+        numeric progress fields of all nodes, the maximum for entries).
+        '''
+        raise NotImplementedError
+
+    def start(self, progress = None):
+        '''Start renewing the held claims (and publishing progress) in a
+        background thread, every third of lease_seconds.
+        progress:           optional callable returning a dict of counts
+        '''
+        self._progress = progress
+        self._stop.clear()
+        self._thread = threading.Thread(target = self._heartbeat,
+            daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the heartbeat and publish the final progress.'''
+        self._stop.set()
+        if self._thread is not None: self._thread.join()
+        self._thread = None
+        self.beat()
+
+    def beat(self):
+        with self._held_lock: keys = list(self.held)
+        if keys: self._renew(keys)
+        if self._progress is not None:
+            self._report(dict(self._progress(), updated = time.time()))
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try: self.beat()
+            except Exception as e: print(f'Could not renew claims: {e}')
+
+    def _hold(self, key):
+        with self._held_lock: self.held.add(key)
+
+    def _drop(self, key):
+        with self._held_lock: self.held.discard(key)
+
+    def _renew(self, keys):
+        raise NotImplementedError
+
+    def _report(self, progress):
+        raise NotImplementedError
+
+
+class LeaseClaims(Claims):
+    def __init__(self, directory, node = None, lease_seconds = 600):
+        '''Claims as lease files in a directory on a shared filesystem.
+        A claim creates <directory>/leases/<ab>/<hash>.lease with O_EXCL,
+        which succeeds on exactly one node; renewing touches it. An expired
+        lease is taken over by renaming it away (again atomic), a finished
+        job leaves a .done marker. Progress is published as
+        <directory>/nodes/<node>.json.
+        directory:          shared directory, e.g. next to the outputs
+        '''
+        super().__init__(node, lease_seconds)
+        self.directory = Path(directory)
+        (self.directory / 'nodes').mkdir(parents = True, exist_ok = True)
+
+    def __repr__(self):
+        return f'LeaseClaims({self.directory}, node={self.node})'
+
+    def claim(self, key):
+        lease = self._lease_filename(key)
+        if self._done_filename(lease).exists(): return False
+        lease.parent.mkdir(parents = True, exist_ok = True)
+        for _ in range(2):
+            if self._create(lease, key):
+                # the job may have finished between the check and the create
+                if self._done_filename(lease).exists():
+                    lease.unlink(missing_ok = True)
+                    return False
+                self._hold(key)
+                return True
+            if not self._take_over(lease): return False
+        return False
+
+    def release(self, key, done = False):
+        lease = self._lease_filename(key)
+        if done: self._done_filename(lease).touch()
+        if self._owner(lease) == self.node: lease.unlink(missing_ok = True)
+        self._drop(key)
+
+    def is_done(self, key):
+        return self._done_filename(self._lease_filename(key)).exists()
+
+    def progress(self):
+        nodes = {}
+        for filename in sorted((self.directory / 'nodes').glob('*.json')):
+            try: nodes[filename.stem] = json.loads(filename.read_text())
+            except (OSError, ValueError): continue
+        return _aggregate(nodes, self.lease_seconds)
+
+    def _renew(self, keys):
+        for key in keys:
+            lease = self._lease_filename(key)
+            # an expired lease may have been taken over by another node
+            if self._owner(lease) != self.node:
+                self._drop(key)
+                continue
+            try: os.utime(lease)
+            except FileNotFoundError: self._drop(key)
+
+    def _report(self, progress):
+        from .connector import _write_atomic
+        filename = self.directory / 'nodes' / f'{self.node}.json'
+        _write_atomic(filename, [json.dumps(progress).encode()])
+
+    def _create(self, lease, key):
+        try: fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError: return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'node': self.node, 'key': str(key),
+                'time': time.time()}, f)
+        return True
+
+    def _owner(self, lease):
+        '''Node holding a lease, None if there is none (or it is still
+        being written).
+        '''
+        try: return json.loads(lease.read_text())['node']
+        except (OSError, ValueError, KeyError): return None
+
+    def _take_over(self, lease):
+        '''Move an expired lease out of the way; True if the lease is gone
+        (expired or released meanwhile), so it can be created again.
+        '''
+        try: age = time.time() - lease.stat().st_mtime
+        except FileNotFoundError: return True
+        if age < self.lease_seconds: return False
+        stale = lease.with_name(f'{lease.name}.{self.node}.stale')
+        try: os.rename(lease, stale)
+        except FileNotFoundError: return True
+        # another node may have replaced the expired lease with a fresh one
+        # between the stat and the rename: give it back
+        if time.time() - stale.stat().st_mtime < self.lease_seconds:
+            try: os.link(stale, lease)
+            except FileExistsError: pass
+            stale.unlink(missing_ok = True)
+            return False
+        stale.unlink(missing_ok = True)
+        return True
+
+    def _lease_filename(self, key):
+        digest = hashlib.sha1(str(key).encode()).hexdigest()
+        return self.directory / 'leases' / digest[:2] / f'{digest}.lease'
+
+    def _done_filename(self, lease):
+        return lease.with_suffix('.done')
+
+
+class SQLiteClaims(Claims):
+    def __init__(self, filename, node = None, lease_seconds = 600,
+        timeout = 60):
+        '''Claims in a shared SQLite database; every claim is one short
+        write transaction. Uses the rollback journal, as WAL needs shared
+        memory that network filesystems do not provide; the filesystem
+        must support the locks SQLite relies on.
+        filename:           path of the sqlite database
+        timeout:            seconds to wait for the database lock
+        '''
+        super().__init__(node, lease_seconds)
+        self.filename = str(filename)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.filename, timeout = timeout,
+            check_same_thread = False, isolation_level = None)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS claims (
+            key TEXT PRIMARY KEY, node TEXT NOT NULL, state TEXT NOT NULL,
+            expires REAL NOT NULL)''')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS nodes (
+            node TEXT PRIMARY KEY, progress TEXT NOT NULL)''')
+
+    def __repr__(self):
+        return f'SQLiteClaims({self.filename}, node={self.node})'
+
+    def close(self):
+        with self._lock: self.connection.close()
+
+    def claim(self, key):
+        key = str(key)
+        now = time.time()
+        with self._lock:
+            c = self.connection
+            c.execute('BEGIN IMMEDIATE')
+            try:
+                row = c.execute('''SELECT node, state, expires FROM claims
+                    WHERE key = ?''', (key,)).fetchone()
+                claimed = row is None or (row[1] == 'running'
+                    and (row[2] < now or row[0] == self.node))
+                if claimed:
+                    c.execute('''INSERT OR REPLACE INTO claims
+                        VALUES (?, ?, 'running', ?)''',
+                        (key, self.node, now + self.lease_seconds))
+                c.execute('COMMIT')
+            except BaseException:
+                c.execute('ROLLBACK')
+                raise
+        if claimed: self._hold(key)
+        return claimed
+
+    def release(self, key, done = False):
+        key = str(key)
+        with self._lock:
+            if done:
+                self.connection.execute('''UPDATE claims SET state = 'done'
+                    WHERE key = ?''', (key,))
+            else:
+                self.connection.execute('''DELETE FROM claims
+                    WHERE key = ? AND node = ?''', (key, self.node))
+        self._drop(key)
+
+    def is_done(self, key):
+        with self._lock:
+            row = self.connection.execute('''SELECT state FROM claims
+                WHERE key = ?''', (str(key),)).fetchone()
+        return row is not None and row[0] == 'done'
+
+    def progress(self):
+        with self._lock:
+            rows = self.connection.execute('''SELECT node, progress
+                FROM nodes ORDER BY node''').fetchall()
+        nodes = {node: json.loads(progress) for node, progress in rows}
+        return _aggregate(nodes, self.lease_seconds)
+
+    def _renew(self, keys):
+        expires = time.time() + self.lease_seconds
+        with self._lock:
+            self.connection.executemany('''UPDATE claims SET expires = ?
+                WHERE key = ? AND node = ? AND state = 'running' ''',
+                [(expires, str(key), self.node) for key in keys])
+
+    def _report(self, progress):
+        with self._lock:
+            self.connection.execute('''INSERT OR REPLACE INTO nodes
+                VALUES (?, ?)''', (self.node, json.dumps(progress)))
+
+
+def _aggregate(nodes, lease_seconds):
+    '''Sum the counts of all nodes; entries (the manifest size, seen by
+    every node) is the maximum instead.
+    '''
+    now = time.time()
+    total = {}
+    for progress in nodes.values():
+        progress['alive'] = now - progress.get('updated', 0) < lease_seconds
+        for name, value in progress.items():
+            if name in ('updated', 'alive', 'running'): continue
+            if not isinstance(value, (int, float)): continue
+            if name == 'entries': total[name] = max(total.get(name, 0), value)
+            else: total[name] = total.get(name, 0) + value
+    return {'nodes': nodes, 'total': total}
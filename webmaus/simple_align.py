@@ -1,3 +1,5 @@
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 from .connector import run_pipeline
@@ -9,14 +11,18 @@ DEFAULT_LANGUAGE = languages['dutch']
 
 def align_text(transcription, audio_filename, output_filename,
     language = DEFAULT_LANGUAGE, pipe = 'G2P_MAUS_PHO2SYL',
-    preseg = 'true'):
+    preseg = 'true', session = None, cache = None, backend = None):
     '''Align a transcription string with an audio file and save the result.
+    session:    requests session to use (default: the shared webmaus session)
+    cache:      optional cache.ResultCache, hits are served locally
+    backend:    optional backends.Backend (default: the BAS web service)
     '''
     output_path = Path(output_filename)
     response = run_pipeline(audio_filename = audio_filename,
         text_filename = None, language = language,
         output_format = _output_format_from_filename(output_path),
-        pipe = pipe, preseg = preseg, text = transcription)
+        pipe = pipe, preseg = preseg, text = transcription,
+        session = session, cache = cache, backend = backend)
     if response is None or not response.success:
         raise RuntimeError(f'Alignment failed for {audio_filename}')
     output_path.parent.mkdir(parents = True, exist_ok = True)
@@ -26,21 +32,99 @@ def align_text(transcription, audio_filename, output_filename,
 
 def align_texts(transcriptions, audio_filenames, output_filenames,
     language = DEFAULT_LANGUAGE, pipe = 'G2P_MAUS_PHO2SYL',
-    preseg = 'true'):
+    preseg = 'true', session = None, cache = None, backend = None,
+    max_workers = 1, fail_fast = True):
     '''Align multiple transcription strings with matching audio files.
+    all alignments share one keep-alive session (default: the shared
+    webmaus session).
+    max_workers:        number of concurrent alignments (default: 1, one
+                        after the other)
+    fail_fast:          stop at the first failed alignment and raise its
+                        exception, with the results so far attached as
+                        results (a list in input order: the output filename
+                        of every finished alignment, the exception of the
+                        failed one and None for alignments that did not
+                        run) and its input position as index; if False
+                        every alignment runs and a failed one is returned as
+                        its exception, in place
+    Returns: list of output filenames (or exceptions) in input order
+    Invalid arguments (lengths that differ, an output filename without an
+    extension) raise a ValueError before any alignment starts.
+    '''
+    results = [None] * len(transcriptions)
+    with contextlib.closing(iter_align_texts(transcriptions,
+        audio_filenames, output_filenames, language = language, pipe = pipe,
+        preseg = preseg, session = session, cache = cache, backend = backend,
+        max_workers = max_workers)) as alignments:
+        for index, result in alignments:
+            results[index] = result
+            if fail_fast and isinstance(result, Exception):
+                # closing the generator cancels the pending alignments
+                result.results = results
+                result.index = index
+                raise result
+    return results
+
+
+def iter_align_texts(transcriptions, audio_filenames, output_filenames,
+    language = DEFAULT_LANGUAGE, pipe = 'G2P_MAUS_PHO2SYL',
+    preseg = 'true', session = None, cache = None, backend = None,
+    max_workers = 4, fail_fast = False):
+    '''Align multiple transcriptions concurrently, yielding every result as
+    soon as it is done (not in input order).
+    max_workers:        number of concurrent alignments
+    fail_fast:          raise the exception of the first failed alignment
+                        (with its input position as index); if False a
+                        failed alignment is yielded as its exception
+    Yields: (index, output filename or exception) tuples, index being the
+            input position
+    The arguments are validated when it is called, before any alignment
+    starts (see align_texts). Pending alignments are cancelled when the
+    generator is closed, e.g. when the caller stops iterating early.
     '''
     if not len(transcriptions) == len(audio_filenames) == len(output_filenames):
         raise ValueError('transcriptions, audio_filenames, and '
             'output_filenames must have the same length')
+    for output_filename in output_filenames:
+        _output_format_from_filename(Path(output_filename))
+    kwargs = {'language': language, 'pipe': pipe, 'preseg': preseg,
+        'session': session, 'cache': cache, 'backend': backend}
+    jobs = enumerate(zip(transcriptions, audio_filenames, output_filenames))
+    return _iter_align(jobs, kwargs, max_workers, fail_fast)
+
+
+def _iter_align(jobs, kwargs, max_workers, fail_fast):
+    if max_workers <= 1:
+        for index, job in jobs:
+            result = _align(job, kwargs)
+            if fail_fast and isinstance(result, Exception):
+                result.index = index
+                raise result
+            yield index, result
+        return
+    executor = ThreadPoolExecutor(max_workers)
+    try:
+        futures = {executor.submit(_align, job, kwargs): index
+            for index, job in jobs}
+        for future in as_completed(futures):
+            result = future.result()
+            if fail_fast and isinstance(result, Exception):
+                result.index = futures[future]
+                raise result
+            yield futures[future], result
+    finally:
+        executor.shutdown(cancel_futures = True)
+
 
-    output_files = []
-    for transcription, audio_filename, output_filename in zip(
-        transcriptions, audio_filenames, output_filenames):
-        output_files.append(align_text(transcription = transcription,
+def _align(job, kwargs):
+    '''Run align_text; a failure is returned instead of raised.'''
+    transcription, audio_filename, output_filename = job
+    try:
+        return align_text(transcription = transcription,
             audio_filename = audio_filename,
-            output_filename = output_filename, language = language,
-            pipe = pipe, preseg = preseg))
-    return output_files
+            output_filename = output_filename, **kwargs)
+    except Exception as e:
+        return e
 
 
 def _output_format_from_filename(output_filename):
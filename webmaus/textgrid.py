@@ -0,0 +1,323 @@
+import re
+
+import numpy as np
+
+
+HEADER = 'File type = "ooTextFile"\nObject class = "TextGrid"\n\n'
+
+_TEXT = r'"((?:[^"]|"")*)"'
+_GRID = re.compile(r'xmin = (\S+)\s*xmax = (\S+)')
+_ITEM = re.compile(r'item \[\d+\]:\s*class = "(\w+)"\s*name = ' + _TEXT
+    + r'\s*xmin = (\S+)\s*xmax = (\S+)\s*(?:intervals|points): size = (\d+)')
+_INTERVAL = re.compile(r'xmin = (\S+)\s*xmax = (\S+)\s*text = ' + _TEXT)
+_POINT = re.compile(r'(?:number|time) = (\S+)\s*mark = ' + _TEXT)
+
+
+class Alignment:
+    def __init__(self, xmin, xmax, tiers = None, labels = None):
+        '''Compact, array backed TextGrid.
+        Every tier stores its start and end times as float64 arrays and its
+        labels as int32 indices into the label list shared by all tiers
+        (each distinct label is stored once).
+        xmin:               start time of the TextGrid
+        xmax:               end time of the TextGrid
+        tiers:              list of Tier objects
+        labels:             list of distinct labels
+        '''
+        self.xmin = xmin
+        self.xmax = xmax
+        self.tiers = [] if tiers is None else tiers
+        self.labels = [] if labels is None else labels
+        self._label_ids = {label: i for i, label in enumerate(self.labels)}
+
+    def __repr__(self):
+        names = ', '.join(tier.name for tier in self.tiers)
+        return f'Alignment(xmin={self.xmin}, xmax={self.xmax}, tiers=[{names}])'
+
+    def __getitem__(self, name):
+        for tier in self.tiers:
+            if tier.name == name: return tier
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return any(tier.name == name for tier in self.tiers)
+
+    @property
+    def tier_names(self):
+        return [tier.name for tier in self.tiers]
+
+    @classmethod
+    def from_text(cls, text, header_only = False):
+        '''Parse a TextGrid in the long text format written by MAUS.
+        text:               TextGrid file content
+        header_only:        only parse the tier headers (name, class, times
+                            and size); the intervals of a tier are parsed
+                            when its arrays are first accessed
+        '''
+        grid = _GRID.search(text)
+        if grid is None: raise ValueError('not a TextGrid')
+        alignment = cls(float(grid.group(1)), float(grid.group(2)))
+        matches = list(_ITEM.finditer(text))
+        ends = [m.start() for m in matches[1:]] + [len(text)]
+        for m, end in zip(matches, ends):
+            tier = Tier(_unquote(m.group(2)), m.group(1), float(m.group(3)),
+                float(m.group(4)), int(m.group(5)), alignment,
+                source = (text, m.end(), end))
+            if not header_only: tier.load()
+            alignment.tiers.append(tier)
+        return alignment
+
+    @classmethod
+    def read(cls, filename, header_only = False):
+        with open(filename) as f:
+            return cls.from_text(f.read(), header_only)
+
+    @classmethod
+    def from_dict(cls, textgrid):
+        '''Create an Alignment from a TextGrid dict (see read_textgrid).'''
+        alignment = cls(textgrid['xmin'], textgrid['xmax'])
+        for t in textgrid['tiers']:
+            items = t['items']
+            tier = Tier(t['name'], t['class'], t['xmin'], t['xmax'],
+                len(items), alignment)
+            if t['class'] == 'IntervalTier':
+                starts = [item[0] for item in items]
+                ends = [item[1] for item in items]
+                labels = [item[2] for item in items]
+            else:
+                starts = ends = [item[0] for item in items]
+                labels = [item[1] for item in items]
+            tier._set(np.array(starts, dtype = np.float64),
+                np.array(ends, dtype = np.float64), alignment.intern(labels))
+            alignment.tiers.append(tier)
+        return alignment
+
+    def to_dict(self):
+        '''Return the TextGrid dict used by write_textgrid.'''
+        return {'xmin': self.xmin, 'xmax': self.xmax,
+            'tiers': [tier.to_dict() for tier in self.tiers]}
+
+    def to_text(self):
+        return write_textgrid(self.to_dict())
+
+    def intern(self, labels):
+        '''Map labels to indices in the shared label list.
+        Returns: int32 numpy array
+        '''
+        ids = self._label_ids
+        append = self.labels.append
+        indices = []
+        for label in labels:
+            index = ids.get(label)
+            if index is None:
+                index = ids[label] = len(ids)
+                append(label)
+            indices.append(index)
+        return np.array(indices, dtype = np.int32)
+
+    def label_id(self, label):
+        '''Return the index of label, or -1 if it does not occur.'''
+        return self._label_ids.get(label, -1)
+
+
+class Tier:
+    __slots__ = ('name', 'tier_class', 'xmin', 'xmax', 'size', 'alignment',
+        '_source', '_start', '_end', '_label_index')
+
+    def __init__(self, name, tier_class, xmin, xmax, size, alignment,
+        source = None):
+        '''A tier of an Alignment; interval tiers have start < end, point
+        tiers have start == end.
+        '''
+        self.name = name
+        self.tier_class = tier_class
+        self.xmin = xmin
+        self.xmax = xmax
+        self.size = size
+        self.alignment = alignment
+        self._source = source
+        self._start = self._end = self._label_index = None
+
+    def __repr__(self):
+        return f'Tier({self.name}, {self.tier_class}, size={self.size})'
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        label = self.alignment.labels[self.label_index[index]]
+        if self.is_interval:
+            return float(self.start[index]), float(self.end[index]), label
+        return float(self.start[index]), label
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self[index]
+
+    @property
+    def is_interval(self):
+        return self.tier_class == 'IntervalTier'
+
+    @property
+    def loaded(self):
+        return self._source is None
+
+    @property
+    def start(self):
+        self.load()
+        return self._start
+
+    @property
+    def end(self):
+        self.load()
+        return self._end
+
+    @property
+    def label_index(self):
+        self.load()
+        return self._label_index
+
+    @property
+    def labels(self):
+        '''Labels of all items (a list, materialized on request).'''
+        labels = self.alignment.labels
+        return [labels[i] for i in self.label_index]
+
+    @property
+    def durations(self):
+        return self.end - self.start
+
+    def find(self, label):
+        '''Return the indices of the items with the given label.'''
+        return np.flatnonzero(self.label_index == self.alignment.label_id(label))
+
+    def load(self):
+        '''Parse the items of a tier read with header_only.'''
+        if self._source is None: return
+        text, start, end = self._source
+        if self.is_interval:
+            rows = _INTERVAL.findall(text, start, end)
+            starts, ends, labels = zip(*rows) if rows else ((), (), ())
+            ends = np.array(ends, dtype = np.float64)
+        else:
+            rows = _POINT.findall(text, start, end)
+            starts, labels = zip(*rows) if rows else ((), ())
+            ends = None
+        # numpy converts the number strings in C
+        starts = np.array(starts, dtype = np.float64)
+        if ends is None: ends = starts
+        labels = [_unquote(label) if '"' in label else label
+            for label in labels]
+        self._set(starts, ends, self.alignment.intern(labels))
+        self._source = None
+
+    def _set(self, start, end, label_index):
+        self._start = start
+        self._end = end
+        self._label_index = label_index
+        self.size = len(label_index)
+
+    def to_dict(self):
+        labels = self.labels
+        if self.is_interval:
+            items = list(zip(self.start.tolist(), self.end.tolist(), labels))
+        else: items = list(zip(self.start.tolist(), labels))
+        return {'class': self.tier_class, 'name': self.name,
+            'xmin': self.xmin, 'xmax': self.xmax, 'items': items}
+
+
+def read_textgrid(text):
+    '''Parse a TextGrid in the long text format written by MAUS and Praat.
+    text:               TextGrid file content
+    Returns: dict with xmin, xmax and tiers; every tier is a dict with
+             class, name, xmin, xmax and items, a list of (xmin, xmax,
+             label) tuples for interval tiers or (time, label) tuples for
+             point tiers
+    '''
+    return Alignment.from_text(text).to_dict()
+
+
+def write_textgrid(textgrid):
+    '''Serialize a TextGrid dict (see read_textgrid) to the long format.'''
+    lines = [HEADER.rstrip('\n'), '',
+        f'xmin = {_number(textgrid["xmin"])}',
+        f'xmax = {_number(textgrid["xmax"])}',
+        'tiers? <exists>', f'size = {len(textgrid["tiers"])}', 'item []:']
+    for index, tier in enumerate(textgrid['tiers'], 1):
+        lines += [f'    item [{index}]:',
+            f'        class = "{tier["class"]}"',
+            f'        name = "{_quote(tier["name"])}"',
+            f'        xmin = {_number(tier["xmin"])}',
+            f'        xmax = {_number(tier["xmax"])}']
+        items = tier['items']
+        if tier['class'] == 'IntervalTier':
+            lines.append(f'        intervals: size = {len(items)}')
+            for i, (xmin, xmax, label) in enumerate(items, 1):
+                lines += [f'        intervals [{i}]:',
+                    f'            xmin = {_number(xmin)}',
+                    f'            xmax = {_number(xmax)}',
+                    f'            text = "{_quote(label)}"']
+        else:
+            lines.append(f'        points: size = {len(items)}')
+            for i, (time, label) in enumerate(items, 1):
+                lines += [f'        points [{i}]:',
+                    f'            number = {_number(time)}',
+                    f'            mark = "{_quote(label)}"']
+    return '\n'.join(lines) + '\n'
+
+
+def merge_textgrids(textgrids, offsets, xmax = None,
+    pause_labels = ('', '<p:>')):
+    '''Stitch TextGrids of consecutive chunks into one TextGrid.
+    textgrids:          list of TextGrid dicts, one per chunk, in time order
+    offsets:            start time of every chunk in the full recording
+    xmax:               end time of the full recording (default: end of the
+                        last chunk)
+    pause_labels:       labels of intervals that are joined when they meet
+                        at a chunk boundary
+    Returns: TextGrid dict with every time shifted by its chunk offset
+    '''
+    if len(textgrids) != len(offsets):
+        raise ValueError('textgrids and offsets must have the same length')
+    if xmax is None: xmax = offsets[-1] + textgrids[-1]['xmax']
+    tiers = []
+    for first in textgrids[0]['tiers']:
+        tier = {'class': first['class'], 'name': first['name'],
+            'xmin': offsets[0] + first['xmin'], 'xmax': xmax, 'items': []}
+        items = tier['items']
+        for textgrid, offset in zip(textgrids, offsets):
+            source = _find_tier(textgrid, first['name'])
+            if source is None: continue
+            for item in source['items']:
+                if tier['class'] != 'IntervalTier':
+                    items.append((item[0] + offset, item[1]))
+                    continue
+                start, end, label = item[0] + offset, item[1] + offset, item[2]
+                if items and label in pause_labels and \
+                    items[-1][2] in pause_labels and \
+                    abs(items[-1][1] - start) < 1e-6:
+                    items[-1] = (items[-1][0], end, items[-1][2])
+                else: items.append((start, end, label))
+        if tier['class'] == 'IntervalTier' and items:
+            items[-1] = (items[-1][0], max(items[-1][1], xmax), items[-1][2])
+        tiers.append(tier)
+    return {'xmin': tiers[0]['xmin'] if tiers else 0, 'xmax': xmax,
+        'tiers': tiers}
+
+
+def _find_tier(textgrid, name):
+    for tier in textgrid['tiers']:
+        if tier['name'] == name: return tier
+    return None
+
+
+def _number(value):
+    return f'{value:.15g}'
+
+
+def _quote(label):
+    return label.replace('"', '""')
+
+
+def _unquote(label):
+    return label.replace('""', '"')
@@ -1,5 +1,5 @@
+import threading
 import time
-import progressbar
 
 transcription_set= ['sampa', 'ipa', 'manner', 'place']
 
@@ -59,6 +59,7 @@ class LoopETA:
         self._i = None
 
         if show_progress:
+            import progressbar
             self._bar = progressbar.ProgressBar(
                 max_value=total,
             )
@@ -88,6 +89,177 @@ class LoopETA:
             return 0
         return self._i / self.total * 100
 
+class ThroughputETA:
+    def __init__(self, total, show_progress = False, alpha = 0.3,
+        min_interval = 1.0):
+        '''Progress and ETA weighted by audio duration.
+        Jobs are registered with their audio seconds when they are
+        submitted and counted as done when they complete, so long and short
+        segments weigh in proportion to their length. Throughput is an EWMA
+        of audio seconds completed per wall clock second; jobs still in
+        flight are credited with the part they have probably finished.
+        Has the interface of LoopETA (update, eta, pretty_eta,
+        percentage_done, total).
+        total:              number of jobs (None if unknown)
+        show_progress:      show a progress bar of completed jobs
+        alpha:              weight of the newest throughput sample
+        min_interval:       minimum seconds between throughput samples, so
+                            jobs finishing together form one sample
+        '''
+        self.total = total
+        self.show_progress = show_progress
+        self.alpha = alpha
+        self.min_interval = min_interval
+        self.submitted = 0
+        self.skipped = 0
+        self.completed = 0
+        self.submitted_seconds = 0.0
+        self._known = 0
+        self.done_seconds = 0.0
+        self.throughput = None
+        self.job_realtime_factor = None
+        self._i = None
+        self._start = time.time()
+        self._jobs = {}
+        self._in_flight = {}
+        self._sample_start = self._start
+        self._sample_seconds = 0.0
+        self._lock = threading.Lock()
+        self._bar = None
+        if show_progress:
+            import progressbar
+            self._bar = progressbar.ProgressBar(max_value=total)
+            self._bar.start()
+
+    def update(self, i):
+        '''Record that i jobs were handed out (submitted or skipped).'''
+        self._i = i
+
+    def submit(self, key, seconds):
+        '''Register a queued job and its audio duration (None if unknown,
+        the mean duration of the other jobs is assumed).
+        '''
+        with self._lock:
+            self._jobs[key] = seconds
+            self.submitted += 1
+            if seconds is not None:
+                self.submitted_seconds += seconds
+                self._known += 1
+
+    def skip(self):
+        '''Record a job that needs no work; it does not affect the ETA.'''
+        with self._lock: self.skipped += 1
+
+    def start(self, key):
+        with self._lock: self._in_flight[key] = time.time()
+
+    def complete(self, key):
+        '''Record a completed (or failed) job and update the throughput.'''
+        now = time.time()
+        with self._lock:
+            started = self._in_flight.pop(key, None)
+            seconds = self._seconds(self._jobs.pop(key, None))
+            self.completed += 1
+            self.done_seconds += seconds
+            if started is not None and seconds > 0:
+                self.job_realtime_factor = self._ewma(
+                    self.job_realtime_factor, (now - started) / seconds)
+            self._sample_seconds += seconds
+            elapsed = now - self._sample_start
+            if elapsed >= self.min_interval:
+                self.throughput = self._ewma(self.throughput,
+                    self._sample_seconds / elapsed)
+                self._sample_start = now
+                self._sample_seconds = 0.0
+        if self._bar is not None: self._bar.update(self.completed)
+
+    def finish(self):
+        if self._bar is not None: self._bar.finish()
+
+    @property
+    def mean_seconds(self):
+        '''Mean audio duration of the submitted jobs with a known one.'''
+        if self._known == 0: return 0.0
+        return self.submitted_seconds / self._known
+
+    @property
+    def remaining_seconds(self):
+        '''Audio seconds still to align: queued and in flight jobs (minus
+        the credit for in flight work) plus unsubmitted jobs at the mean
+        duration.
+        '''
+        with self._lock:
+            now = time.time()
+            remaining = sum(self._seconds(s) for s in self._jobs.values())
+            rtf = self.job_realtime_factor
+            if rtf:
+                for key, started in self._in_flight.items():
+                    seconds = self._seconds(self._jobs.get(key))
+                    # never credit a job as (almost) finished
+                    remaining -= min(0.9 * seconds, (now - started) / rtf)
+            if self.total is not None:
+                unsubmitted = self.total - self.submitted - self.skipped
+                remaining += max(0, unsubmitted) * self.mean_seconds
+        return max(0.0, remaining)
+
+    @property
+    def realtime_factor(self):
+        '''Audio seconds aligned per wall clock second (all jobs).'''
+        if self.throughput is not None: return self.throughput
+        elapsed = time.time() - self._start
+        if self.done_seconds == 0 or elapsed == 0: return None
+        return self.done_seconds / elapsed
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight)
+
+    @property
+    def queue_depth(self):
+        '''Submitted jobs that have not started yet.'''
+        return len(self._jobs) - len(self._in_flight)
+
+    @property
+    def eta(self):
+        rate = self.realtime_factor
+        if not rate: return None
+        return self.remaining_seconds / rate
+
+    @property
+    def pretty_eta(self):
+        eta = self.eta
+        if eta is None: return 'N/A'
+        return seconds_to_dd_hh_mm_ss(eta)
+
+    @property
+    def percentage_done(self):
+        '''Share of the audio seconds that has been aligned.'''
+        if not self.total: return 0
+        total = self.done_seconds + self.remaining_seconds
+        # nothing to align (e.g. every job was skipped)
+        if total == 0: return self.skipped / self.total * 100
+        return self.done_seconds / total * 100
+
+    def _seconds(self, seconds):
+        if seconds is None: return self.mean_seconds
+        return seconds
+
+    def _ewma(self, value, sample):
+        if value is None: return sample
+        return self.alpha * sample + (1 - self.alpha) * value
+
+def process_context():
+    '''Multiprocessing context for process pools started from threaded
+    code: forkserver where available, else spawn. A fork would copy the
+    locks other threads hold (e.g. of the requests session or a logging
+    handler) into the child, where nobody ever releases them.
+    '''
+    import multiprocessing
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
 def seconds_to_dd_hh_mm_ss(seconds):
     seconds = int(seconds)
 